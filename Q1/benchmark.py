@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Windows: không đo được bộ nhớ đỉnh
+    resource = None
+
+from carve_index import read_index
+from formats import FORMAT_REGISTRY
+from synthetic import parse_size, read_manifest
+from telemetry import ScanMetrics
+
+# Ngưỡng mặc định khi so sánh với kết quả cũ: tốc độ/bộ nhớ được phép kém
+# đi 10%, độ chính xác và độ phủ không được giảm
+SPEED_TOLERANCE = 0.10
+ACCURACY_TOLERANCE = 0.0
+
+
+def _peak_rss():
+    """Bộ nhớ đỉnh (byte) của tiến trình hiện tại và các tiến trình con"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux trả về KB, macOS trả về byte
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_recovery(task):
+    """
+    Chạy ImageRecovery.build_index trong một tiến trình riêng để bộ nhớ đỉnh
+    chỉ phản ánh lượt quét. Trả về (thời gian, bộ nhớ đỉnh, các mục chỉ
+    mục, số liệu theo giai đoạn)
+    """
+    module, volume_path, options = task
+    recovery_cls = importlib.import_module(module).ImageRecovery
+    metrics = ScanMetrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, 'index.jsonl')
+        with contextlib.redirect_stdout(io.StringIO()):
+            began = time.perf_counter()
+            recovery_cls(volume_path, metrics=metrics,
+                         **options).build_index(index_path)
+            seconds = time.perf_counter() - began
+        return (seconds, _peak_rss(), read_index(index_path),
+                metrics.to_dict())
+
+
+def score(records, manifest, dedup=False):
+    """
+    So sánh các mục phục hồi được với manifest. Một mục đúng khi trùng vị
+    trí bắt đầu và nội dung (SHA-256) với một ảnh trong manifest; mồi nhử
+    không được tính, bản sao không được tính khi bật dedup.
+    Trả về precision, recall tổng và recall theo từng định dạng
+    """
+    truth = {(entry['offset'], entry['sha256']): entry
+             for entry in manifest
+             if not entry['decoy'] and
+             not (dedup and entry['duplicate_of'] is not None)}
+    found = {key for key in ((record['offset'], record['sha256'])
+                             for record in records) if key in truth}
+
+    per_type = {}
+    for key, entry in truth.items():
+        groups = [entry['type']]
+        if len(entry['fragments']) > 1:
+            groups.append('fragmented')
+        for group in groups:
+            stats = per_type.setdefault(group, {'expected': 0, 'found': 0})
+            stats['expected'] += 1
+            stats['found'] += key in found
+    for stats in per_type.values():
+        stats['recall'] = stats['found'] / stats['expected']
+
+    return {
+        'recovered': len(records),
+        'expected': len(truth),
+        'true_positives': len(found),
+        'precision': len(found) / len(records) if records else 1.0,
+        'recall': len(found) / len(truth) if truth else 1.0,
+        'per_type': per_type
+    }
+
+
+def run_benchmark(volume_path, manifest_path=None, module='recovery',
+                  options=None):
+    """
+    Đo tốc độ (MB/s), bộ nhớ đỉnh, precision và recall của ImageRecovery
+    (lấy từ module) trên một volume tổng hợp có manifest. Mặc định quét mọi
+    định dạng trong FORMAT_REGISTRY (volume tổng hợp chứa đủ các định
+    dạng), không phải FORMATS của module
+    """
+    options = dict(options or {})
+    options.setdefault('formats', FORMAT_REGISTRY.names())
+    manifest_path = manifest_path or volume_path + '.manifest.jsonl'
+    # spawn: tiến trình đo không thừa hưởng bộ nhớ của tiến trình hiện tại
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        seconds, peak_rss, records, metrics = executor.submit(
+            _run_recovery, (module, os.path.abspath(volume_path),
+                            options)).result()
+
+    size = os.path.getsize(volume_path)
+    report = {
+        'volume': volume_path,
+        'size': size,
+        'module': module,
+        'options': options,
+        'seconds': seconds,
+        'mb_per_s': size / (1 << 20) / seconds if seconds else None,
+        'peak_rss_mb': None if peak_rss is None else peak_rss / (1 << 20),
+        'metrics': metrics
+    }
+    report.update(score(records, read_manifest(manifest_path),
+                        options.get('dedup', False)))
+    return report
+
+
+def compare(report, baseline, speed_tolerance=SPEED_TOLERANCE,
+            accuracy_tolerance=ACCURACY_TOLERANCE):
+    """
+    So sánh với kết quả của một lần đo trước, trả về danh sách các suy giảm
+    (rỗng nếu không có)
+    """
+    regressions = []
+    if (report['mb_per_s'] and baseline.get('mb_per_s') and
+            report['mb_per_s'] < baseline['mb_per_s'] * (1 - speed_tolerance)):
+        regressions.append(f"Tốc độ: {report['mb_per_s']:.1f} MB/s "
+                           f"(trước đó {baseline['mb_per_s']:.1f} MB/s)")
+    if (report['peak_rss_mb'] and baseline.get('peak_rss_mb') and
+            report['peak_rss_mb'] >
+            baseline['peak_rss_mb'] * (1 + speed_tolerance)):
+        regressions.append(f"Bộ nhớ đỉnh: {report['peak_rss_mb']:.1f} MB "
+                           f"(trước đó {baseline['peak_rss_mb']:.1f} MB)")
+    for metric in ('precision', 'recall'):
+        if report[metric] < baseline[metric] - accuracy_tolerance:
+            regressions.append(f"{metric}: {report[metric]:.4f} "
+                               f"(trước đó {baseline[metric]:.4f})")
+    return regressions
+
+
+def print_report(report):
+    """In kết quả đo"""
+    print(f"Volume: {report['volume']} ({report['size'] / (1 << 20):.0f} MB)")
+    print(f"Thời gian: {report['seconds']:.2f}s "
+          f"({report['mb_per_s']:.1f} MB/s)")
+    if report['peak_rss_mb'] is not None:
+        print(f"Bộ nhớ đỉnh: {report['peak_rss_mb']:.1f} MB")
+    print(f"Phục hồi {report['recovered']} / {report['expected']} ảnh, "
+          f"đúng {report['true_positives']}")
+    print(f"Precision: {report['precision']:.4f}, "
+          f"recall: {report['recall']:.4f}")
+    for group, stats in sorted(report['per_type'].items()):
+        print(f"  {group}: {stats['found']} / {stats['expected']} "
+              f"({stats['recall']:.4f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Đo tốc độ và độ chính xác của ImageRecovery trên "
+                    "volume tổng hợp (tạo bằng synthetic.py)")
+    parser.add_argument('volume')
+    parser.add_argument('--manifest', help="Mặc định: "
+                        "<volume>.manifest.jsonl")
+    parser.add_argument('--module', default='recovery',
+                        help="Module chứa lớp ImageRecovery (recovery, test)")
+    parser.add_argument('--formats',
+                        help="Các định dạng, vd: jpg,png (mặc định: mọi "
+                             "định dạng trong registry)")
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--window-size')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--alignment', type=int)
+    parser.add_argument('--dedup', action='store_true')
+    parser.add_argument('--deep-validate', action='store_true')
+    parser.add_argument('--fragments', action='store_true',
+                        help="Ghép ảnh bị chia thành hai mảnh")
+    parser.add_argument('--cluster-size', type=int)
+    parser.add_argument('--prefilter', action='store_true',
+                        help="Lọc ứng viên bằng NumPy")
+    parser.add_argument('--output', help="Ghi kết quả ra tập tin JSON")
+    parser.add_argument('--baseline',
+                        help="Kết quả JSON của lần đo trước để so sánh")
+    args = parser.parse_args()
+
+    options = {'streaming': args.streaming, 'workers': args.workers,
+               'alignment': args.alignment, 'dedup': args.dedup,
+               'deep_validate': args.deep_validate,
+               'fragments': args.fragments,
+               'cluster_size': args.cluster_size,
+               'prefilter': args.prefilter}
+    if args.window_size:
+        options['window_size'] = parse_size(args.window_size)
+    if args.formats:
+        options['formats'] = args.formats.split(',')
+    report = run_benchmark(args.volume, args.manifest, args.module, options)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f))
+        for regression in regressions:
+            print(f"Suy giảm - {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
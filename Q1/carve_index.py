@@ -0,0 +1,86 @@
+import json
+import struct
+
+# Định dạng chỉ mục: JSON Lines (dễ đọc) hoặc bảng nhị phân kích thước cố định
+INDEX_FORMATS = ('jsonl', 'binary')
+
+# Bảng nhị phân: magic + các bản ghi
+# (id, offset, length, file_type, level, sha256, split, gap).
+# Ảnh ghép từ hai mảnh: mảnh đầu dài split byte, mảnh sau bắt đầu sau
+# khoảng trống gap byte; split = 0 với ảnh liền mạch
+INDEX_MAGIC = b'CARVIDX2'
+_RECORD = struct.Struct('<QQQ8sB32sQQ')
+
+# Phiên bản cũ (không có thông tin mảnh) vẫn đọc được
+_INDEX_MAGIC_V1 = b'CARVIDX1'
+_RECORD_V1 = struct.Struct('<QQQ8sB32s')
+
+
+def write_index(path, records, index_format='jsonl'):
+    """
+    Ghi các bản ghi chỉ mục (dict gồm id, offset, length, type, level,
+    sha256 và fragments nếu ảnh bị phân mảnh) ra tập tin.
+    Trả về số bản ghi đã ghi
+    """
+    if index_format not in INDEX_FORMATS:
+        raise ValueError(f"Định dạng chỉ mục không hỗ trợ: {index_format}")
+
+    count = 0
+    with open(path, 'wb') as f:
+        if index_format == 'binary':
+            f.write(INDEX_MAGIC)
+        for record in records:
+            if index_format == 'jsonl':
+                f.write(json.dumps(record).encode() + b'\n')
+            else:
+                split, gap = _split_gap(record)
+                f.write(_RECORD.pack(record['id'], record['offset'],
+                                     record['length'], record['type'].encode(),
+                                     record['level'],
+                                     bytes.fromhex(record['sha256']),
+                                     split, gap))
+            count += 1
+    return count
+
+
+def _split_gap(record):
+    """Mô tả các mảnh của bản ghi bằng (split, gap) cho bảng nhị phân"""
+    fragments = record.get('fragments')
+    if not fragments:
+        return 0, 0
+    if len(fragments) != 2:
+        raise ValueError("Chỉ mục nhị phân chỉ hỗ trợ ảnh gồm tối đa hai mảnh")
+    (first, split), (second, _) = fragments
+    return split, second - first - split
+
+
+def read_index(path):
+    """Đọc chỉ mục (tự nhận dạng JSON Lines hoặc nhị phân)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data.startswith(INDEX_MAGIC):
+        rows = _RECORD.iter_unpack(data[len(INDEX_MAGIC):])
+    elif data.startswith(_INDEX_MAGIC_V1):
+        rows = (fields + (0, 0) for fields in
+                _RECORD_V1.iter_unpack(data[len(_INDEX_MAGIC_V1):]))
+    else:
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    records = []
+    for fields in rows:
+        record_id, offset, length, file_type, level, digest, split, gap = \
+            fields
+        record = {
+            'id': record_id,
+            'offset': offset,
+            'length': length,
+            'type': file_type.rstrip(b'\0').decode(),
+            'level': level,
+            'sha256': digest.hex()
+        }
+        if split:
+            record['fragments'] = [[offset, split],
+                                   [offset + split + gap, length - split]]
+        records.append(record)
+    return records
@@ -0,0 +1,622 @@
+import os
+import re
+import struct
+import zlib
+
+
+class VolumeReader:
+    """
+    Đọc ngẫu nhiên trên volume (tập tin đang mở hoặc bytes trong bộ nhớ).
+    Với tập tin, dữ liệu được đọc theo khối và giữ lại khối gần nhất để các
+    lần đọc nhỏ liên tiếp của bộ carver không phải gọi hệ thống mỗi lần
+    """
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._data = source
+            self._file = None
+            self.size = len(source)
+        else:
+            self._data = None
+            self._file = source
+            self.size = os.fstat(source.fileno()).st_size
+        self._block_start = 0
+        self._block = b''
+
+    def read(self, offset, size):
+        """Đọc tối đa size byte tại offset"""
+        if self._data is not None:
+            return bytes(self._data[offset:offset + size])
+
+        rel = offset - self._block_start
+        if 0 <= rel and rel + size <= len(self._block):
+            return self._block[rel:rel + size]
+        if size > self.BLOCK_SIZE:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+        self._file.seek(offset)
+        self._block = self._file.read(self.BLOCK_SIZE)
+        self._block_start = offset
+        return self._block[:size]
+
+    def view(self, offset, size):
+        """
+        Như read nhưng không sao chép khi volume nằm trong bộ nhớ
+        (trả về memoryview trỏ vào dữ liệu volume)
+        """
+        if self._data is not None:
+            return memoryview(self._data)[offset:offset + size]
+        return self.read(offset, size)
+
+    def search(self, regex, start, stop=None, overlap=1):
+        """
+        Tìm regex từ start đến stop, trả về vị trí tuyệt đối hoặc -1.
+        overlap: độ dài tối đa của một lần khớp trừ 1
+        """
+        if stop is None or stop > self.size:
+            stop = self.size
+        if self._data is not None:
+            match = regex.search(self._data, start, stop)
+            return -1 if match is None else match.start()
+
+        pos = start
+        while pos < stop:
+            chunk = self.read(pos, min(self.BLOCK_SIZE, stop - pos))
+            if not chunk:
+                break
+            match = regex.search(chunk)
+            if match is not None:
+                return pos + match.start()
+            if len(chunk) <= overlap:
+                break
+            pos += len(chunk) - overlap
+        return -1
+
+
+# Marker JPEG thực sự trong dữ liệu nén: FF không theo sau bởi 00 (byte
+# stuffing), RST0-7 hoặc FF (byte đệm)
+_JPEG_MARKER = re.compile(b'\xFF[^\x00\xD0-\xD7\xFF]')
+
+
+def carve_jpeg(reader, start, max_size=None):
+    """
+    Xác định điểm kết thúc của JPEG bắt đầu tại start bằng cách đi theo
+    các segment (dùng trường độ dài) đến SOS, sau đó quét dữ liệu nén để tìm
+    marker kế tiếp. Thumbnail nhúng trong APP1 bị bỏ qua cùng segment chứa nó.
+    Trả về vị trí ngay sau EOI, hoặc None nếu cấu trúc không hợp lệ
+    """
+    limit = reader.size if max_size is None else min(reader.size,
+                                                     start + max_size)
+    if reader.read(start, 2) != b'\xFF\xD8':
+        return None
+
+    pos = start + 2
+    seen_frame = seen_scan = False
+    while pos + 2 <= limit:
+        header = reader.read(pos, 2)
+        if header[0] != 0xFF:
+            return None
+        marker = header[1]
+
+        if marker == 0xD9:
+            # EOI chỉ hợp lệ sau khi đã có dữ liệu ảnh
+            return pos + 2 if seen_scan else None
+        if marker == 0xFF:
+            # Byte đệm trước marker
+            pos += 1
+            continue
+        if marker < 0xC0 or marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            return None
+
+        if pos + 4 > limit:
+            return None
+        length = struct.unpack('>H', reader.read(pos + 2, 2))[0]
+        if length < 2:
+            return None
+        pos += 2 + length
+
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            seen_frame = True
+        elif marker == 0xDA:
+            if not seen_frame:
+                return None
+            seen_scan = True
+            # Dữ liệu nén: tìm marker thật kế tiếp (EOI, DHT, SOS tiếp theo...)
+            pos = reader.search(_JPEG_MARKER, pos, limit)
+            if pos == -1:
+                return None
+
+    return None
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _crc_range(reader, crc, start, length):
+    """Tính CRC32 nối tiếp trên đoạn [start, start + length) theo từng khối"""
+    pos, end = start, start + length
+    while pos < end:
+        block = reader.read(pos, min(reader.BLOCK_SIZE, end - pos))
+        if not block:
+            break
+        crc = zlib.crc32(block, crc)
+        pos += len(block)
+    return crc
+
+
+def _walk_png(reader, pos, limit, seen_idat=False, first=False):
+    """
+    Đi theo chuỗi chunk PNG từ pos, kiểm tra CRC của từng chunk.
+    Trả về (end, pos, seen_idat): end là vị trí ngay sau IEND hoặc None nếu
+    gặp chunk hỏng, khi đó pos là vị trí của chunk hỏng đầu tiên
+    """
+    while pos + 12 <= limit:
+        length, chunk_type = struct.unpack('>I4s', reader.read(pos, 8))
+        if length > 0x7FFFFFFF or not chunk_type.isalpha():
+            return None, pos, seen_idat
+        if first and (chunk_type != b'IHDR' or length != 13):
+            return None, pos, seen_idat
+
+        end = pos + 12 + length
+        if end > limit:
+            return None, pos, seen_idat
+        crc = _crc_range(reader, zlib.crc32(chunk_type), pos + 8, length)
+        if struct.unpack('>I', reader.read(pos + 8 + length, 4))[0] != crc:
+            return None, pos, seen_idat
+
+        first = False
+        if chunk_type == b'IDAT':
+            seen_idat = True
+        elif chunk_type == b'IEND':
+            return (end if seen_idat else None), pos, seen_idat
+        pos = end
+
+    return None, pos, seen_idat
+
+
+def carve_png(reader, start, max_size=None):
+    """
+    Xác định điểm kết thúc của PNG bằng cách đi theo chuỗi chunk
+    (độ dài + kiểu + dữ liệu + CRC) từ chữ ký đến IEND. CRC của từng chunk
+    được kiểm tra ngay khi đọc; chunk đầu tiên phải là IHDR và phải có IDAT
+    trước IEND. Trả về vị trí ngay sau IEND, hoặc None nếu gặp chunk hỏng
+    """
+    limit = reader.size if max_size is None else min(reader.size,
+                                                     start + max_size)
+    if reader.read(start, 8) != PNG_SIGNATURE:
+        return None
+    return _walk_png(reader, start + 8, limit, first=True)[0]
+
+
+# Kích thước hợp lệ của DIB header trong BMP
+BMP_DIB_SIZES = (12, 40, 52, 56, 64, 108, 124)
+
+
+def carve_bmp(reader, start, max_size=None):
+    """
+    Lấy kích thước BMP từ BITMAPFILEHEADER. Các trường reserved, offset dữ
+    liệu điểm ảnh và DIB header được kiểm tra để loại bỏ ngay các chữ ký 'BM'
+    ngẫu nhiên. Trả về vị trí kết thúc, hoặc None nếu header không hợp lệ
+    """
+    header = reader.read(start, 30)
+    if len(header) < 30 or header[:2] != b'BM':
+        return None
+    size, reserved1, reserved2, pixel_offset, dib_size = \
+        struct.unpack('<IHHII', header[2:18])
+    if reserved1 or reserved2 or dib_size not in BMP_DIB_SIZES:
+        return None
+    if not 14 + dib_size <= pixel_offset < size:
+        return None
+    if max_size is not None and size > max_size:
+        return None
+    if start + size > reader.size:
+        return None
+
+    if dib_size == 12:
+        planes, bpp = struct.unpack('<HH', header[22:26])
+    else:
+        width, height, planes, bpp = struct.unpack('<iiHH',
+                                                   reader.read(start + 18, 12))
+        if width <= 0 or height == 0:
+            return None
+    if planes != 1 or bpp not in (1, 4, 8, 16, 24, 32):
+        return None
+    return start + size
+
+
+def carve_webp(reader, start, max_size=None):
+    """
+    Lấy kích thước WEBP từ độ dài chunk RIFF, sau khi kiểm tra dạng 'WEBP'
+    và chunk đầu tiên (VP8, VP8L hoặc VP8X)
+    """
+    header = reader.read(start, 16)
+    if len(header) < 16 or header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+        return None
+    if header[12:16] not in (b'VP8 ', b'VP8L', b'VP8X'):
+        return None
+    size = struct.unpack('<I', header[4:8])[0]
+    # Chunk RIFF được đệm đến độ dài chẵn
+    end = start + 8 + size + (size & 1)
+    if size < 12 or end > reader.size:
+        return None
+    if max_size is not None and end - start > max_size:
+        return None
+    return end
+
+
+def _skip_sub_blocks(reader, pos, limit):
+    """Bỏ qua chuỗi sub-block của GIF, trả về vị trí sau block kết thúc (0)"""
+    while pos < limit:
+        length = reader.read(pos, 1)
+        if not length:
+            return None
+        pos += 1 + length[0]
+        if length[0] == 0:
+            return pos
+    return None
+
+
+def carve_gif(reader, start, max_size=None):
+    """
+    Xác định điểm kết thúc của GIF bằng cách đi qua bảng màu, các image
+    descriptor, extension và sub-block đến trailer (0x3B).
+    Trả về vị trí ngay sau trailer, hoặc None nếu cấu trúc không hợp lệ
+    """
+    limit = reader.size if max_size is None else min(reader.size,
+                                                     start + max_size)
+    header = reader.read(start, 13)
+    if len(header) < 13 or header[:6] not in (b'GIF87a', b'GIF89a'):
+        return None
+    width, height, packed = struct.unpack('<HHB', header[6:11])
+    if width == 0 or height == 0:
+        return None
+
+    pos = start + 13
+    if packed & 0x80:
+        pos += 3 << ((packed & 0x07) + 1)
+
+    seen_image = False
+    while pos < limit:
+        block = reader.read(pos, 1)
+        if not block:
+            return None
+        if block == b'\x3B':
+            return pos + 1 if seen_image else None
+
+        if block == b'\x21':
+            # Extension: nhãn + các sub-block
+            pos = _skip_sub_blocks(reader, pos + 2, limit)
+        elif block == b'\x2C':
+            descriptor = reader.read(pos + 1, 10)
+            if len(descriptor) < 10:
+                return None
+            packed = descriptor[8]
+            pos += 10
+            if packed & 0x80:
+                pos += 3 << ((packed & 0x07) + 1)
+            # Kích thước mã LZW tối thiểu, sau đó là dữ liệu ảnh
+            code_size = reader.read(pos, 1)
+            if not code_size or not 1 <= code_size[0] <= 12:
+                return None
+            pos = _skip_sub_blocks(reader, pos + 1, limit)
+            seen_image = True
+        else:
+            return None
+
+        if pos is None:
+            return None
+    return None
+
+
+class StitchedReader(VolumeReader):
+    """
+    Reader ảo ghép hai mảnh của một tập tin bị phân mảnh: dữ liệu trước vị
+    trí split giữ nguyên, từ split trở đi được đọc lệch gap byte (bỏ qua
+    khoảng trống giữa hai mảnh). Các carver dùng được như với VolumeReader
+    """
+
+    def __init__(self, reader, split, gap):
+        self._data = None
+        self._reader = reader
+        self.split = split
+        self.gap = gap
+        self.size = reader.size - gap
+
+    def read(self, offset, size):
+        if offset >= self.split:
+            return self._reader.read(offset + self.gap, size)
+        if offset + size <= self.split:
+            return self._reader.read(offset, size)
+        return (self._reader.read(offset, self.split - offset) +
+                self._reader.read(self.split + self.gap,
+                                  offset + size - self.split))
+
+
+def _cluster_boundaries(first, last, cluster_size):
+    """Các ranh giới cluster b với first <= b <= last"""
+    return range(first + (-first % cluster_size), last + 1, cluster_size)
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+# _CRC_SHIFTS[k]: ma trận đưa một CRC qua 2^k byte 0 (tính dần khi cần)
+_CRC_SHIFTS = []
+
+
+def _crc_shift_matrix(k):
+    if not _CRC_SHIFTS:
+        # Toán tử cho một bit 0, bình phương ba lần thành một byte 0
+        matrix = [0xEDB88320] + [1 << n for n in range(31)]
+        for _ in range(3):
+            matrix = _gf2_square(matrix)
+        _CRC_SHIFTS.append(matrix)
+    while len(_CRC_SHIFTS) <= k:
+        _CRC_SHIFTS.append(_gf2_square(_CRC_SHIFTS[-1]))
+    return _CRC_SHIFTS[k]
+
+
+def _crc32_combine(crc1, crc2, length2):
+    """
+    CRC32 của A + B từ CRC32 của A, của B và độ dài B (như crc32_combine
+    của zlib) mà không phải đọc lại A
+    """
+    k = 0
+    while length2:
+        if length2 & 1:
+            crc1 = _gf2_times(_crc_shift_matrix(k), crc1)
+        length2 >>= 1
+        k += 1
+    return crc1 ^ crc2
+
+
+def _png_header_ok(header, first=False):
+    """Header chunk (độ dài + kiểu) có hợp lý không"""
+    if len(header) < 8:
+        return False
+    length, chunk_type = struct.unpack('>I4s', header)
+    if length > 0x7FFFFFFF or not chunk_type.isalpha():
+        return False
+    return not first or (chunk_type == b'IHDR' and length == 13)
+
+
+def carve_png_fragments(reader, start, cluster_size, max_gap, max_size=None):
+    """
+    Ghép PNG bị chia thành hai mảnh (bifragment gap carving). Mảnh thứ nhất
+    kết thúc tại một ranh giới cluster b trong chunk hỏng đầu tiên, mảnh thứ
+    hai bắt đầu sau khoảng trống g (bội số của cluster_size, tối đa
+    max_gap). Với mỗi g, header của chunk kế tiếp được kiểm tra trước; chỉ
+    khi hợp lý mới tính CRC của chunk bị cắt (ghép CRC của hai phần, không
+    đọc lại) cho từng b, rồi mới đi tiếp phần còn lại của tập tin.
+    Trả về [(start, b), (b + g, end)] với g nhỏ nhất, hoặc None
+    """
+    if reader.read(start, 8) != PNG_SIGNATURE:
+        return None
+    end, pos, seen_idat = _walk_png(reader, start + 8, reader.size,
+                                    first=True)
+    if end is not None:
+        return None
+    first = pos == start + 8
+
+    def logical_limit(stitched):
+        if max_size is None:
+            return stitched.size
+        return min(stitched.size, start + max_size)
+
+    header = reader.read(pos, 8)
+    if not _png_header_ok(header, first):
+        # Điểm cắt nằm trong header của chunk hỏng
+        for gap in range(cluster_size, max_gap + 1, cluster_size):
+            for split in _cluster_boundaries(max(pos, start + 1), pos + 7,
+                                             cluster_size):
+                stitched = StitchedReader(reader, split, gap)
+                end = _walk_png(stitched, pos, logical_limit(stitched),
+                                seen_idat, first)[0]
+                if end is not None:
+                    return [(start, split), (split + gap, end + gap)]
+        return None
+
+    # Header còn nguyên nhưng CRC sai: điểm cắt nằm trong dữ liệu hoặc CRC
+    length, chunk_type = struct.unpack('>I4s', header)
+    crc_pos = pos + 8 + length
+    chunk_end = crc_pos + 4
+    splits = _cluster_boundaries(max(pos + 8, start + 1),
+                                 min(chunk_end - 1, reader.size),
+                                 cluster_size)
+    if not splits:
+        return None
+    prefix = {}
+    for gap in range(cluster_size, max_gap + 1, cluster_size):
+        if chunk_end + gap > reader.size:
+            break
+        if (chunk_type != b'IEND' and
+                not _png_header_ok(reader.read(chunk_end + gap, 8))):
+            continue
+
+        if not prefix:
+            # CRC của phần đầu chunk (kiểu + dữ liệu) đến từng điểm cắt
+            crc, last = 0, pos + 4
+            for split in splits:
+                stop = min(split, crc_pos)
+                crc = _crc_range(reader, crc, last, stop - last)
+                prefix[split] = crc
+                last = stop
+        # CRC của từng đoạn [b + g, crc_pos + g), tính từ cuối chunk
+        suffix = {}
+        crc, length_after, last = 0, 0, crc_pos
+        for split in reversed(splits):
+            if split < crc_pos:
+                piece = _crc_range(reader, 0, split + gap, last - split)
+                crc = _crc32_combine(piece, crc, length_after)
+                length_after += last - split
+                last = split
+            suffix[split] = (crc, length_after)
+
+        for split in splits:
+            stitched = StitchedReader(reader, split, gap)
+            crc = _crc32_combine(prefix[split], *suffix[split])
+            if struct.unpack('>I', stitched.read(crc_pos, 4))[0] != crc:
+                continue
+            if chunk_type == b'IEND':
+                end = chunk_end if seen_idat else None
+            else:
+                end = _walk_png(stitched, chunk_end, logical_limit(stitched),
+                                seen_idat or chunk_type == b'IDAT')[0]
+            if end is not None:
+                return [(start, split), (split + gap, end + gap)]
+    return None
+
+
+# Mọi marker trong dữ liệu nén, kể cả restart marker (RST0-7)
+_JPEG_ANY_MARKER = re.compile(b'\xFF[^\x00\xFF]')
+
+# Một dãy dài các byte giống nhau (thường là byte 0 của vùng trống) không
+# xuất hiện trong dữ liệu nén entropy
+_CONSTANT_RUN = re.compile(rb'(.)\1{31}', re.DOTALL)
+
+# Khoảng cách tối đa giữa hai restart marker: 8 lần khoảng cách lớn nhất đã
+# gặp, nhưng không nhỏ hơn giá trị này
+_RESTART_WINDOW = 64 * 1024
+
+
+def _jpeg_scan_start(reader, start, limit):
+    """
+    Đi theo các segment từ SOI đến SOS đầu tiên. Trả về (vị trí bắt đầu dữ
+    liệu nén, restart interval khai báo trong DRI, số MCU của ảnh theo SOF
+    baseline hoặc None) hoặc None
+    """
+    if reader.read(start, 2) != b'\xFF\xD8':
+        return None
+    pos = start + 2
+    interval = 0
+    mcus = None
+    while pos + 4 <= limit:
+        prefix, marker, length = struct.unpack('>BBH', reader.read(pos, 4))
+        if prefix != 0xFF:
+            return None
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker < 0xC0 or marker in (0xD8, 0xD9) or length < 2:
+            return None
+        if marker == 0xDD:
+            interval = struct.unpack('>H', reader.read(pos + 4, 2))[0]
+        elif marker in (0xC0, 0xC1):
+            mcus = _jpeg_mcu_count(reader.read(pos + 4, length - 2))
+        pos += 2 + length
+        if marker == 0xDA:
+            return pos, interval, mcus
+    return None
+
+
+def _jpeg_mcu_count(sof):
+    """Số MCU của một scan baseline từ nội dung segment SOF"""
+    if len(sof) < 6:
+        return None
+    height, width, components = struct.unpack('>HHB', sof[1:6])
+    sampling = sof[6:6 + 3 * components][1::3]
+    if not height or not width or len(sampling) != components:
+        return None
+    if components == 1:
+        # Scan một thành phần không xen kẽ: mỗi MCU là một block 8x8
+        return -(-width // 8) * -(-height // 8)
+    h_max = max(factor >> 4 for factor in sampling)
+    v_max = max(factor & 0x0F for factor in sampling)
+    if not h_max or not v_max:
+        return None
+    return -(-width // (8 * h_max)) * -(-height // (8 * v_max))
+
+
+def _walk_restarts(reader, pos, limit, count=0, longest=0):
+    """
+    Đi qua dữ liệu nén từ pos (ngay sau SOS hoặc một RST). Các RST phải
+    xuất hiện đúng thứ tự RST0..RST7 và cách nhau không quá cửa sổ cho
+    phép. Trả về (end, pos, anomaly, count, longest): end là vị trí ngay
+    sau EOI, hoặc None khi gặp bất thường tại anomaly; pos là vị trí ngay
+    sau RST hợp lệ cuối cùng; count là số RST đã đi qua
+    """
+    while True:
+        stop = min(limit, pos + max(8 * longest, _RESTART_WINDOW))
+        found = reader.search(_JPEG_ANY_MARKER, pos, stop)
+        if found == -1:
+            return None, pos, stop, count, longest
+        marker = reader.read(found + 1, 1)[0]
+        if marker == 0xD9:
+            return found + 2, pos, found, count, longest
+        if marker != 0xD0 + count % 8:
+            return None, pos, found, count, longest
+        longest = max(longest, found - pos)
+        count += 1
+        pos = found + 2
+
+
+def carve_jpeg_fragments(reader, start, cluster_size, max_gap,
+                         max_size=None):
+    """
+    Ghép JPEG bị chia thành hai mảnh, dựa vào restart marker: điểm cắt là
+    một ranh giới cluster b giữa RST hợp lệ cuối cùng và vị trí bất thường
+    đầu tiên (RST sai thứ tự, marker lạ hoặc quá xa RST trước). Với mỗi
+    khoảng trống g, marker đầu tiên sau b + g phải là RST kế tiếp (hoặc EOI)
+    và không có dãy byte hằng nào xen vào trước khi đi tiếp phần còn lại;
+    tập tin ghép phải có đúng số RST suy ra từ kích thước ảnh (SOF) và
+    restart interval, rồi được kiểm tra lại bằng carve_jpeg.
+    JPEG không có restart marker hoặc không phải baseline không xác định
+    được điểm cắt nên không được ghép.
+    Trả về [(start, b), (b + g, end)] với b lớn nhất rồi g nhỏ nhất, hoặc None
+    """
+    scan = _jpeg_scan_start(reader, start, reader.size)
+    if scan is None or not scan[1] or not scan[2]:
+        return None
+    data_start, interval, mcus = scan
+    restarts = -(-mcus // interval) - 1
+    end, last_good, anomaly, count, longest = _walk_restarts(
+        reader, data_start, reader.size)
+    if end is not None:
+        return None
+
+    # Marker bất thường có thể nằm vắt qua điểm cắt (FF cuối mảnh đầu); vùng
+    # byte hằng sau RST cuối chắc chắn không thuộc ảnh
+    last_split = min(anomaly + 1, reader.size)
+    run = reader.search(_CONSTANT_RUN, last_good, last_split, overlap=31)
+    if run != -1:
+        last_split = run
+    window = max(8 * longest, _RESTART_WINDOW)
+    for split in reversed(_cluster_boundaries(max(last_good, start + 1),
+                                              last_split, cluster_size)):
+        for gap in range(cluster_size, max_gap + 1, cluster_size):
+            resume = split + gap
+            if resume >= reader.size:
+                break
+            found = reader.search(_JPEG_ANY_MARKER, resume,
+                                  resume + window - (split - last_good))
+            if found == -1:
+                continue
+            marker = reader.read(found + 1, 1)[0]
+            if marker not in (0xD0 + count % 8, 0xD9):
+                continue
+            if reader.search(_CONSTANT_RUN, resume, found, overlap=31) != -1:
+                continue
+
+            stitched = StitchedReader(reader, split, gap)
+            limit = stitched.size if max_size is None else \
+                min(stitched.size, start + max_size)
+            end, _, _, total, _ = _walk_restarts(stitched, last_good, limit,
+                                                 count, longest)
+            if (end is not None and total == restarts and
+                    carve_jpeg(stitched, start, max_size) == end):
+                return [(start, split), (split + gap, end + gap)]
+    return None
@@ -0,0 +1,279 @@
+import struct
+from matcher import SignatureMatcher, has_bytes, header_field, field_in
+from carvers import (carve_jpeg, carve_png, carve_gif, carve_bmp, carve_webp,
+                     carve_jpeg_fragments, carve_png_fragments, BMP_DIB_SIZES)
+
+
+class ImageFormat:
+    """
+    Một định dạng có thể phục hồi (plugin của FormatRegistry):
+    name: tên định dạng, cũng là phần mở rộng của tập tin phục hồi;
+    signatures: các chuỗi byte mở đầu tập tin;
+    footer: EOF marker, tập tin kết thúc tại marker đầu tiên sau chữ ký;
+    carver: carver(reader, start, max_size) trả về điểm kết thúc theo cấu
+    trúc hoặc kích thước khai báo trong header (được ưu tiên hơn footer);
+    max_size: kích thước tối đa (bắt buộc nếu không có footer và carver,
+    khi đó tập tin được lấy đúng max_size byte);
+    validator: validator(data) kiểm tra dữ liệu ứng viên (mức 0);
+    min_size: ứng viên nhỏ hơn bị loại;
+    fragment_carver: fragment_carver(reader, start, cluster_size, max_gap,
+    max_size) ghép tập tin bị phân mảnh khi carver thất bại, trả về danh
+    sách các mảnh (start, end) hoặc None;
+    header_check: header_check(array, offsets) kiểm tra vector hóa (NumPy)
+    các trường header tại mọi vị trí chữ ký, trả về mảng bool. Chỉ được loại
+    những vị trí mà carver chắc chắn từ chối;
+    header_validator: header_validator(header) kiểm tra mức 0 trên HEADER_SIZE
+    byte đầu của ứng viên trước khi chạy carver, với cùng điều kiện như
+    header_check (header ngắn hơn cần thiết được giữ lại)
+    """
+
+    # Số byte header được đọc cho header_validator
+    HEADER_SIZE = 32
+
+    def __init__(self, name, signatures, footer=None, carver=None,
+                 max_size=None, validator=None, min_size=64,
+                 fragment_carver=None, header_check=None,
+                 header_validator=None):
+        if footer is None and carver is None and max_size is None:
+            raise ValueError(f"Định dạng {name} cần footer, carver "
+                             f"hoặc max_size")
+        self.name = name
+        self.signatures = tuple(signatures)
+        self.footer = footer
+        self.carver = carver
+        self.max_size = max_size
+        self.validator = validator
+        self.min_size = min_size
+        self.fragment_carver = fragment_carver
+        self.header_check = header_check
+        self.header_validator = header_validator
+
+    def validate(self, data):
+        """Kiểm tra mức 0: kích thước tối thiểu và validator của định dạng"""
+        if len(data) < self.min_size:
+            return False
+        return self.validator is None or self.validator(data)
+
+    def validate_header(self, header):
+        """Kiểm tra mức 0 trên header của ứng viên thô, trước carver"""
+        return self.header_validator is None or self.header_validator(header)
+
+    def __repr__(self):
+        return f"ImageFormat({self.name!r})"
+
+
+class FormatRegistry:
+    """
+    Tập các định dạng được hỗ trợ. Chữ ký của mọi định dạng (và footer của
+    các định dạng không có carver) được biên dịch một lần thành một
+    SignatureMatcher dùng chung, nên thêm định dạng không thêm lượt quét nào
+    """
+
+    def __init__(self, formats=()):
+        self._formats = {}
+        self._matcher = None
+        for image_format in formats:
+            self.register(image_format)
+
+    def register(self, image_format):
+        """Thêm (hoặc thay thế) một định dạng, trả về chính định dạng đó"""
+        self._formats[image_format.name] = image_format
+        self._matcher = None
+        return image_format
+
+    def subset(self, names):
+        """Registry mới chỉ gồm các định dạng có tên trong names"""
+        missing = [name for name in names if name not in self._formats]
+        if missing:
+            raise KeyError(f"Định dạng không được hỗ trợ: {', '.join(missing)}")
+        return FormatRegistry(self._formats[name] for name in names)
+
+    @property
+    def matcher(self):
+        """SignatureMatcher của toàn bộ registry (biên dịch khi cần lần đầu)"""
+        if self._matcher is None:
+            signatures = {name: fmt.signatures
+                          for name, fmt in self._formats.items()}
+            footers = {name: fmt.footer
+                       for name, fmt in self._formats.items()
+                       if fmt.carver is None}
+            checks = {name: fmt.header_check
+                      for name, fmt in self._formats.items()}
+            self._matcher = SignatureMatcher(signatures, footers, checks)
+        return self._matcher
+
+    def __getitem__(self, name):
+        return self._formats[name]
+
+    def __contains__(self, name):
+        return name in self._formats
+
+    def __iter__(self):
+        return iter(self._formats.values())
+
+    def __len__(self):
+        return len(self._formats)
+
+    def names(self):
+        return list(self._formats)
+
+    def __getstate__(self):
+        # Matcher được biên dịch lại ở tiến trình con khi cần
+        return {'_formats': self._formats, '_matcher': None}
+
+
+def _validate_jpeg(data):
+    # Kiểm tra cấu trúc JPEG; carve_jpeg đã xác nhận có segment SOS
+    # (dữ liệu nén) khi xác định ranh giới
+    return data[0:2] == b'\xFF\xD8' and data[-2:] == b'\xFF\xD9'
+
+
+def _validate_png(data):
+    # Kiểm tra chữ ký PNG và IEND; IHDR, IDAT và CRC của từng chunk
+    # đã được carve_png kiểm tra khi xác định ranh giới
+    return (data[:8] == b'\x89PNG\r\n\x1a\n' and
+            data[-8:] == b'IEND\xAE\x42\x60\x82')
+
+
+def _validate_gif(data):
+    # Kiểm tra chữ ký và kết thúc GIF
+    return data[:6] in (b'GIF87a', b'GIF89a') and data[-1:] == b'\x3B'
+
+
+def _validate_bmp(data):
+    return data[:2] == b'BM'
+
+
+def _validate_webp(data):
+    return data[:4] == b'RIFF' and data[8:12] == b'WEBP'
+
+
+# Kiểm tra header mức 0 (trước carver): cùng điều kiện với các hàm _check_*
+# bên dưới, trên header của một ứng viên
+
+def _header_jpeg(header):
+    return len(header) < 6 or struct.unpack('>H', header[4:6])[0] >= 2
+
+
+def _header_png(header):
+    # Chunk đầu tiên phải là IHDR dài 13 byte
+    return len(header) < 16 or header[8:16] == b'\x00\x00\x00\x0dIHDR'
+
+
+def _header_gif(header):
+    if len(header) < 13:
+        return True
+    width, height = struct.unpack('<HH', header[6:10])
+    return width != 0 and height != 0
+
+
+def _header_bmp(header):
+    if len(header) < 30:
+        return True
+    size, reserved, pixel_offset, dib_size = struct.unpack('<IIII',
+                                                          header[2:18])
+    return (reserved == 0 and dib_size in BMP_DIB_SIZES and
+            dib_size + 14 <= pixel_offset < size)
+
+
+def _header_webp(header):
+    if len(header) < 16:
+        return True
+    return (struct.unpack('<I', header[4:8])[0] >= 12 and
+            header[8:12] == b'WEBP' and
+            header[12:16] in (b'VP8 ', b'VP8L', b'VP8X'))
+
+
+# Kiểm tra header vector hóa cho bộ lọc ứng viên: mỗi hàm lặp lại các điều
+# kiện đầu tiên của carver tương ứng; vị trí thiếu byte (cuối cửa sổ) được
+# giữ lại để carver quyết định
+
+def _check_jpeg(array, offsets):
+    # Segment đầu tiên phải có độ dài >= 2
+    return (~has_bytes(array, offsets, 6) |
+            (header_field(array, offsets, 4, 2, big_endian=True) >= 2))
+
+
+def _check_gif(array, offsets):
+    # Kích thước màn hình logic khác 0
+    return (~has_bytes(array, offsets, 13) |
+            ((header_field(array, offsets, 6, 2) != 0) &
+             (header_field(array, offsets, 8, 2) != 0)))
+
+
+def _check_bmp(array, offsets):
+    # Trường reserved bằng 0, DIB header hợp lệ, offset điểm ảnh nằm giữa
+    # header và kích thước tập tin
+    size = header_field(array, offsets, 2, 4)
+    pixel_offset = header_field(array, offsets, 10, 4)
+    dib_size = header_field(array, offsets, 14, 4)
+    return (~has_bytes(array, offsets, 30) |
+            ((header_field(array, offsets, 6, 4) == 0) &
+             field_in(dib_size, BMP_DIB_SIZES) &
+             (dib_size + 14 <= pixel_offset) & (pixel_offset < size)))
+
+
+_WEBP = int.from_bytes(b'WEBP', 'big')
+_VP8_CHUNKS = [int.from_bytes(chunk, 'big')
+               for chunk in (b'VP8 ', b'VP8L', b'VP8X')]
+
+
+def _check_webp(array, offsets):
+    # RIFF phải chứa dạng WEBP, chunk đầu tiên là VP8/VP8L/VP8X
+    return (~has_bytes(array, offsets, 16) |
+            ((header_field(array, offsets, 4, 4) >= 12) &
+             (header_field(array, offsets, 8, 4, big_endian=True) == _WEBP) &
+             field_in(header_field(array, offsets, 12, 4, big_endian=True),
+                      _VP8_CHUNKS)))
+
+
+# Registry mặc định với các định dạng có sẵn; dùng register_format để thêm
+# định dạng mới
+FORMAT_REGISTRY = FormatRegistry([
+    ImageFormat('jpg',
+                signatures=(
+                    b'\xFF\xD8\xFF\xE0',  # JFIF
+                    b'\xFF\xD8\xFF\xE1',  # Exif
+                    b'\xFF\xD8\xFF\xDB',  # JPEG với bảng lượng tử hóa
+                    b'\xFF\xD8\xFF\xEE'   # JPEG với phân đoạn ứng dụng
+                ),
+                footer=b'\xFF\xD9',  # EOI marker
+                carver=carve_jpeg,
+                validator=_validate_jpeg,
+                fragment_carver=carve_jpeg_fragments,
+                header_check=_check_jpeg,
+                header_validator=_header_jpeg),
+    ImageFormat('png',
+                signatures=(b'\x89\x50\x4E\x47\x0D\x0A\x1A\x0A',),
+                footer=b'\x49\x45\x4E\x44\xAE\x42\x60\x82',  # IEND chunk
+                carver=carve_png,
+                validator=_validate_png,
+                fragment_carver=carve_png_fragments,
+                header_validator=_header_png),
+    # GIF được đi theo các block đến trailer; BMP và WEBP lấy kích thước
+    # khai báo trong header
+    ImageFormat('gif',
+                signatures=(b'GIF87a', b'GIF89a'),
+                footer=b'\x3B',
+                carver=carve_gif,
+                validator=_validate_gif,
+                header_check=_check_gif,
+                header_validator=_header_gif),
+    ImageFormat('bmp',
+                signatures=(b'BM',),
+                carver=carve_bmp,
+                validator=_validate_bmp,
+                header_check=_check_bmp,
+                header_validator=_header_bmp),
+    ImageFormat('webp',
+                signatures=(b'RIFF',),
+                carver=carve_webp,
+                validator=_validate_webp,
+                header_check=_check_webp,
+                header_validator=_header_webp)
+])
+
+
+def register_format(image_format):
+    """Thêm một định dạng vào registry mặc định"""
+    return FORMAT_REGISTRY.register(image_format)
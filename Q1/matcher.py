@@ -0,0 +1,278 @@
+import heapq
+import re
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy là phụ thuộc tùy chọn, chỉ cần cho bộ lọc ứng viên vector hóa
+    np = None
+
+# Có thể dùng bộ lọc ứng viên vector hóa (prefilter) hay không
+HAS_NUMPY = np is not None
+
+# Loại điểm khớp: chữ ký đầu tập tin hoặc marker kết thúc
+HEADER = 'header'
+FOOTER = 'footer'
+
+# Một điểm khớp trong volume: vị trí tuyệt đối, loại, định dạng và chuỗi byte
+Hit = namedtuple('Hit', ['offset', 'kind', 'file_type', 'pattern'])
+
+
+class SignatureMatcher:
+    """
+    Bộ so khớp một lượt cho tất cả chữ ký và EOF marker.
+    Toàn bộ mẫu được biên dịch thành một automaton duy nhất (regex dạng
+    phép hợp), nên mỗi byte của volume chỉ được duyệt một lần bất kể số
+    lượng định dạng hỗ trợ. Kết quả là dòng Hit đã sắp xếp theo vị trí.
+    """
+
+    # Số byte được so khớp vector hóa mỗi lần (giới hạn bộ nhớ tạm)
+    VECTOR_BLOCK = 4 * 1024 * 1024
+
+    def __init__(self, signatures, eof_markers, header_checks=None):
+        # Mỗi chuỗi byte có thể thuộc nhiều định dạng/vai trò (vd: b'WEBP')
+        self.patterns = {}
+        for file_type, sigs in signatures.items():
+            for sig in sigs:
+                self.patterns.setdefault(sig, []).append((HEADER, file_type))
+        for file_type, marker in eof_markers.items():
+            if marker:
+                self.patterns.setdefault(marker, []).append((FOOTER, file_type))
+
+        self._regex, self._roles = self._compile(self.patterns)
+        self.max_length = max(len(p) for p in self.patterns)
+
+        # Dùng cho chế độ quét theo sector: chữ ký chỉ được thử tại các vị
+        # trí căn lề, EOF marker vẫn được tìm ở mọi vị trí
+        headers = {p: [r for r in roles if r[0] == HEADER]
+                   for p, roles in self.patterns.items()}
+        footers = {p: [r for r in roles if r[0] == FOOTER]
+                   for p, roles in self.patterns.items()}
+        self._header_regex, self._header_roles = self._compile(
+            {p: roles for p, roles in headers.items() if roles})
+        self._footer_regex, self._footer_roles = self._compile(
+            {p: roles for p, roles in footers.items() if roles})
+        # Các byte mà một dải lặp lại toàn byte đó có thể chứa trọn một mẫu
+        self._constant_patterns = {p[0] for p in self.patterns
+                                   if p.count(p[0]) == len(p)}
+        self._header_first_bytes = re.compile(
+            b'[' + b''.join(re.escape(p[:1]) for p in headers if headers[p]) +
+            b']')
+
+        # Bộ lọc vector hóa: các mẫu được nhóm theo byte đầu; header_checks
+        # (định dạng -> hàm kiểm tra header) loại bớt chữ ký ngẫu nhiên
+        self.header_checks = {ft: check
+                              for ft, check in (header_checks or {}).items()
+                              if check is not None}
+        self._pattern_list = sorted(self.patterns, key=len, reverse=True)
+        self._by_first_byte = {}
+        for index, pattern in enumerate(self._pattern_list):
+            self._by_first_byte.setdefault(pattern[0], []).append(index)
+        self._pattern_roles = [self._roles[pattern]
+                               for pattern in self._pattern_list]
+        if np is not None:
+            # Mẫu nào có vai trò marker kết thúc / chữ ký của từng định dạng
+            self._footer_patterns = np.array(
+                [any(kind != HEADER for kind, _, _ in roles)
+                 for roles in self._pattern_roles])
+            self._header_patterns = {
+                file_type: np.array([(HEADER, file_type) in
+                                     [role[:2] for role in roles]
+                                     for roles in self._pattern_roles])
+                for file_type in signatures}
+
+    @staticmethod
+    def _compile(patterns):
+        """
+        Biên dịch các mẫu thành một regex dạng phép hợp cùng bảng vai trò.
+        Mẫu dài được thử trước; các mẫu là tiền tố của mẫu dài hơn được báo
+        cáo kèm theo để không bị bỏ sót
+        """
+        if not patterns:
+            return None, {}
+        ordered = sorted(patterns, key=len, reverse=True)
+        roles_by_pattern = {}
+        for pattern in ordered:
+            roles = []
+            for other in sorted(patterns, key=len):
+                if pattern.startswith(other):
+                    roles.extend((kind, ft, other)
+                                 for kind, ft in patterns[other])
+            # Chữ ký luôn đứng trước marker kết thúc tại cùng một vị trí
+            roles.sort(key=lambda role: role[0] != HEADER)
+            roles_by_pattern[pattern] = roles
+
+        alternation = b'|'.join(re.escape(p) for p in ordered)
+        return re.compile(b'(' + alternation + b')'), roles_by_pattern
+
+    def iter_hits(self, data, base=0, limit=None, alignment=None, start=0,
+                  prefilter=False):
+        """
+        Duyệt data một lần, trả về các Hit theo thứ tự vị trí.
+        base: vị trí tuyệt đối của data trong volume;
+        limit: chỉ nhận các điểm khớp bắt đầu trước vị trí này trong data;
+        alignment: nếu có, chữ ký chỉ được nhận tại các vị trí tuyệt đối chia
+        hết cho alignment (kích thước sector/cluster);
+        start: bắt đầu tìm từ vị trí này trong data;
+        prefilter: tìm ứng viên bằng NumPy và loại các chữ ký có header
+        không hợp lệ theo header_checks (cần NumPy)
+        """
+        if limit is None or limit > len(data):
+            limit = len(data)
+        if prefilter and np is not None:
+            yield from self._iter_vectorized(data, base, limit, alignment,
+                                             start)
+            return
+        if not alignment or alignment == 1:
+            yield from self._iter_regex(self._regex, self._roles, data, base,
+                                        limit, start)
+            return
+
+        headers = self._iter_aligned(data, base, limit, alignment, start)
+        footers = self._iter_regex(self._footer_regex, self._footer_roles,
+                                   data, base, limit, start)
+        yield from heapq.merge(headers, footers,
+                               key=lambda hit: (hit.offset, hit.kind != HEADER))
+
+    @staticmethod
+    def _iter_regex(regex, roles, data, base, limit, start=0):
+        """Tìm mọi vị trí khớp regex (kể cả chồng lấn) trước limit"""
+        if regex is None:
+            return
+        search = regex.search
+        match = search(data, start)
+        while match is not None:
+            pos = match.start()
+            if pos >= limit:
+                break
+            for kind, file_type, pattern in roles[match.group(1)]:
+                yield Hit(base + pos, kind, file_type, pattern)
+            # Tiếp tục từ byte kế tiếp để không bỏ sót các mẫu chồng lấn
+            match = search(data, pos + 1)
+
+    def _iter_aligned(self, data, base, limit, alignment, start=0):
+        """
+        Chỉ thử chữ ký tại các vị trí căn lề: lấy byte đầu của mỗi sector
+        bằng phép cắt có bước nhảy, lọc theo tập byte đầu của các chữ ký rồi
+        mới so khớp đầy đủ
+        """
+        if self._header_regex is None:
+            return
+        first = start + (-(base + start) % alignment)
+        leading = data[first:limit:alignment]
+        match_at = self._header_regex.match
+        for candidate in self._header_first_bytes.finditer(leading):
+            pos = first + candidate.start() * alignment
+            match = match_at(data, pos)
+            if match is not None:
+                for kind, file_type, pattern in self._header_roles[match.group(1)]:
+                    yield Hit(base + pos, kind, file_type, pattern)
+
+    def _iter_vectorized(self, data, base, limit, alignment, start=0):
+        """
+        Như iter_hits nhưng vị trí khớp của mọi mẫu được tính bằng phép so
+        sánh mảng trên từng khối VECTOR_BLOCK byte; header_checks và căn lề
+        được áp dụng trên cả mảng ứng viên, nên vòng lặp Python chỉ chạy
+        qua các hit còn lại. Kết quả giống _iter_regex khi không có ứng viên
+        nào bị header_checks loại
+        """
+        array = np.frombuffer(data, dtype=np.uint8)
+        for block in range(start, limit, self.VECTOR_BLOCK):
+            stop = min(block + self.VECTOR_BLOCK, limit)
+            positions, best = self._vector_candidates(array, block, stop)
+            if not len(positions):
+                continue
+
+            if alignment and alignment > 1:
+                aligned = (positions + base) % alignment == 0
+            else:
+                aligned = True
+            keep = self._footer_patterns[best]
+            header_ok = {}
+            for file_type, patterns in self._header_patterns.items():
+                involved = patterns[best]
+                ok = involved & aligned
+                check = self.header_checks.get(file_type)
+                if check is not None and ok.any():
+                    ok[ok] = check(array, positions[ok])
+                header_ok[file_type] = ok
+                keep = keep | ok
+
+            for j in np.flatnonzero(keep).tolist():
+                offset = base + int(positions[j])
+                for kind, file_type, pattern in self._pattern_roles[best[j]]:
+                    if kind == HEADER and not header_ok[file_type][j]:
+                        continue
+                    yield Hit(offset, kind, file_type, pattern)
+
+    def _vector_candidates(self, array, block, stop):
+        """
+        Các vị trí trong [block, stop) có mẫu khớp, đã sắp xếp, kèm chỉ số
+        (trong _pattern_list) của mẫu dài nhất khớp tại mỗi vị trí
+        """
+        found_positions, found_patterns = [], []
+        for first, indexes in self._by_first_byte.items():
+            candidates = np.flatnonzero(array[block:stop] == first) + block
+            for index in indexes:
+                pattern = self._pattern_list[index]
+                matched = candidates[candidates + len(pattern) <= len(array)]
+                for k in range(1, len(pattern)):
+                    matched = matched[array[matched + k] == pattern[k]]
+                found_positions.append(matched)
+                found_patterns.append(np.full(len(matched), index))
+        positions = np.concatenate(found_positions)
+        patterns = np.concatenate(found_patterns)
+        # _pattern_list xếp mẫu dài trước: giữ chỉ số nhỏ nhất tại mỗi vị trí
+        order = np.lexsort((patterns, positions))
+        positions, patterns = positions[order], patterns[order]
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = positions[1:] != positions[:-1]
+        return positions[first], patterns[first]
+
+    def active_spans(self, data, limit=None, block_size=64 * 1024):
+        """
+        Chia data thành các khối block_size và bỏ qua các khối chỉ gồm một
+        giá trị byte lặp lại (vùng trống 0x00, flash đã xóa 0xFF...).
+        Trả về các đoạn (start, end) cần quét; mỗi đoạn được nới về trước
+        max_length - 1 byte để không bỏ sót mẫu bắt đầu ở cuối vùng trống
+        """
+        if limit is None or limit > len(data):
+            limit = len(data)
+        spans = []
+        for pos in range(0, limit, block_size):
+            end = min(pos + block_size, limit)
+            value = data[pos]
+            if (data.count(value, pos, end) == end - pos and
+                    value not in self._constant_patterns):
+                continue
+            begin = max(0, pos - (self.max_length - 1))
+            if spans and begin <= spans[-1][1]:
+                spans[-1][1] = end
+            else:
+                spans.append([begin, end])
+        return [tuple(span) for span in spans]
+
+
+def has_bytes(array, offsets, count):
+    """Mảng bool: có đủ count byte từ mỗi vị trí trong offsets hay không"""
+    return offsets + count <= len(array)
+
+
+def header_field(array, offsets, at, size, big_endian=False):
+    """
+    Trường số nguyên không dấu size byte tại offsets + at, đọc vector hóa
+    cho mọi vị trí (byte ngoài mảng được thay bằng byte cuối cùng, dùng cùng
+    has_bytes để bỏ qua các vị trí này)
+    """
+    value = np.zeros(len(offsets), dtype=np.uint64)
+    for k in range(size):
+        shift = 8 * (size - 1 - k if big_endian else k)
+        byte = array.take(offsets + at + k, mode='clip').astype(np.uint64)
+        value |= byte << np.uint64(shift)
+    return value
+
+
+def field_in(values, choices):
+    """Mảng bool: giá trị nào thuộc choices"""
+    return np.isin(values, choices)
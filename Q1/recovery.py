@@ -1,24 +1,172 @@
 import os
 import struct
 import binascii
+import argparse
+import glob
+import sys
+import contextlib
+import errno
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow là phụ thuộc tùy chọn, chỉ cần cho kiểm tra mức 2 (giải mã)
+    Image = None
+
+from matcher import HEADER, HAS_NUMPY
+from carvers import VolumeReader
+from formats import FORMAT_REGISTRY, FormatRegistry, ImageFormat
+from carve_index import write_index, read_index
+from writer import AsyncWriter
+from telemetry import ScanMetrics
+
+# Tên định dạng mà Pillow báo cho từng loại tập tin
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'webp': 'WEBP'
+}
+
+# Các mức kiểm tra: 0 = chữ ký/EOF marker (header của chữ ký được kiểm tra
+# trước carver, kích thước và EOF marker sau khi có điểm kết thúc),
+# 1 = cấu trúc (carver), 2 = giải mã đầy đủ
+VALIDATION_TIERS = (0, 1, 2)
 
 class ImageRecovery:
-    # Định nghĩa signature của JPG và PNG
-    SIGNATURES = {
-        'jpg': (b'\xFF\xD8\xFF\xE0', b'\xFF\xD8\xFF\xE1'),  # SOI markers cho JPEG
-        'png': (b'\x89\x50\x4E\x47\x0D\x0A\x1A\x0A',)  # Signature cho PNG
-    }
-    
-    # Định nghĩa EOF markers
-    EOF_MARKERS = {
-        'jpg': b'\xFF\xD9',  # EOI marker cho JPEG
-        'png': b'\x49\x45\x4E\x44\xAE\x42\x60\x82'  # IEND chunk cho PNG
-    }
+    # Các định dạng được phục hồi: JPG và PNG (chữ ký, EOF marker, carver và
+    # cách kiểm tra của từng định dạng được khai báo trong formats.py)
+    FORMATS = FORMAT_REGISTRY.subset(('jpg', 'png'))
+
+    # Kích thước tối đa của một tập tin, áp dụng cùng với max_size của từng
+    # định dạng (None = tìm EOF đến hết volume)
+    MAX_SIZE = None
+
+    # Kích thước cửa sổ đọc ở chế độ streaming
+    WINDOW_SIZE = 16 * 1024 * 1024
 
-    def __init__(self, volume_path):
+    # Kích thước mỗi phân đoạn (shard) khi quét song song
+    SHARD_SIZE = 64 * 1024 * 1024
+
+    # Số hash tối đa được ghi nhớ khi loại bỏ ảnh trùng lặp
+    DEDUP_CACHE_SIZE = 100000
+
+    # Kích thước khối dùng để nhận biết vùng trống (một giá trị byte lặp lại)
+    EMPTY_BLOCK_SIZE = 64 * 1024
+
+    # Khoảng thời gian (giây) giữa hai lần lưu checkpoint
+    CHECKPOINT_INTERVAL = 60
+
+    # Ghép tập tin phân mảnh: kích thước cluster và khoảng trống tối đa giữa
+    # hai mảnh
+    CLUSTER_SIZE = 4096
+    MAX_GAP = 1024 * 1024
+
+    def __init__(self, volume_path, streaming=False, window_size=None,
+                 workers=1, shard_size=None, alignment=None, output_dir=None,
+                 writers=0, group_size=None, dedup=False,
+                 dedup_cache_size=None, checkpoint_path=None, resume=False,
+                 checkpoint_interval=None, skip_empty=True,
+                 deep_validate=False, decode_workers=None, metrics=None,
+                 formats=None, fragments=False, cluster_size=None,
+                 max_gap=None, executor=None, prefilter=False,
+                 decode_executor=None):
         self.volume_path = volume_path
         self.recovered_files = 0
+        # streaming=True: quét volume theo từng cửa sổ thay vì đọc toàn bộ
+        self.streaming = streaming
+        self.window_size = window_size or self.WINDOW_SIZE
+        # workers > 1: chia volume thành các shard và quét trên nhiều tiến trình
+        self.workers = workers
+        # executor: ProcessPoolExecutor dùng chung (vd: giữa nhiều volume);
+        # khi có, volume luôn được quét theo shard trên executor này
+        self.executor = executor
+        self._futures = None
+        self.shard_size = shard_size or self.SHARD_SIZE
+        # alignment (vd: 512, 4096): chỉ tìm chữ ký tại đầu sector/cluster
+        self.alignment = alignment
+        # prefilter=True: tìm chữ ký bằng NumPy và loại ngay các header
+        # không hợp lệ (header_check của định dạng) trước khi carve
+        if prefilter and not HAS_NUMPY:
+            print("Không có NumPy, bỏ qua bộ lọc ứng viên vector hóa")
+        self.prefilter = prefilter and HAS_NUMPY
+        # skip_empty: bỏ qua lỗ của tập tin thưa và các vùng byte lặp lại
+        self.skip_empty = skip_empty
+        # Thư mục đầu ra; group_size: số tập tin tối đa trong mỗi thư mục con
+        self.output_dir = output_dir
+        self.group_size = group_size
+        # writers > 0: ghi tập tin bằng các luồng ghi chạy song song với quét
+        self.writers = writers
+        self._created_dirs = set()
+        # dedup=True: bỏ qua các ảnh trùng nội dung (theo SHA-256)
+        self.dedup = dedup
+        self.dedup_cache_size = dedup_cache_size or self.DEDUP_CACHE_SIZE
+        self.aliases = []
+        # checkpoint_path: định kỳ lưu trạng thái quét để có thể tiếp tục
+        # (resume=True) sau khi bị gián đoạn
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
+        self.checkpoint_interval = (self.CHECKPOINT_INTERVAL
+                                    if checkpoint_interval is None
+                                    else checkpoint_interval)
+        self._checkpointing = False
+        self._last_checkpoint = 0
+        self._saved_shards = set()
+        # deep_validate=True: giải mã đầy đủ các ảnh đã qua mức 0 và 1 bằng
+        # Pillow trên decode_workers tiến trình (mặc định: số CPU)
+        if deep_validate and Image is None:
+            print("Không có Pillow, bỏ qua kiểm tra giải mã (mức 2)")
+        self.deep_validate = deep_validate and Image is not None
+        self.decode_workers = decode_workers
+        # decode_executor: nhóm tiến trình giải mã dùng chung, tách khỏi
+        # executor quét để việc giải mã không phải xếp hàng sau các shard
+        self.decode_executor = decode_executor
+        # metrics: ScanMetrics ghi nhận tiến độ và thời gian của lượt quét
+        self.metrics = metrics
+        self._flush_output = None
+        self._state = self._new_state()
+        # formats: FormatRegistry hoặc danh sách tên định dạng trong
+        # FORMAT_REGISTRY (mặc định: FORMATS của lớp)
+        if formats is None:
+            formats = self.FORMATS
+        elif not isinstance(formats, FormatRegistry):
+            formats = FORMAT_REGISTRY.subset(formats)
+        self.formats = formats
+        # Bộ so khớp một lượt cho mọi định dạng, biên dịch một lần cho mỗi
+        # registry và dùng chung giữa các lần quét
+        self.matcher = formats.matcher
+        self._carvers = {fmt.name: fmt.carver for fmt in formats
+                         if fmt.carver is not None}
+        self._limits = {fmt.name: self._max_size(fmt) for fmt in formats}
+        # Kiểm tra mức 0 trên header của chữ ký, trước khi chạy carver
+        self._header_validators = {fmt.name: fmt.validate_header
+                                   for fmt in formats
+                                   if fmt.carver is not None and
+                                   fmt.header_validator is not None}
+        # fragments=True: khi carver thất bại, thử ghép tập tin bị chia thành
+        # hai mảnh (theo cluster_size, khoảng trống tối đa max_gap)
+        self.fragments = fragments
+        self.cluster_size = cluster_size or self.CLUSTER_SIZE
+        self.max_gap = max_gap or self.MAX_GAP
+        self._fragment_carvers = {fmt.name: fmt.fragment_carver
+                                  for fmt in formats
+                                  if fragments and fmt.fragment_carver}
         
+    def _max_size(self, image_format):
+        """Kích thước tối đa của định dạng, giới hạn thêm bởi MAX_SIZE"""
+        sizes = [size for size in (image_format.max_size, self.MAX_SIZE)
+                 if size is not None]
+        return min(sizes) if sizes else None
+
     def read_volume(self):
         """Đọc dữ liệu từ volume"""
         try:
@@ -28,50 +176,355 @@ class ImageRecovery:
             print(f"Lỗi khi đọc volume: {e}")
             return None
 
+    def iter_windows(self, f, start=0, stop=None, overlap=None, extend=None):
+        """
+        Đọc volume theo từng cửa sổ cố định, trả về (offset, dữ liệu).
+        Mỗi cửa sổ đọc thêm `overlap` byte của cửa sổ kế tiếp để không bỏ sót
+        chữ ký nằm vắt qua ranh giới; chỉ các vị trí < offset + window_size
+        thuộc về cửa sổ hiện tại.
+        extend: nếu có, stop không cắt cửa sổ; cửa sổ bắt đầu từ stop trở đi
+        chỉ được đọc khi extend(offset) đúng (vd: còn ứng viên đang mở)
+        """
+        if overlap is None:
+            overlap = self.matcher.max_length - 1
+        pos = start
+        while True:
+            if stop is not None and pos >= stop and (extend is None or
+                                                     not extend(pos)):
+                break
+            if self.skip_empty:
+                # Nhảy qua các lỗ (hole) của tập tin thưa, giữ nguyên lưới
+                # cửa sổ tính từ start để kết quả không đổi
+                data_pos = _next_data(f, pos)
+                if data_pos is None:
+                    break
+                if data_pos >= pos + self.window_size:
+                    pos = data_pos - (data_pos - start) % self.window_size
+                    continue
+            size = self.window_size + overlap
+            if stop is not None and extend is None:
+                size = min(size, stop - pos)
+            began = time.perf_counter()
+            f.seek(pos)
+            data = f.read(size)
+            if not data:
+                break
+            if self.metrics is not None:
+                self.metrics.add_time('read', time.perf_counter() - began)
+                self.metrics.add_bytes(min(len(data), self.window_size))
+            yield pos, data
+            if len(data) <= overlap:
+                break
+            pos += self.window_size
+
+    def scan_hits(self, f, start=0):
+        """Quét volume theo cửa sổ, trả về dòng Hit đã sắp xếp theo vị trí"""
+        for base, data in self.iter_windows(f, start):
+            # Giữa hai cửa sổ, mọi hit trước base đã được xử lý xong
+            self._maybe_checkpoint(base)
+            yield from self._timed_hits(data, base, self.window_size)
+
+    def _window_hits(self, data, base=0, limit=None, start=0):
+        """
+        Dòng Hit của một cửa sổ (chỉ các vị trí từ start đến trước limit).
+        Khi bật skip_empty, các khối chỉ gồm một giá trị byte lặp lại không
+        được đưa qua bộ so khớp
+        """
+        if not self.skip_empty:
+            yield from self.matcher.iter_hits(data, base, limit, self.alignment,
+                                              start, self.prefilter)
+            return
+        for begin, end in self.matcher.active_spans(data, limit,
+                                                    self.EMPTY_BLOCK_SIZE):
+            if end > start:
+                yield from self.matcher.iter_hits(data, base, end,
+                                                  self.alignment,
+                                                  max(begin, start),
+                                                  self.prefilter)
+
+    def _timed_hits(self, data, base=0, limit=None):
+        """
+        Như _window_hits; khi có metrics, các hit của cửa sổ được tìm hết
+        trước để đo thời gian so khớp và đếm số hit theo định dạng
+        """
+        hits = self._window_hits(data, base, limit)
+        if self.metrics is None:
+            return hits
+        began = time.perf_counter()
+        hits = list(hits)
+        self.metrics.add_time('match', time.perf_counter() - began)
+        self.metrics.count_hits(hits)
+        return hits
+
+    def carve_boundaries(self, hits, reader):
+        """
+        Ghép chữ ký với EOF marker trong một lượt duy nhất trên dòng Hit.
+        Mỗi chữ ký kết thúc tại EOF marker cùng định dạng đầu tiên sau nó
+        (trong giới hạn kích thước tối đa của định dạng), hoặc tại điểm kết
+        thúc do carver của định dạng đó xác định; trả về (start, end,
+        file_type). Với tập tin được ghép từ nhiều mảnh, end là điểm kết
+        thúc của mảnh cuối
+        """
+        for _, start, end, file_type, _ in self._carve(hits, reader):
+            yield start, end, file_type
+
+    def _carve(self, hits, reader, pending=None):
+        """
+        Lõi của carve_boundaries, trả về (khóa, start, end, file_type,
+        fragments). Khóa thứ tự (vị trí hit, thứ tự hit tại vị trí đó, start)
+        giúp các shard song song ghép lại đúng thứ tự của lượt quét tuần tự;
+        fragments là danh sách các mảnh (start, end) nếu tập tin được ghép từ
+        nhiều mảnh, ngược lại là None
+        """
+        if pending is None:
+            pending = {}
+        for file_type in self._limits:
+            pending.setdefault(file_type, deque())
+
+        carvers, limits = self._carvers, self._limits
+        fragment_carvers = self._fragment_carvers
+        header_validators = self._header_validators
+        last_offset, rank = -1, 0
+        for hit in hits:
+            rank = rank + 1 if hit.offset == last_offset else 0
+            last_offset = hit.offset
+            open_starts = pending[hit.file_type]
+            limit = limits[hit.file_type]
+            if hit.kind == HEADER:
+                carver = carvers.get(hit.file_type)
+                validate_header = header_validators.get(hit.file_type)
+                if validate_header is not None:
+                    size = ImageFormat.HEADER_SIZE
+                    if hit.file_type in fragment_carvers:
+                        # Mảnh đầu có thể kết thúc tại ranh giới cluster kế
+                        # tiếp, chỉ kiểm tra phần header nằm trước nó
+                        size = min(size, -hit.offset % self.cluster_size
+                                   or size)
+                    began = time.perf_counter()
+                    valid = validate_header(reader.read(hit.offset, size))
+                    self._count_tier(0, began, valid)
+                    if not valid:
+                        continue
+                if carver is not None:
+                    began = time.perf_counter()
+                    end = carver(reader, hit.offset, limit)
+                    fragments = None
+                    if end is None and hit.file_type in fragment_carvers:
+                        fragments = fragment_carvers[hit.file_type](
+                            reader, hit.offset, self.cluster_size,
+                            self.max_gap, limit)
+                        if fragments is not None:
+                            end = fragments[-1][1]
+                    self._count_tier(1, began, end is not None)
+                    if end is not None:
+                        yield ((hit.offset, rank, hit.offset), hit.offset,
+                               end, hit.file_type, fragments)
+                    continue
+                if self.formats[hit.file_type].footer is None:
+                    # Định dạng không có EOF marker: lấy theo kích thước tối đa
+                    yield ((hit.offset, rank, hit.offset), hit.offset,
+                           hit.offset + limit, hit.file_type, None)
+                    continue
+                # Bỏ các chữ ký đã quá kích thước tối đa mà chưa gặp EOF marker
+                while (limit is not None and open_starts and
+                       open_starts[0] + limit < hit.offset):
+                    open_starts.popleft()
+                open_starts.append(hit.offset)
+                continue
+
+            # Thêm độ dài của EOF marker
+            end = hit.offset + len(hit.pattern)
+            for start in open_starts:
+                if limit is None or end <= start + limit:
+                    yield ((hit.offset, rank, start), start, end,
+                           hit.file_type, None)
+            open_starts.clear()
+
+    def _validated(self, candidates, reader, validate=True, covered=None):
+        """
+        Đọc và kiểm tra từng ứng viên (mức 0), trả về (khóa, start, end,
+        file_type, fragments, dữ liệu). Ứng viên nằm trọn trong một ảnh cùng
+        định dạng đã phục hồi bằng carver (vd: thumbnail trong EXIF) được bỏ
+        qua; với ảnh ghép từ nhiều mảnh chỉ xét mảnh đầu tiên
+        """
+        if covered is None:
+            covered = {}
+        for key, start, end, file_type, fragments in candidates:
+            if start < covered.get(file_type, -1):
+                continue
+            image_data = _read_extents(reader, start, end, fragments)
+
+            # Kiểm tra tính hợp lệ của file
+            if validate:
+                began = time.perf_counter()
+                valid = self.validate_image(image_data, file_type)
+                self._count_tier(0, began, valid)
+                if not valid:
+                    continue
+            if file_type in self._carvers:
+                covered[file_type] = end if fragments is None \
+                    else fragments[0][1]
+            yield key, start, end, file_type, fragments, image_data
+
+    def _count_tier(self, tier, began, passed):
+        """Cộng thời gian (tính từ began) và số ứng viên bị loại của một mức"""
+        self._state['tier_seconds'][tier] += time.perf_counter() - began
+        if not passed:
+            self._state['tier_rejected'][tier] += 1
+
+    def _deep_validated(self, results):
+        """
+        Kiểm tra mức 2: giải mã đầy đủ các ảnh đã qua mức 0 và 1 trên một
+        nhóm tiến trình. Số ảnh đang giải mã được giới hạn và kết quả được trả
+        về theo đúng thứ tự đầu vào. Các ảnh đang giải mã được giữ trong trạng
+        thái quét để checkpoint lưu giữa chừng không làm mất chúng
+        """
+        inflight = self._state['inflight']
+        resumed = []
+        if inflight:
+            # Ảnh còn đang giải mã khi lưu checkpoint lần trước
+            with open(self.volume_path, 'rb') as f:
+                reader = VolumeReader(f)
+                resumed = [(key, start, end, file_type, fragments,
+                            _read_extents(reader, start, end, fragments))
+                           for key, start, end, file_type, fragments
+                           in inflight]
+            inflight.clear()
+
+        workers = self.decode_workers or os.cpu_count() or 1
+        queue = deque()
+        # Không dùng executor quét: ảnh giải mã xong ngay khi volume quét xong
+        # thay vì chờ các shard của những volume xếp hàng sau nó
+        with self._pool(workers, self.decode_executor) as executor:
+            for item in itertools.chain(resumed, results):
+                key, start, end, file_type, fragments, image_data = item
+                future = executor.submit(_decode_task,
+                                         (file_type, bytes(image_data)))
+                queue.append((item, future))
+                inflight.append((key, start, end, file_type, fragments))
+                if len(queue) >= workers * 4:
+                    yield from self._decoded(queue.popleft())
+            while queue:
+                yield from self._decoded(queue.popleft())
+
+    def _decoded(self, entry):
+        """Chờ kết quả giải mã của một ảnh, trả về ảnh nếu giải mã được"""
+        item, future = entry
+        passed, seconds = future.result()
+        self._state['inflight'].popleft()
+        self._state['tier_seconds'][2] += seconds
+        if passed:
+            yield item
+        else:
+            self._state['tier_rejected'][2] += 1
+
+    def validation_report(self):
+        """
+        Thời gian (giây) và số ứng viên bị loại của từng mức kiểm tra trong
+        lượt quét gần nhất. Thời gian mức 2 là tổng thời gian giải mã trên
+        các tiến trình
+        """
+        state = self._state
+        return [{'tier': tier,
+                 'seconds': state['tier_seconds'][tier],
+                 'rejected': state['tier_rejected'][tier]}
+                for tier in VALIDATION_TIERS]
+
+    def print_validation_report(self):
+        """In thời gian và số ứng viên bị loại theo từng mức kiểm tra"""
+        print("\nThời gian kiểm tra theo mức:")
+        for entry in self.validation_report():
+            if entry['tier'] == 2 and not self.deep_validate:
+                continue
+            print(f"  Mức {entry['tier']}: {entry['seconds']:.3f}s, "
+                  f"loại {entry['rejected']} ứng viên")
+
+    def _has_open(self, pending, offset):
+        """Còn chữ ký nào có thể được đóng bởi EOF marker tại offset không"""
+        return any(starts and (self._limits[file_type] is None or
+                               starts[-1] + self._limits[file_type] >= offset)
+                   for file_type, starts in pending.items())
+
+    def _shard_hits(self, f, start, stop, pending):
+        """
+        Dòng Hit của một shard: chỉ nhận chữ ký trong [start, stop). Volume
+        chỉ được đọc tiếp qua stop khi còn ứng viên của shard đang mở, và
+        không quá kích thước tối đa của chúng, để tìm EOF marker
+        """
+        windows = self.iter_windows(
+            f, start, stop, extend=lambda pos: self._has_open(pending, pos))
+        for base, data in windows:
+            tail = 0
+            if base < stop:
+                # Metrics chỉ tính phần trước stop; phần sau thuộc shard kế
+                # tiếp và được so khớp (và đếm) lại ở đó
+                yield from self._timed_hits(
+                    data, base, min(self.window_size, stop - base))
+                if base + self.window_size <= stop:
+                    continue
+                tail = stop - base
+            for hit in self._window_hits(data, base, self.window_size, tail):
+                if not self._has_open(pending, hit.offset):
+                    return
+                if hit.kind != HEADER:
+                    yield hit
+
+    def carve_shard(self, start, stop):
+        """
+        Quét một shard và kiểm tra các ứng viên của nó (mức 0 và 1).
+        Trả về danh sách (khóa, start, end, file_type, fragments) đã hợp lệ
+        """
+        results = []
+        pending = {}
+        with open(self.volume_path, 'rb') as f:
+            reader = VolumeReader(f)
+            hits = self._shard_hits(f, start, stop, pending)
+            candidates = self._carve(hits, reader, pending)
+            for key, begin, end, file_type, fragments, _ in self._validated(
+                    candidates, reader):
+                results.append((key, begin, end, file_type, fragments))
+        return results
+
+    def find_all_boundaries(self, data):
+        """Tìm ranh giới của mọi định dạng ảnh trong một lượt quét"""
+        hits = self._window_hits(data)
+        return list(self.carve_boundaries(hits, VolumeReader(data)))
+
     def find_file_boundaries(self, data, file_type):
         """Tìm vị trí bắt đầu và kết thúc của các file ảnh"""
-        boundaries = []
-        
-        # Tìm tất cả các signature phù hợp
-        start_positions = []
-        for sig in self.SIGNATURES[file_type]:
-            pos = 0
-            while True:
-                pos = data.find(sig, pos)
-                if pos == -1:
-                    break
-                start_positions.append(pos)
-                pos += 1
-        
-        start_positions.sort()
-        
-        # Với mỗi điểm bắt đầu, tìm EOF marker
-        for start in start_positions:
-            end = data.find(self.EOF_MARKERS[file_type], start)
-            if end != -1:
-                # Thêm độ dài của EOF marker
-                end += len(self.EOF_MARKERS[file_type])
-                boundaries.append((start, end))
-                
-        return boundaries
+        return sorted((start, end)
+                      for start, end, ft in self.find_all_boundaries(data)
+                      if ft == file_type)
 
     def validate_image(self, data, file_type):
-        """Kiểm tra tính hợp lệ của dữ liệu ảnh"""
-        if file_type == 'jpg':
-            # Kiểm tra basic JPEG structure
-            return data[0:2] == b'\xFF\xD8' and data[-2:] == b'\xFF\xD9'
-        elif file_type == 'png':
-            # Kiểm tra PNG signature và IEND chunk
-            return (data.startswith(b'\x89PNG\r\n\x1a\n') and
-                    data.endswith(b'IEND\xAE\x42\x60\x82'))
-        return False
+        """Kiểm tra tính hợp lệ của dữ liệu ảnh (validator của định dạng)"""
+        return file_type in self.formats and \
+            self.formats[file_type].validate(data)
+
+    def output_path(self, index, file_type):
+        """
+        Đường dẫn của tập tin phục hồi thứ index; tên chỉ phụ thuộc vào thứ
+        tự nên luôn xác định. Với group_size, các tập tin được chia vào các
+        thư mục con group_000, group_001...
+        """
+        directory = self.output_dir or ''
+        if self.group_size:
+            directory = os.path.join(directory,
+                                     f"group_{index // self.group_size:03d}")
+        if directory and directory not in self._created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._created_dirs.add(directory)
+        return os.path.join(directory, f"recovered_{index}.{file_type}")
 
     def save_recovered_file(self, data, file_type):
         """Lưu file đã phục hồi"""
-        filename = f"recovered_{self.recovered_files}.{file_type}"
+        filename = self.output_path(self.recovered_files, file_type)
         try:
+            began = time.perf_counter()
             with open(filename, 'wb') as f:
                 f.write(data)
+            if self.metrics is not None:
+                self.metrics.add_time('write', time.perf_counter() - began)
             print(f"Đã phục hồi: {filename}")
             self.recovered_files += 1
             return True
@@ -79,37 +532,687 @@ class ImageRecovery:
             print(f"Lỗi khi lưu file {filename}: {e}")
             return False
 
+    def validation_level(self, file_type):
+        """
+        Mức kiểm tra mà một ảnh hợp lệ đã đạt được: 0 = chữ ký/EOF marker,
+        1 = cấu trúc tập tin (đã đi qua carver), 2 = giải mã đầy đủ
+        """
+        if self.deep_validate and file_type in PIL_FORMATS:
+            return 2
+        return 1 if file_type in self._carvers else 0
+
+    def iter_recovered(self):
+        """
+        Quét volume theo chế độ đã chọn (đọc toàn bộ, streaming hoặc song
+        song), trả về lần lượt (start, end, file_type, dữ liệu, fragments)
+        của các ảnh hợp lệ theo đúng thứ tự đặt tên. Mức kiểm tra đắt hơn chỉ
+        chạy trên các ứng viên đã qua mức rẻ hơn
+        """
+        if self.workers > 1 or self.executor is not None:
+            results = self._iter_parallel()
+        elif self.streaming or self.checkpoint_path:
+            results = self._iter_streaming()
+        else:
+            results = self._iter_in_memory()
+        if self.deep_validate:
+            results = self._deep_validated(results)
+        for _, start, end, file_type, fragments, image_data in results:
+            yield start, end, file_type, image_data, fragments
+
+    def _iter_unique(self):
+        """
+        iter_recovered kèm hash SHA-256 của từng ảnh (chỉ tính khi bật dedup,
+        ngược lại là None). Khi bật dedup, ảnh có
+        nội dung trùng với một ảnh đã trả về trước đó bị bỏ qua và được ghi
+        nhận là bản sao (alias) trong self.aliases. Tập hash đã gặp được giới
+        hạn ở dedup_cache_size mục (bỏ mục ít dùng nhất khi đầy)
+        """
+        seen = self._state['seen']
+        for start, end, file_type, image_data, fragments in \
+                self.iter_recovered():
+            if not self.dedup:
+                self._count_recovered(file_type)
+                yield start, end, file_type, image_data, fragments, None
+                continue
+
+            digest = hashlib.sha256(image_data).digest()
+            original = seen.get(digest)
+            if original is not None:
+                seen.move_to_end(digest)
+                self.aliases.append({
+                    'offset': start,
+                    'length': len(image_data),
+                    'type': file_type,
+                    'alias_of': original
+                })
+                continue
+
+            seen[digest] = self._state['unique_count']
+            if len(seen) > self.dedup_cache_size:
+                seen.popitem(last=False)
+            self._state['unique_count'] += 1
+            self._count_recovered(file_type)
+            yield start, end, file_type, image_data, fragments, digest
+
     def recover_images(self):
         """Hàm chính để phục hồi ảnh"""
         print("Bắt đầu quá trình phục hồi ảnh...")
-        
-        # Đọc dữ liệu từ volume
+        types = ', '.join(name.upper() for name in self.formats.names())
+        print(f"\nTìm kiếm các file {types}...")
+
+        self.recovered_files = 0
+        self.aliases = []
+        self._state = self._new_state()
+        self._start_metrics()
+        if self.resume and self.checkpoint_path:
+            self._load_checkpoint()
+        self._saved_shards = set(self._state['shards'])
+        if (self.checkpoint_path and not self._saved_shards and
+                os.path.exists(self._shards_path)):
+            # Kết quả shard của một lượt quét khác, không được nạp
+            os.remove(self._shards_path)
+        self._checkpointing = bool(self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+        try:
+            if self.writers:
+                self._recover_async()
+            else:
+                for _, _, file_type, image_data, _, _ in self._iter_unique():
+                    self.save_recovered_file(image_data, file_type)
+        finally:
+            self._checkpointing = False
+            self._finish_metrics()
+
+        # Hoàn tất: checkpoint không còn cần thiết
+        if self.checkpoint_path:
+            for path in (self.checkpoint_path, self._shards_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if self.aliases:
+            print(f"\nBỏ qua {len(self.aliases)} bản sao trùng nội dung")
+        self.print_validation_report()
+        print(f"\nĐã hoàn thành. Tổng số file phục hồi: {self.recovered_files}")
+
+    def _recover_async(self):
+        """
+        Đưa dữ liệu ảnh (memoryview của volume khi đọc toàn bộ, không sao
+        chép) cho AsyncWriter. Tên tập tin được gán ngay tại luồng quét theo
+        thứ tự nên kết quả giống hệt chế độ ghi tuần tự
+        """
+        with AsyncWriter(self.writers) as writer:
+            # Trước khi lưu checkpoint phải ghi xong các tập tin đang chờ
+            self._flush_output = writer.flush
+            try:
+                for _, _, file_type, image_data, _, _ in self._iter_unique():
+                    writer.submit(self.output_path(self.recovered_files,
+                                                   file_type), image_data)
+                    self.recovered_files += 1
+            finally:
+                self._flush_output = None
+        self.recovered_files -= writer.failed
+        if self.metrics is not None:
+            self.metrics.add_time('write', writer.seconds)
+
+    def _start_metrics(self):
+        if self.metrics is not None:
+            self.metrics.reset(self.volume_path,
+                               os.path.getsize(self.volume_path))
+
+    def _count_recovered(self, file_type):
+        if self.metrics is not None:
+            self.metrics.recovered[file_type] += 1
+
+    def _finish_metrics(self):
+        if self.metrics is not None:
+            self.metrics.finish(self.validation_report(), len(self.aliases))
+
+    def _new_state(self):
+        """Trạng thái của một lượt quét, đủ để tiếp tục từ checkpoint"""
+        return {
+            'offset': 0,          # streaming: vị trí cửa sổ kế tiếp
+            'pending': {},        # chữ ký đang chờ EOF marker
+            'covered': {},        # điểm kết thúc ảnh carver gần nhất
+            'seen': OrderedDict(),
+            'unique_count': 0,
+            'shards': {},         # song song: kết quả các shard đã xong
+            'shard_tiers': {},    # thời gian/số ứng viên bị loại theo shard
+            'inflight': deque(),  # ảnh đang giải mã (mức 2)
+            'tier_seconds': [0.0] * len(VALIDATION_TIERS),
+            'tier_rejected': [0] * len(VALIDATION_TIERS)
+        }
+
+    def _maybe_checkpoint(self, offset=None):
+        """
+        Lưu checkpoint nếu đã đến hạn: tại ranh giới cửa sổ (offset) khi
+        quét tuần tự, hoặc sau một shard (offset=None) khi quét song song
+        """
+        if not self._checkpointing:
+            return
+        if offset is not None and (self.workers > 1 or
+                                   self.executor is not None):
+            return
+        if time.monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return
+        if offset is not None:
+            self._state['offset'] = offset
+        self._save_checkpoint()
+
+    @property
+    def _shards_path(self):
+        """Tập tin phụ của checkpoint chứa kết quả các shard, mỗi dòng một shard"""
+        return self.checkpoint_path + '.shards'
+
+    def _save_checkpoint(self):
+        """
+        Ghi checkpoint ra đĩa (ghi tập tin tạm rồi thay thế nguyên tử). Kết
+        quả shard chỉ được nối thêm vào _shards_path cho các shard xong sau
+        lần lưu trước, nên chi phí mỗi lần lưu không tăng theo số shard
+        """
+        if self._flush_output is not None:
+            self._flush_output()
+        state = self._state
+        new_shards = [start for start in state['shards']
+                      if start not in self._saved_shards]
+        if new_shards:
+            with open(self._shards_path, 'a') as f:
+                for start in new_shards:
+                    f.write(json.dumps([start, state['shards'][start],
+                                        *state['shard_tiers'][start]]) + '\n')
+            self._saved_shards.update(new_shards)
+        checkpoint = {
+            'volume_path': os.path.abspath(self.volume_path),
+            'volume_size': os.path.getsize(self.volume_path),
+            'window_size': self.window_size,
+            'offset': state['offset'],
+            'pending': {ft: list(starts)
+                        for ft, starts in state['pending'].items()},
+            'covered': state['covered'],
+            'seen': [[digest.hex(), index]
+                     for digest, index in state['seen'].items()],
+            'unique_count': state['unique_count'],
+            # Chỉ ranh giới các shard đã tính vào tier_seconds/tier_rejected
+            'shards': sorted(self._saved_shards),
+            'inflight': list(state['inflight']),
+            'tier_seconds': state['tier_seconds'],
+            'tier_rejected': state['tier_rejected'],
+            'recovered_files': self.recovered_files,
+            'aliases': self.aliases
+        }
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _load_checkpoint(self):
+        """Nạp checkpoint (nếu có và khớp với volume) vào trạng thái quét"""
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if (checkpoint['volume_path'] != os.path.abspath(self.volume_path) or
+                checkpoint['volume_size'] != os.path.getsize(self.volume_path)
+                or checkpoint['window_size'] != self.window_size):
+            print("Checkpoint không khớp với volume, quét lại từ đầu")
+            return
+
+        self._state = {
+            'offset': checkpoint['offset'],
+            'pending': {ft: deque(starts)
+                        for ft, starts in checkpoint['pending'].items()},
+            'covered': checkpoint['covered'],
+            'seen': OrderedDict((bytes.fromhex(digest), index)
+                                for digest, index in checkpoint['seen']),
+            'unique_count': checkpoint['unique_count'],
+            'shards': {},
+            'shard_tiers': {},
+            'inflight': deque((tuple(key), begin, end, file_type, fragments)
+                              for key, begin, end, file_type, fragments
+                              in checkpoint['inflight']),
+            'tier_seconds': checkpoint['tier_seconds'],
+            'tier_rejected': checkpoint['tier_rejected']
+        }
+        self._load_shards(set(checkpoint['shards']))
+        self.recovered_files = checkpoint['recovered_files']
+        self.aliases = checkpoint['aliases']
+        print(f"Tiếp tục từ checkpoint tại byte {checkpoint['offset']}")
+
+    def _load_shards(self, counted):
+        """
+        Nạp kết quả shard từ _shards_path. Các shard được ghi sau lần lưu
+        checkpoint cuối (không thuộc counted) được cộng thêm vào thống kê
+        mức kiểm tra; dòng cuối bị ghi dở (thiếu ký tự xuống dòng) bị bỏ qua
+        """
+        if not os.path.exists(self._shards_path):
+            return
+        state = self._state
+        with open(self._shards_path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                start, results, tier_seconds, tier_rejected = json.loads(line)
+                state['shards'][start] = [
+                    (tuple(key), begin, end, file_type, fragments)
+                    for key, begin, end, file_type, fragments in results]
+                state['shard_tiers'][start] = (tier_seconds, tier_rejected)
+                if start not in counted:
+                    for tier in VALIDATION_TIERS:
+                        state['tier_seconds'][tier] += tier_seconds[tier]
+                        state['tier_rejected'][tier] += tier_rejected[tier]
+
+    def build_index(self, index_path, index_format='jsonl'):
+        """
+        Quét volume và chỉ ghi chỉ mục (offset, length, type, level, sha256
+        và các mảnh nếu ảnh bị phân mảnh) của các ảnh hợp lệ, không sao chép
+        dữ liệu ảnh ra đĩa. Dùng extract() để lấy các ảnh cần thiết sau đó
+        """
+        print("Bắt đầu lập chỉ mục ảnh...")
+        self.aliases = []
+        self._state = self._new_state()
+        self._start_metrics()
+        records = (self._index_record(record_id, *entry)
+                   for record_id, entry in enumerate(self._iter_unique()))
+
+        count = write_index(index_path, records, index_format)
+        self._finish_metrics()
+        self.print_validation_report()
+        print(f"Đã ghi {count} mục vào {index_path}")
+        return count
+
+    def _index_record(self, record_id, start, end, file_type, image_data,
+                      fragments, digest):
+        record = {
+            'id': record_id,
+            'offset': start,
+            'length': len(image_data),
+            'type': file_type,
+            'level': self.validation_level(file_type),
+            'sha256': (digest or hashlib.sha256(image_data).digest()).hex()
+        }
+        if fragments is not None:
+            record['fragments'] = [[begin, stop - begin]
+                                   for begin, stop in fragments]
+        return record
+
+    def extract(self, index_path, ids=None):
+        """
+        Trích xuất các mục đã chọn (theo id, mặc định là tất cả) trong chỉ
+        mục bằng cách đọc đúng đoạn dữ liệu của chúng trên volume.
+        Tên tập tin (và output_dir, group_size) giống với khi phục hồi trực tiếp
+        """
+        wanted = None if ids is None else set(ids)
+        extracted = 0
+        with open(self.volume_path, 'rb') as f:
+            for entry in read_index(index_path):
+                if wanted is not None and entry['id'] not in wanted:
+                    continue
+                filename = self.output_path(entry['id'], entry['type'])
+                digest = hashlib.sha256()
+                extents = entry.get('fragments') or [[entry['offset'],
+                                                      entry['length']]]
+                with open(filename, 'wb') as out:
+                    for offset, remaining in extents:
+                        f.seek(offset)
+                        while remaining > 0:
+                            block = f.read(min(VolumeReader.BLOCK_SIZE,
+                                               remaining))
+                            if not block:
+                                break
+                            digest.update(block)
+                            out.write(block)
+                            remaining -= len(block)
+
+                if digest.hexdigest() != entry['sha256']:
+                    print(f"Cảnh báo: {filename} không khớp hash trong chỉ mục")
+                extracted += 1
+        return extracted
+
+    def _iter_in_memory(self):
+        """Đọc toàn bộ volume vào bộ nhớ rồi quét"""
+        began = time.perf_counter()
         volume_data = self.read_volume()
         if volume_data is None:
             return
-        
-        # Phục hồi từng loại file
-        for file_type in ['jpg', 'png']:
-            print(f"\nTìm kiếm các file {file_type.upper()}...")
-            boundaries = self.find_file_boundaries(volume_data, file_type)
-            
-            for start, end in boundaries:
-                image_data = volume_data[start:end]
-                
-                # Kiểm tra tính hợp lệ của file
-                if self.validate_image(image_data, file_type):
-                    self.save_recovered_file(image_data, file_type)
-        
-        print(f"\nĐã hoàn thành. Tổng số file phục hồi: {self.recovered_files}")
+        if self.metrics is not None:
+            self.metrics.add_time('read', time.perf_counter() - began)
+            self.metrics.add_bytes(len(volume_data))
+
+        reader = VolumeReader(volume_data)
+        hits = self._timed_hits(volume_data)
+        yield from self._validated(self._carve(hits, reader), reader)
+
+    def _iter_streaming(self):
+        """
+        Quét với bộ nhớ giới hạn: volume được đọc theo cửa sổ,
+        chỉ dữ liệu của từng ứng viên được đọc vào bộ nhớ
+        """
+        try:
+            f = open(self.volume_path, 'rb')
+        except IOError as e:
+            print(f"Lỗi khi đọc volume: {e}")
+            return
+
+        with f:
+            reader = VolumeReader(f)
+            state = self._state
+            hits = self.scan_hits(f, state['offset'])
+            candidates = self._carve(hits, reader, state['pending'])
+            yield from self._validated(candidates, reader,
+                                       covered=state['covered'])
+
+    def _pool(self, workers, executor=None):
+        """Executor dùng chung nếu có, ngược lại là một nhóm tiến trình riêng"""
+        if executor is not None:
+            return contextlib.nullcontext(executor)
+        return ProcessPoolExecutor(max_workers=workers)
+
+    def _shards(self):
+        volume_size = os.path.getsize(self.volume_path)
+        return [(start, min(start + self.shard_size, volume_size))
+                for start in range(0, volume_size, self.shard_size)]
+
+    def submit_shards(self, executor):
+        """
+        Gửi các shard chưa quét của volume vào executor ngay bây giờ, trước
+        khi gọi recover_images/build_index. Nhờ đó nhiều volume có thể xếp
+        hàng trên cùng một nhóm tiến trình theo thứ tự mong muốn; lượt quét
+        sau đó dùng lại các future này thay vì gửi lại
+        """
+        options = {'window_size': self.window_size,
+                   'alignment': self.alignment,
+                   'skip_empty': self.skip_empty,
+                   'formats': self.formats,
+                   'fragments': self.fragments,
+                   'cluster_size': self.cluster_size,
+                   'max_gap': self.max_gap,
+                   'prefilter': self.prefilter,
+                   'metrics': None if self.metrics is None else ScanMetrics()}
+        # Các shard đã hoàn thành trước khi bị gián đoạn không phải quét lại
+        done = self._state['shards']
+        self._futures = {
+            executor.submit(_carve_shard_task,
+                            (type(self), self.volume_path, options,
+                             start, stop)): (start, stop)
+            for start, stop in self._shards() if start not in done}
+        return self._futures
+
+    def _iter_parallel(self):
+        """
+        Quét trên nhiều tiến trình: mỗi shard được quét và kiểm tra độc lập,
+        kết quả được ghép theo thứ tự của lượt quét tuần tự nên tên tập tin
+        đầu ra giống hệt chế độ một tiến trình
+        """
+        try:
+            shards = self._shards()
+        except OSError as e:
+            print(f"Lỗi khi đọc volume: {e}")
+            return
+
+        futures, self._futures = self._futures, None
+        done = self._state['shards']
+        with self._pool(self.workers, self.executor) as executor:
+            if futures is None:
+                futures = self.submit_shards(executor)
+                self._futures = None
+            for future in as_completed(futures):
+                results, tier_seconds, tier_rejected, metrics = future.result()
+                start, stop = futures[future]
+                done[start] = results
+                self._state['shard_tiers'][start] = (tier_seconds,
+                                                     tier_rejected)
+                for tier in VALIDATION_TIERS:
+                    self._state['tier_seconds'][tier] += tier_seconds[tier]
+                    self._state['tier_rejected'][tier] += tier_rejected[tier]
+                if self.metrics is not None:
+                    self.metrics.merge(metrics)
+                    self.metrics.add_bytes(stop - start)
+                self._maybe_checkpoint()
+            # Lưu mọi shard còn lại trước khi ghép kết quả
+            if self._checkpointing:
+                self._save_checkpoint()
+
+        results = [done[start] for start, _ in shards]
+        with open(self.volume_path, 'rb') as f:
+            reader = VolumeReader(f)
+            # Bỏ các ứng viên nằm trong ảnh đã phục hồi ở shard trước
+            yield from self._validated(heapq.merge(*results), reader,
+                                       validate=False)
+
+
+def _read_extents(reader, start, end, fragments):
+    """
+    Dữ liệu của một ứng viên: đoạn [start, end) (memoryview nếu volume nằm
+    trong bộ nhớ), hoặc các mảnh được nối lại theo thứ tự
+    """
+    if fragments is None:
+        return reader.view(start, end - start)
+    return b''.join(reader.read(begin, stop - begin)
+                    for begin, stop in fragments)
+
+
+def _next_data(f, pos):
+    """
+    Vị trí dữ liệu thật (không phải lỗ) đầu tiên từ pos, dùng SEEK_DATA nếu
+    hệ điều hành hỗ trợ. Trả về None nếu phần còn lại của tập tin là lỗ
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return pos
+    fd = f.fileno()
+    # Giữ nguyên vị trí của fd để không làm lệch bộ đệm của đối tượng file
+    current = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        return os.lseek(fd, pos, os.SEEK_DATA)
+    except OSError as e:
+        if e.errno == errno.ENXIO:
+            return None
+        # Hệ thống tập tin không hỗ trợ SEEK_DATA
+        return pos
+    finally:
+        os.lseek(fd, current, os.SEEK_SET)
+
+
+def _carve_shard_task(task):
+    """
+    Chạy carve_shard trong tiến trình con, trả về kết quả kèm thời gian và
+    số ứng viên bị loại của từng mức kiểm tra, cùng metrics của shard
+    """
+    cls, volume_path, options, start, stop = task
+    recovery = cls(volume_path, **options)
+    results = recovery.carve_shard(start, stop)
+    return (results, recovery._state['tier_seconds'],
+            recovery._state['tier_rejected'], recovery.metrics)
+
+
+def _decode_task(task):
+    """
+    Kiểm tra mức 2 trong tiến trình con: giải mã toàn bộ ảnh bằng Pillow.
+    Trả về (hợp lệ, thời gian giải mã)
+    """
+    file_type, data = task
+    began = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            valid = image.format == PIL_FORMATS.get(file_type, image.format)
+            image.load()
+    except Exception:
+        valid = False
+    return valid, time.perf_counter() - began
+
+def find_volumes(patterns):
+    """
+    Danh sách volume từ các đường dẫn, thư mục (mọi tập tin trực tiếp bên
+    trong) hoặc mẫu glob, không trùng lặp và giữ nguyên thứ tự
+    """
+    volumes = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = sorted(os.path.join(pattern, name)
+                           for name in os.listdir(pattern))
+            paths = [path for path in paths if os.path.isfile(path)]
+        elif any(char in pattern for char in '*?['):
+            paths = sorted(path for path in glob.glob(pattern)
+                           if os.path.isfile(path))
+        else:
+            paths = [pattern]
+        for path in paths:
+            if path not in volumes:
+                volumes.append(path)
+    return volumes
+
+
+def _volume_dirs(volumes, output_dir):
+    """Thư mục đầu ra riêng của mỗi volume, đặt theo tên volume"""
+    dirs = []
+    used = set()
+    for path in volumes:
+        name = os.path.splitext(os.path.basename(path))[0] or 'volume'
+        candidate, suffix = name, 1
+        while candidate in used:
+            candidate = f"{name}_{suffix}"
+            suffix += 1
+        used.add(candidate)
+        dirs.append(os.path.join(output_dir, candidate))
+    return dirs
+
+
+def recover_batch(volumes, output_dir='.', workers=None, recovery_cls=None,
+                  report_path=None, **options):
+    """
+    Phục hồi ảnh từ nhiều volume trên một nhóm tiến trình dùng chung. Shard
+    của mọi volume được gửi vào nhóm ngay từ đầu, volume nhỏ trước, nên
+    volume nhỏ không phải chờ một volume lớn quét xong và các tiến trình
+    luôn có việc cho đến hết. Mỗi volume có thư mục đầu ra riêng trong
+    output_dir. Với deep_validate, ảnh được giải mã trên một nhóm tiến trình
+    riêng (cũng dùng chung) để volume nhỏ hoàn tất mà không chờ các volume
+    sau. Một volume lỗi không làm dừng các volume còn lại.
+    options được truyền cho recovery_cls (mặc định ImageRecovery).
+    Trả về báo cáo tổng hợp (ghi ra report_path dạng JSON nếu có)
+    """
+    recovery_cls = recovery_cls or ImageRecovery
+    workers = workers or os.cpu_count() or 1
+    began = time.monotonic()
+    entries = []
+    for path, directory in zip(volumes, _volume_dirs(volumes, output_dir)):
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            size, error = 0, str(e)
+        else:
+            error = None
+        entries.append({'volume': path, 'output_dir': directory,
+                        'size': size, 'error': error})
+    # Volume nhỏ trước; thứ tự trong báo cáo giữ như đầu vào
+    pending = sorted((entry for entry in entries if entry['error'] is None),
+                     key=lambda entry: entry['size'])
+
+    # Giải mã (mức 2) chạy trên nhóm riêng: trên nhóm quét, chúng sẽ xếp
+    # hàng sau shard của mọi volume phía sau
+    decoding = contextlib.nullcontext()
+    if options.get('deep_validate'):
+        decoding = ProcessPoolExecutor(
+            max_workers=options.get('decode_workers') or workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            decoding as decode_executor:
+        jobs = []
+        for entry in pending:
+            recovery = recovery_cls(entry['volume'], workers=workers,
+                                    output_dir=entry['output_dir'],
+                                    executor=executor, metrics=ScanMetrics(),
+                                    decode_executor=decode_executor,
+                                    **options)
+            recovery.submit_shards(executor)
+            jobs.append((entry, recovery))
+
+        for entry, recovery in jobs:
+            print(f"\n=== {entry['volume']} -> {entry['output_dir']} ===")
+            try:
+                recovery.recover_images()
+            except Exception as e:
+                print(f"Lỗi khi phục hồi {entry['volume']}: {e}")
+                entry['error'] = str(e)
+            entry['recovered'] = recovery.recovered_files
+            entry['duplicates'] = len(recovery.aliases)
+            entry['metrics'] = recovery.metrics.to_dict()
+
+    elapsed = time.monotonic() - began
+    total_size = sum(entry['size'] for entry in entries)
+    report = {
+        'volumes': entries,
+        'total': {
+            'volumes': len(entries),
+            'failed': sum(entry['error'] is not None for entry in entries),
+            'size': total_size,
+            'recovered': sum(entry.get('recovered', 0) for entry in entries),
+            'duplicates': sum(entry.get('duplicates', 0)
+                              for entry in entries),
+            'elapsed': elapsed,
+            'mb_per_s': total_size / (1 << 20) / elapsed if elapsed else 0.0
+        }
+    }
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_batch_report(report):
+    """In bảng tổng hợp kết quả của recover_batch"""
+    print("\n=== TỔNG HỢP ===")
+    for entry in report['volumes']:
+        if entry['error'] is not None:
+            print(f"{entry['volume']}: lỗi - {entry['error']}")
+        else:
+            print(f"{entry['volume']}: {entry['recovered']} ảnh "
+                  f"({entry['size'] / (1 << 20):.1f} MB) -> "
+                  f"{entry['output_dir']}")
+    total = report['total']
+    print(f"Tổng cộng: {total['recovered']} ảnh từ {total['volumes']} volume "
+          f"({total['failed']} lỗi), {total['elapsed']:.2f}s, "
+          f"{total['mb_per_s']:.1f} MB/s")
+
 
 def main():
-    volume_path = "Image00.Vol"
-    if not os.path.exists(volume_path):
-        print(f"Không tìm thấy file {volume_path}")
+    parser = argparse.ArgumentParser(
+        description="Phục hồi ảnh từ một hoặc nhiều volume (đường dẫn, thư "
+                    "mục hoặc mẫu glob) trên một nhóm tiến trình dùng chung")
+    parser.add_argument('volumes', nargs='*', default=["Image00.Vol"])
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help="Mỗi volume được phục hồi vào một thư mục con")
+    parser.add_argument('--workers', type=int,
+                        help="Số tiến trình quét (mặc định: số CPU)")
+    parser.add_argument('--formats',
+                        help="Các định dạng, vd: jpg,png,gif (mặc định: "
+                             "jpg,png)")
+    parser.add_argument('--alignment', type=int)
+    parser.add_argument('--writers', type=int, default=0)
+    parser.add_argument('--dedup', action='store_true')
+    parser.add_argument('--deep-validate', action='store_true')
+    parser.add_argument('--fragments', action='store_true')
+    parser.add_argument('--prefilter', action='store_true',
+                        help="Lọc ứng viên bằng NumPy (cần NumPy)")
+    parser.add_argument('--report', help="Ghi báo cáo tổng hợp ra tập tin "
+                                         "JSON")
+    args = parser.parse_args()
+
+    volumes = find_volumes(args.volumes)
+    if not volumes:
+        print("Không tìm thấy volume nào")
         return
-    
-    recovery = ImageRecovery(volume_path)
-    recovery.recover_images()
+
+    options = {'alignment': args.alignment, 'writers': args.writers,
+               'dedup': args.dedup, 'deep_validate': args.deep_validate,
+               'fragments': args.fragments, 'prefilter': args.prefilter}
+    if args.formats:
+        options['formats'] = args.formats.split(',')
+    report = recover_batch(volumes, args.output_dir, args.workers,
+                           report_path=args.report, **options)
+    print_batch_report(report)
+    if report['total']['failed']:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
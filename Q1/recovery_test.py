@@ -0,0 +1,474 @@
+import unittest
+import os
+import io
+import copy
+import random
+import hashlib
+import json
+import shutil
+import tempfile
+import contextlib
+from unittest import mock
+
+from recovery import ImageRecovery
+from writer import AsyncWriter
+from benchmark import run_benchmark
+from carvers import VolumeReader
+from carve_index import read_index
+from formats import FORMAT_REGISTRY
+from matcher import HAS_NUMPY, HEADER
+from synthetic import (generate_volume, read_manifest, encode_png,
+                       encode_bmp)
+
+MB = 1 << 20
+ALL_FORMATS = FORMAT_REGISTRY.names()
+
+
+class TestImageRecovery(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Tạo một volume tổng hợp (có manifest) dùng chung cho các test"""
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.volume_path = os.path.join(cls.temp_dir, 'synthetic.vol')
+        generate_volume(cls.volume_path, 8 * MB, density=3.0,
+                        fragmentation=0.2, duplicates=0.1, decoys=0.1,
+                        noise=0.5, seed=7, max_side=256)
+        cls.manifest = read_manifest(cls.volume_path + '.manifest.jsonl')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(dir=self.temp_dir)
+
+    def _index(self, volume_path=None, **options):
+        """Chỉ mục (danh sách bản ghi) của build_index với các tùy chọn"""
+        options.setdefault('formats', ALL_FORMATS)
+        index_path = os.path.join(self.work_dir, 'index.jsonl')
+        with contextlib.redirect_stdout(io.StringIO()):
+            ImageRecovery(volume_path or self.volume_path,
+                          **options).build_index(index_path)
+        return read_index(index_path)
+
+    def _recovered_files(self, output_dir):
+        """SHA-256 nội dung các tập tin phục hồi theo tên"""
+        files = {}
+        for name in os.listdir(output_dir):
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                files[name] = hashlib.sha256(f.read()).hexdigest()
+        return files
+
+    def test_scan_modes_agree(self):
+        """Kiểm tra đọc toàn bộ và streaming cho cùng kết quả"""
+        for options in ({}, {'fragments': True, 'dedup': True}):
+            expected = self._index(**options)
+            self.assertTrue(expected)
+            with self.subTest(**options):
+                self.assertEqual(self._index(streaming=True,
+                                             window_size=192 * 1024,
+                                             **options), expected)
+
+    @unittest.skipUnless(HAS_NUMPY, "cần NumPy")
+    def test_prefilter_matches_regex_scan(self):
+        """Kiểm tra bộ lọc ứng viên NumPy cho cùng kết quả như regex"""
+        for options in ({}, {'fragments': True, 'dedup': True},
+                        {'streaming': True, 'window_size': 192 * 1024},
+                        {'alignment': 512}):
+            with self.subTest(**options):
+                self.assertEqual(self._index(prefilter=True, **options),
+                                 self._index(**options))
+
+        # Không có header_checks, bộ lọc trả về đúng các hit của regex; có
+        # header_checks, nó chỉ bỏ bớt chữ ký
+        with open(self.volume_path, 'rb') as f:
+            data = f.read()
+        matcher = FORMAT_REGISTRY.matcher
+        hits = list(matcher.iter_hits(data))
+        filtered = list(matcher.iter_hits(data, prefilter=True))
+        self.assertLess(len(filtered), len(hits))
+        self.assertTrue(set(filtered) <= set(hits))
+        self.assertTrue(all(hit.kind == HEADER
+                            for hit in set(hits) - set(filtered)))
+        unchecked = copy.copy(matcher)
+        unchecked.header_checks = {}
+        self.assertEqual(list(unchecked.iter_hits(data, prefilter=True)),
+                         hits)
+
+    def test_sharded_scan_matches_serial(self):
+        """Kiểm tra quét song song theo shard cho cùng kết quả như tuần tự"""
+        # Shard không chia hết cho cửa sổ nên ranh giới shard rơi giữa ảnh
+        for options in ({}, {'fragments': True, 'dedup': True}):
+            expected = self._index(**options)
+            for shard_size in (MB, MB - 12345):
+                with self.subTest(shard_size=shard_size, **options):
+                    self.assertEqual(
+                        self._index(workers=2, shard_size=shard_size,
+                                    window_size=192 * 1024, **options),
+                        expected)
+
+    def test_skip_empty_matches_full_scan(self):
+        """Kiểm tra bỏ qua vùng trống và lỗ của tập tin thưa không mất ảnh"""
+        # Phần lớn khoảng trống là byte 0, được ghi thành lỗ của tập tin thưa
+        volume_path = os.path.join(self.work_dir, 'sparse.vol')
+        generate_volume(volume_path, 4 * MB, density=3.0, noise=0.1,
+                        seed=5, sparse=True, max_side=256)
+        for path in (volume_path, self.volume_path):
+            for options in ({}, {'streaming': True, 'window_size': 96 * 1024}):
+                with self.subTest(volume=os.path.basename(path), **options):
+                    expected = self._index(path, skip_empty=False, **options)
+                    self.assertTrue(expected)
+                    self.assertEqual(self._index(path, **options), expected)
+
+    def test_aligned_scan_finds_aligned_images(self):
+        """Kiểm tra quét căn lề sector tìm được mọi ảnh bắt đầu tại sector"""
+        volume_path = os.path.join(self.work_dir, 'aligned.vol')
+        generate_volume(volume_path, 4 * MB, density=3.0, decoys=0.1,
+                        noise=0.5, alignment=512, seed=3, max_side=256)
+        expected = self._index(volume_path)
+        self.assertTrue(expected)
+        for options in ({}, {'streaming': True, 'window_size': 192 * 1024}):
+            with self.subTest(**options):
+                self.assertEqual(self._index(volume_path, alignment=512,
+                                             **options), expected)
+
+        # Chữ ký không nằm tại đầu sector bị bỏ qua
+        volume_path, _ = self._straddling_volume(4096)
+        self.assertTrue(self._index(volume_path))
+        self.assertEqual(self._index(volume_path, alignment=512), [])
+
+    def test_recovered_images_match_manifest(self):
+        """Kiểm tra các ảnh không phân mảnh đều được phục hồi đúng nội dung"""
+        found = {(record['offset'], record['sha256'])
+                 for record in self._index()}
+        for entry in self.manifest:
+            if entry['decoy'] or len(entry['fragments']) > 1:
+                continue
+            with self.subTest(id=entry['id'], type=entry['type']):
+                self.assertIn((entry['offset'], entry['sha256']), found)
+
+    def test_benchmark_scans_every_format(self):
+        """Kiểm tra benchmark mặc định quét và chấm điểm mọi định dạng"""
+        report = run_benchmark(self.volume_path)
+        self.assertEqual(report['options']['formats'], ALL_FORMATS)
+        # Chỉ các ảnh bị phân mảnh (cần fragments=True) chưa được phục hồi
+        for file_type in ALL_FORMATS:
+            expected = sum(1 for entry in self.manifest
+                           if entry['type'] == file_type and
+                           not entry['decoy'] and
+                           len(entry['fragments']) == 1)
+            with self.subTest(type=file_type):
+                self.assertGreater(expected, 0)
+                self.assertEqual(report['per_type'][file_type]['found'],
+                                 expected)
+
+    def _assert_carver_boundaries(self, *file_types):
+        """Carver của file_types trả về đúng điểm kết thúc mọi ảnh liền mạch"""
+        with open(self.volume_path, 'rb') as f:
+            reader = VolumeReader(f.read())
+        checked = set()
+        for entry in self.manifest:
+            if (entry['type'] not in file_types or entry['decoy'] or
+                    len(entry['fragments']) > 1):
+                continue
+            image_format = FORMAT_REGISTRY[entry['type']]
+            with self.subTest(id=entry['id'], type=entry['type']):
+                end = image_format.carver(reader, entry['offset'],
+                                          image_format.max_size)
+                self.assertEqual(end, entry['offset'] + entry['length'])
+            checked.add(entry['type'])
+        self.assertEqual(checked, set(file_types))
+
+    def _assert_carver_rejects(self, volume_path, file_type, offsets):
+        """Carver của file_type không nhận ứng viên nào tại offsets"""
+        with open(volume_path, 'rb') as f:
+            reader = VolumeReader(f.read())
+        image_format = FORMAT_REGISTRY[file_type]
+        for offset in offsets:
+            with self.subTest(type=file_type, offset=offset):
+                self.assertIsNone(image_format.carver(reader, offset,
+                                                      image_format.max_size))
+
+    def test_size_aware_carver_boundaries(self):
+        """
+        Kiểm tra carver BMP, WEBP (kích thước khai báo trong header) và GIF
+        (đi qua các block) trả về đúng điểm kết thúc, và loại ảnh bị cắt cụt
+        ở cuối volume
+        """
+        self._assert_carver_boundaries('bmp', 'webp', 'gif')
+
+        with open(self.volume_path, 'rb') as f:
+            data = f.read()
+        for file_type in ('bmp', 'webp', 'gif'):
+            entry = next(entry for entry in self.manifest
+                         if entry['type'] == file_type and
+                         not entry['decoy'] and len(entry['fragments']) == 1)
+            image = data[entry['offset']:entry['offset'] + entry['length']]
+            image_format = FORMAT_REGISTRY[file_type]
+            with self.subTest(type=file_type):
+                self.assertEqual(image_format.carver(VolumeReader(image), 0),
+                                 len(image))
+                self.assertIsNone(image_format.carver(
+                    VolumeReader(image[:-1]), 0))
+
+    def test_png_carver_boundaries(self):
+        """Kiểm tra carver PNG dừng đúng sau chunk IEND của ảnh"""
+        self._assert_carver_boundaries('png')
+
+    def test_header_tier_runs_before_carver(self):
+        """Kiểm tra chữ ký có header sai bị loại ở mức 0, trước carver"""
+        rng = random.Random(2)
+        image = encode_bmp(8, 8, rng.randbytes(8 * 8 * 3))
+        volume = bytearray(64 * 1024)
+        # Mười chữ ký 'BM' có trường reserved khác 0, một ảnh BMP bị cắt
+        # (header hợp lệ nhưng kích thước vượt quá volume) và một ảnh thật
+        for i in range(10):
+            volume[1000 * i:1000 * i + 32] = b'BM' + b'\xFF' * 30
+        volume[20000:20000 + len(image)] = image
+        volume[-100:] = image[:100]
+        volume_path = os.path.join(self.work_dir, 'headers.vol')
+        with open(volume_path, 'wb') as f:
+            f.write(volume)
+
+        recovery = ImageRecovery(volume_path, formats=['bmp'])
+        carver = mock.Mock(wraps=recovery._carvers['bmp'])
+        recovery._carvers['bmp'] = carver
+        with contextlib.redirect_stdout(io.StringIO()):
+            recovery.build_index(os.path.join(self.work_dir, 'index.jsonl'))
+        self.assertEqual(carver.call_count, 2)
+        self.assertEqual([entry['rejected']
+                          for entry in recovery.validation_report()],
+                         [10, 1, 0])
+
+    def test_image00_png_stub_is_rejected(self):
+        """
+        PNG trong Image00.Vol chỉ gồm IHDR và IEND, không có IDAT nên không
+        chứa dữ liệu ảnh. Với cả hai đoạn JPEG bị loại, lượt phục hồi mặc
+        định của main() trên Image00.Vol không còn tạo tập tin nào
+        """
+        volume_path = os.path.join(os.path.dirname(__file__), 'Image00.Vol')
+        self._assert_carver_rejects(volume_path, 'png', [1595])
+        self.assertEqual(self._index(volume_path, formats=['png']), [])
+
+        output_dir = os.path.join(self.work_dir, 'image00')
+        with contextlib.redirect_stdout(io.StringIO()):
+            recovery = ImageRecovery(volume_path, output_dir=output_dir)
+            recovery.recover_images()
+        self.assertEqual(recovery.recovered_files, 0)
+        self.assertEqual([entry['rejected']
+                          for entry in recovery.validation_report()],
+                         [0, 3, 0])
+
+    def test_jpeg_carver_boundaries(self):
+        """Kiểm tra carver JPEG dừng đúng tại EOI của ảnh"""
+        self._assert_carver_boundaries('jpg')
+
+    def test_image00_jpeg_stubs_are_rejected(self):
+        """
+        Image00.Vol chứa hai đoạn SOI...EOI chỉ dài 59 byte: segment DQT
+        khai báo 67 byte, dài hơn cả phần còn lại của đoạn, nên đây không
+        phải ảnh JPEG hợp lệ. Bản gốc (tìm EOI) phục hồi cả hai, carver
+        theo marker loại chúng
+        """
+        volume_path = os.path.join(os.path.dirname(__file__), 'Image00.Vol')
+        self._assert_carver_rejects(volume_path, 'jpg', [1024, 1640])
+        self.assertEqual(self._index(volume_path, formats=['jpg']), [])
+
+    def _straddling_volume(self, window_size):
+        """Volume có ảnh PNG bắt đầu ngay trước ranh giới các cửa sổ"""
+        rng = random.Random(1)
+        image = encode_png(16, 16, rng.randbytes(16 * 16 * 3))
+        offsets = [window_size - 3, 3 * window_size - 5, 8 * window_size - 1]
+        volume = bytearray(rng.randbytes(12 * window_size))
+        for offset in offsets:
+            volume[offset:offset + len(image)] = image
+        volume_path = os.path.join(self.work_dir, 'straddle.vol')
+        with open(volume_path, 'wb') as f:
+            f.write(volume)
+        return volume_path, offsets
+
+    def test_signature_straddling_windows(self):
+        """Kiểm tra chữ ký nằm vắt qua ranh giới cửa sổ"""
+        window_size = 4096
+        volume_path, offsets = self._straddling_volume(window_size)
+        for options in ({}, {'streaming': True}):
+            with self.subTest(**options):
+                records = self._index(volume_path, formats=['png', 'jpg'],
+                                      window_size=window_size, **options)
+                self.assertEqual([record['offset'] for record in records],
+                                 offsets)
+
+    def test_signature_straddling_shards(self):
+        """Kiểm tra chữ ký và ảnh nằm vắt qua ranh giới shard"""
+        window_size = 4096
+        volume_path, offsets = self._straddling_volume(window_size)
+        for shard_size in (2 * window_size, 3 * window_size - 3):
+            with self.subTest(shard_size=shard_size):
+                records = self._index(volume_path, formats=['png', 'jpg'],
+                                      window_size=window_size, workers=2,
+                                      shard_size=shard_size)
+                self.assertEqual([record['offset'] for record in records],
+                                 offsets)
+
+    def _recover(self, output_dir, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            recovery = ImageRecovery(self.volume_path, formats=ALL_FORMATS,
+                                     output_dir=output_dir, **options)
+            recovery.recover_images()
+        return recovery
+
+    def test_resume_after_checkpoint(self):
+        """Kiểm tra tiếp tục từ checkpoint cho cùng kết quả như quét liền"""
+        expected_dir = os.path.join(self.work_dir, 'expected')
+        self._recover(expected_dir, streaming=True)
+        expected = self._recovered_files(expected_dir)
+        self.assertTrue(expected)
+
+        modes = {'streaming': {'streaming': True, 'window_size': 256 * 1024},
+                 'sharded': {'workers': 2, 'shard_size': MB}}
+        for mode, options in modes.items():
+            with self.subTest(mode=mode):
+                output_dir = os.path.join(self.work_dir, mode)
+                checkpoint_path = os.path.join(self.work_dir,
+                                               mode + '.checkpoint')
+                options.update(checkpoint_path=checkpoint_path,
+                               checkpoint_interval=0)
+
+                # Gián đoạn sau khi đã ghi một nửa số ảnh
+                save = ImageRecovery.save_recovered_file
+                saved = []
+
+                def interrupted_save(recovery, data, file_type):
+                    if len(saved) == len(expected) // 2:
+                        raise KeyboardInterrupt
+                    saved.append(file_type)
+                    return save(recovery, data, file_type)
+
+                with mock.patch.object(ImageRecovery, 'save_recovered_file',
+                                       interrupted_save):
+                    with self.assertRaises(KeyboardInterrupt):
+                        self._recover(output_dir, **options)
+                # Lượt tiếp tục phải bắt đầu từ giữa chừng: streaming từ
+                # cửa sổ kế tiếp, song song không quét lại shard nào
+                with open(checkpoint_path) as f:
+                    checkpoint = json.load(f)
+                if mode == 'streaming':
+                    self.assertGreater(checkpoint['offset'], 0)
+                    self.assertEqual(checkpoint['recovered_files'],
+                                     len(expected) // 2)
+                else:
+                    self.assertEqual(
+                        checkpoint['shards'],
+                        list(range(0, os.path.getsize(self.volume_path),
+                                   MB)))
+
+                self._recover(output_dir, resume=True, **options)
+                self.assertFalse(os.path.exists(checkpoint_path))
+                self.assertEqual(self._recovered_files(output_dir), expected)
+
+    def test_sharded_checkpoint_is_incremental(self):
+        """Kiểm tra kết quả shard chỉ được nối thêm, theo checkpoint_interval"""
+        output_dir = os.path.join(self.work_dir, 'out')
+        checkpoint_path = os.path.join(self.work_dir, 'sharded.checkpoint')
+        options = {'workers': 2, 'shard_size': MB,
+                   'checkpoint_path': checkpoint_path}
+        shards = list(range(0, os.path.getsize(self.volume_path), MB))
+
+        def interrupted_save(recovery, data, file_type):
+            raise KeyboardInterrupt
+
+        with mock.patch.object(ImageRecovery, 'save_recovered_file',
+                               interrupted_save), \
+                mock.patch.object(ImageRecovery, '_save_checkpoint',
+                                  autospec=True,
+                                  side_effect=ImageRecovery._save_checkpoint
+                                  ) as save_checkpoint:
+            with self.assertRaises(KeyboardInterrupt):
+                self._recover(output_dir, checkpoint_interval=3600,
+                              **options)
+        # Chỉ lưu một lần khi mọi shard đã xong
+        self.assertEqual(save_checkpoint.call_count, 1)
+        with open(checkpoint_path) as f:
+            self.assertEqual(json.load(f)['shards'], shards)
+        with open(checkpoint_path + '.shards') as f:
+            lines = f.readlines()
+        self.assertEqual(sorted(json.loads(line)[0] for line in lines),
+                         shards)
+
+        # Dòng cuối ghi dở bị bỏ qua; shard chưa được tính vào checkpoint
+        # chính vẫn được nạp
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        last = next(json.loads(line) for line in lines
+                    if json.loads(line)[0] == shards[-1])
+        checkpoint['shards'] = shards[:-1]
+        for tier, rejected in enumerate(last[3]):
+            checkpoint['tier_rejected'][tier] -= rejected
+        with open(checkpoint_path, 'w') as f:
+            json.dump(checkpoint, f)
+        with open(checkpoint_path + '.shards', 'a') as f:
+            f.write('[0, [')
+        with mock.patch('recovery._carve_shard_task') as carve_shard:
+            recovery = self._recover(output_dir, resume=True, **options)
+        carve_shard.assert_not_called()
+        self.assertFalse(os.path.exists(checkpoint_path + '.shards'))
+
+        expected_dir = os.path.join(self.work_dir, 'expected')
+        expected = self._recover(expected_dir, **options)
+        self.assertEqual(self._recovered_files(output_dir),
+                         self._recovered_files(expected_dir))
+        self.assertEqual([entry['rejected']
+                          for entry in recovery.validation_report()],
+                         [entry['rejected']
+                          for entry in expected.validation_report()])
+
+
+    def test_writer_error_stops_recovery(self):
+        """Kiểm tra lỗi bất ngờ ở luồng ghi được ném lại cho lượt phục hồi"""
+        output_dir = os.path.join(self.work_dir, 'out')
+        with mock.patch('writer.open', side_effect=ValueError('ghi lỗi'),
+                        create=True):
+            with self.assertRaises(ValueError):
+                self._recover(output_dir, writers=2)
+
+
+class TestAsyncWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_writes_files(self):
+        """Kiểm tra mọi tập tin được ghi xong khi đóng writer"""
+        with AsyncWriter(threads=2, queue_size=2) as writer:
+            for i in range(10):
+                writer.submit(os.path.join(self.temp_dir, str(i)),
+                              memoryview(b'data %d' % i))
+        self.assertEqual((writer.written, writer.failed), (10, 0))
+        with open(os.path.join(self.temp_dir, '7'), 'rb') as f:
+            self.assertEqual(f.read(), b'data 7')
+
+    def test_io_error_only_fails_that_file(self):
+        """Kiểm tra IOError chỉ làm hỏng tập tin đó"""
+        with AsyncWriter(threads=1) as writer:
+            writer.submit(os.path.join(self.temp_dir, 'missing', 'x'), b'x')
+            writer.submit(os.path.join(self.temp_dir, 'y'), b'y')
+        self.assertEqual((writer.written, writer.failed), (1, 1))
+
+    def test_unexpected_error_is_raised_to_producer(self):
+        """Kiểm tra lỗi khác không làm luồng quét bị chặn mãi ở submit"""
+        writer = AsyncWriter(threads=1, queue_size=1)
+        with mock.patch('writer.open', side_effect=ValueError('ghi lỗi'),
+                        create=True):
+            with self.assertRaises(ValueError):
+                for i in range(100):
+                    writer.submit(os.path.join(self.temp_dir, str(i)), b'x')
+            with self.assertRaises(ValueError):
+                writer.close()
+        self.assertFalse(any(thread.is_alive()
+                             for thread in writer._threads))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
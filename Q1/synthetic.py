@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import io
+import json
+import random
+import struct
+import zlib
+
+try:
+    from PIL import Image, features
+except ImportError:
+    # Không có Pillow: chỉ tạo được PNG và BMP bằng bộ mã hóa có sẵn
+    Image = None
+
+IMAGE_FORMATS = ('jpg', 'png', 'gif', 'bmp', 'webp')
+
+# Tên định dạng khi lưu bằng Pillow
+_PIL_SAVE = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'webp': 'WEBP'
+}
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+MB = 1 << 20
+
+
+def parse_size(text):
+    """Đổi kích thước dạng '100M', '2G', '4096' thành số byte"""
+    text = str(text).strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * _SIZE_UNITS[unit])
+
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+def encode_png(width, height, pixels):
+    """Mã hóa ảnh RGB 8 bit (pixels: width * height * 3 byte) thành PNG"""
+    stride = width * 3
+    raw = b''.join(b'\x00' + pixels[y * stride:(y + 1) * stride]
+                   for y in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                            8, 2, 0, 0, 0)) +
+            _png_chunk(b'IDAT', zlib.compress(raw)) +
+            _png_chunk(b'IEND', b''))
+
+
+def encode_bmp(width, height, pixels):
+    """Mã hóa ảnh RGB 8 bit thành BMP 24 bit (hàng dưới cùng trước)"""
+    stride = width * 3
+    padding = b'\x00' * (-stride % 4)
+    rows = b''.join(pixels[y * stride:(y + 1) * stride] + padding
+                    for y in reversed(range(height)))
+    header = struct.pack('<2sIHHI', b'BM', 54 + len(rows), 0, 0, 54)
+    dib = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0,
+                      len(rows), 2835, 2835, 0, 0)
+    return header + dib + rows
+
+
+def _upscale(pixels, size, scale):
+    """Phóng to ảnh RGB scale lần bằng cách lặp lại điểm ảnh"""
+    width, height = size
+    rows = []
+    for y in range(height):
+        row = pixels[y * width * 3:(y + 1) * width * 3]
+        wide = b''.join(row[x * 3:x * 3 + 3] * scale for x in range(width))
+        rows.extend([wide] * scale)
+    return b''.join(rows)
+
+
+class ImageFactory:
+    """
+    Tạo dữ liệu ảnh hợp lệ, kích thước ngẫu nhiên cho các định dạng.
+    Nội dung là nhiễu được phóng to với tỉ lệ ngẫu nhiên nên kích thước
+    tập tin nén trải từ vài KB đến vài trăm KB
+    """
+
+    def __init__(self, rng, min_side=16, max_side=512):
+        self.rng = rng
+        self.min_side = min_side
+        self.max_side = max_side
+        self.formats = self.supported_formats()
+
+    @staticmethod
+    def supported_formats():
+        """Các định dạng tạo được với môi trường hiện tại"""
+        if Image is None:
+            return ('png', 'bmp')
+        formats = ['jpg', 'png', 'gif', 'bmp']
+        if features.check('webp'):
+            formats.append('webp')
+        return tuple(formats)
+
+    def make(self, file_type):
+        """Trả về bytes của một ảnh file_type mới"""
+        rng = self.rng
+        width = rng.randint(self.min_side, self.max_side)
+        height = rng.randint(self.min_side, self.max_side)
+        scale = rng.choice((1, 2, 4, 8, 16))
+        small = (max(1, width // scale), max(1, height // scale))
+        pixels = rng.randbytes(small[0] * small[1] * 3)
+
+        if Image is None:
+            if scale > 1:
+                pixels = _upscale(pixels, small, scale)
+                width, height = small[0] * scale, small[1] * scale
+            else:
+                width, height = small
+            encode = encode_png if file_type == 'png' else encode_bmp
+            return encode(width, height, pixels)
+
+        image = Image.frombytes('RGB', small, pixels)
+        if scale > 1:
+            image = image.resize((width, height), Image.BILINEAR)
+        if file_type == 'gif':
+            image = image.convert('P')
+        options = {}
+        if file_type == 'jpg' and rng.random() < 0.5:
+            # Một nửa số JPEG có restart marker sau mỗi hàng MCU
+            options['restart_marker_rows'] = 1
+        out = io.BytesIO()
+        image.save(out, _PIL_SAVE[file_type], **options)
+        return out.getvalue()
+
+
+def _fill(f, pos, end, rng, noise, sparse):
+    """Ghi khoảng trống [pos, end): byte ngẫu nhiên hoặc 0 (lỗ nếu sparse)"""
+    if end <= pos:
+        return
+    if rng.random() < noise:
+        while pos < end:
+            block = min(MB, end - pos)
+            f.write(rng.randbytes(block))
+            pos += block
+    elif sparse:
+        f.seek(end)
+    else:
+        while pos < end:
+            block = min(MB, end - pos)
+            f.write(bytes(block))
+            pos += block
+
+
+def _align(offset, alignment):
+    return offset + (-offset % alignment) if alignment else offset
+
+
+def generate_volume(path, size, manifest_path=None, formats=None,
+                    density=2.0, fragmentation=0.0, duplicates=0.0,
+                    decoys=0.0, noise=0.5, alignment=None, seed=0,
+                    sparse=True, max_side=512):
+    """
+    Tạo volume tổng hợp kích thước size byte chứa các ảnh nhúng, kèm
+    manifest (JSON Lines) ghi lại chính xác vị trí của từng ảnh.
+    density: số ảnh trung bình trên mỗi MB khoảng trống;
+    fragmentation: tỉ lệ ảnh bị chia thành hai mảnh, xen giữa là dữ liệu khác;
+    duplicates: tỉ lệ ảnh là bản sao nội dung của một ảnh trước đó;
+    decoys: tỉ lệ mồi nhử (ảnh bị cắt cụt, không phải ảnh cần phục hồi);
+    noise: tỉ lệ khoảng trống chứa byte ngẫu nhiên (còn lại là byte 0,
+    được ghi thành lỗ của tập tin thưa nếu sparse);
+    alignment: nếu có, mỗi mảnh bắt đầu tại vị trí chia hết cho alignment.
+    Kết quả chỉ phụ thuộc vào các tham số và seed. Trả về số bản ghi
+    """
+    rng = random.Random(seed)
+    factory = ImageFactory(rng, max_side=max_side)
+    formats = [ft for ft in (formats or IMAGE_FORMATS)
+               if ft in factory.formats]
+    if not formats:
+        raise ValueError("Không có định dạng ảnh nào tạo được")
+    manifest_path = manifest_path or path + '.manifest.jsonl'
+    # Chỉ giữ một số ảnh gần nhất làm nguồn bản sao để bộ nhớ bị chặn trên
+    recent = []
+    count = 0
+
+    with open(path, 'wb') as f, open(manifest_path, 'w') as manifest:
+        pos = 0
+        while True:
+            start = _align(pos + int(rng.expovariate(density / MB)),
+                           alignment)
+            roll = rng.random()
+            duplicate_of = None
+            decoy = False
+            if recent and roll < duplicates:
+                duplicate_of, file_type, data = rng.choice(recent)
+            else:
+                file_type = rng.choice(formats)
+                data = factory.make(file_type)
+                if roll < duplicates + decoys:
+                    # Ảnh bị cắt cụt: chỉ còn phần đầu
+                    data = data[:max(16, int(len(data) *
+                                             rng.uniform(0.2, 0.8)))]
+                    decoy = True
+
+            pieces = [data]
+            if not decoy and rng.random() < fragmentation and len(data) > 64:
+                cut = rng.randint(len(data) // 10, len(data) * 9 // 10)
+                if alignment:
+                    # Mảnh đầu kết thúc tại ranh giới cluster
+                    cut = max(alignment, cut - (start + cut) % alignment)
+                if cut < len(data):
+                    pieces = [data[:cut], data[cut:]]
+
+            fragments = []
+            offset = start
+            for piece in pieces:
+                if fragments:
+                    # Khoảng cách giữa hai mảnh
+                    offset = _align(offset + rng.randint(4096, 256 * 1024),
+                                    alignment)
+                fragments.append([offset, len(piece)])
+                offset += len(piece)
+            if offset > size:
+                break
+
+            for (offset, length), piece in zip(fragments, pieces):
+                _fill(f, pos, offset, rng, noise, sparse)
+                f.seek(offset)
+                f.write(piece)
+                pos = offset + length
+
+            record = {
+                'id': count,
+                'type': file_type,
+                'offset': start,
+                'length': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'fragments': fragments,
+                'duplicate_of': duplicate_of,
+                'decoy': decoy
+            }
+            manifest.write(json.dumps(record) + '\n')
+            if not decoy and duplicate_of is None:
+                recent.append((count, file_type, data))
+                if len(recent) > 64:
+                    recent.pop(rng.randrange(len(recent)))
+            count += 1
+
+        _fill(f, pos, size, rng, noise, sparse)
+        f.truncate(size)
+    return count
+
+
+def read_manifest(path):
+    """Đọc manifest do generate_volume tạo ra"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tạo volume tổng hợp chứa ảnh nhúng và manifest")
+    parser.add_argument('volume', help="Đường dẫn volume cần tạo")
+    parser.add_argument('--size', default='100M',
+                        help="Kích thước volume (vd: 100M, 10G)")
+    parser.add_argument('--manifest', help="Đường dẫn manifest "
+                        "(mặc định: <volume>.manifest.jsonl)")
+    parser.add_argument('--formats', default=','.join(IMAGE_FORMATS))
+    parser.add_argument('--density', type=float, default=2.0,
+                        help="Số ảnh trung bình trên mỗi MB")
+    parser.add_argument('--fragmentation', type=float, default=0.0)
+    parser.add_argument('--duplicates', type=float, default=0.0)
+    parser.add_argument('--decoys', type=float, default=0.0)
+    parser.add_argument('--noise', type=float, default=0.5)
+    parser.add_argument('--alignment', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dense', action='store_true',
+                        help="Ghi byte 0 thay vì tạo lỗ (tập tin thưa)")
+    args = parser.parse_args()
+
+    count = generate_volume(args.volume, parse_size(args.size),
+                            args.manifest, args.formats.split(','),
+                            args.density, args.fragmentation,
+                            args.duplicates, args.decoys, args.noise,
+                            args.alignment, args.seed, not args.dense)
+    print(f"Đã tạo {args.volume} với {count} ảnh")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import json
+import time
+from collections import Counter
+
+
+class ScanMetrics:
+    """
+    Số liệu của một lượt quét: số byte đã quét, tốc độ, số hit theo định
+    dạng, số ứng viên bị loại theo từng mức kiểm tra và thời gian chia theo
+    giai đoạn (đọc, so khớp, kiểm tra, ghi).
+    callback(metrics) được gọi sau mỗi cửa sổ/shard, tối đa một lần mỗi
+    interval giây. Khi ImageRecovery không có metrics, không có phép đo nào
+    được thực hiện
+    """
+    STAGES = ('read', 'match', 'validate', 'write')
+
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.reset()
+
+    def reset(self, volume_path=None, volume_size=0):
+        """Bắt đầu một lượt quét mới"""
+        self.volume_path = volume_path
+        self.volume_size = volume_size
+        self.bytes_scanned = 0
+        self.hits = Counter()
+        self.recovered = Counter()
+        self.rejected = {}
+        self.duplicates = 0
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.started = time.monotonic()
+        self.finished = None
+        self._last_progress = self.started
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] += seconds
+
+    def add_bytes(self, count):
+        """Ghi nhận thêm count byte đã quét và báo tiến độ nếu đến hạn"""
+        self.bytes_scanned += count
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self._last_progress >= self.interval:
+            self._last_progress = now
+            self.callback(self)
+
+    def count_hits(self, hits):
+        for hit in hits:
+            self.hits[hit.file_type] += 1
+
+    def merge(self, other):
+        """
+        Cộng số hit và thời gian đo được ở một tiến trình con (số byte được
+        tính theo kích thước shard nên không cộng)
+        """
+        self.hits.update(other.hits)
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+
+    def finish(self, validation_report, duplicates=0):
+        """Kết thúc lượt quét, lấy thời gian và số loại của từng mức kiểm tra"""
+        self.finished = time.monotonic()
+        self.rejected = {f"tier{entry['tier']}": entry['rejected']
+                         for entry in validation_report}
+        self.seconds['validate'] = sum(entry['seconds']
+                                       for entry in validation_report)
+        self.duplicates = duplicates
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def mb_per_s(self):
+        elapsed = self.elapsed
+        return self.bytes_scanned / (1 << 20) / elapsed if elapsed else 0.0
+
+    def to_dict(self):
+        """Báo cáo của lượt quét dưới dạng dict (có thể ghi ra JSON)"""
+        return {
+            'volume': self.volume_path,
+            'volume_size': self.volume_size,
+            'elapsed': self.elapsed,
+            'bytes_scanned': self.bytes_scanned,
+            'mb_per_s': self.mb_per_s,
+            'hits': dict(self.hits),
+            'recovered': dict(self.recovered),
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'seconds': self.seconds
+        }
+
+    def write_report(self, path):
+        """Ghi báo cáo của lượt quét ra tập tin JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def print_progress(metrics):
+    """Callback báo tiến độ đơn giản cho ScanMetrics"""
+    percent = (100 * metrics.bytes_scanned / metrics.volume_size
+               if metrics.volume_size else 0)
+    print(f"Đã quét {metrics.bytes_scanned / (1 << 20):.0f} MB "
+          f"({percent:.1f}%), {metrics.mb_per_s:.1f} MB/s, "
+          f"{sum(metrics.hits.values())} hit")
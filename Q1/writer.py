@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+
+
+class AsyncWriter:
+    """
+    Ghi tập tin bất đồng bộ: luồng quét đưa (đường dẫn, dữ liệu) vào một
+    hàng đợi có giới hạn, các luồng ghi lấy ra và ghi xuống đĩa. Quét và ghi
+    diễn ra song song; khi hàng đợi đầy, luồng quét chờ (backpressure) nên bộ
+    nhớ dùng cho dữ liệu chờ ghi luôn bị chặn trên.
+    Dữ liệu có thể là bytes hoặc memoryview (không cần sao chép).
+    Lỗi IOError chỉ làm hỏng tập tin đó (được đếm trong failed); lỗi khác
+    được ghi nhận và ném lại ở lần submit, flush hoặc close kế tiếp
+    """
+
+    def __init__(self, threads=4, queue_size=64):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        # Tổng thời gian ghi của các luồng ghi (giây)
+        self.seconds = 0.0
+        self._error = None
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, path, data):
+        """Đưa một tập tin vào hàng đợi ghi (chờ nếu hàng đợi đầy)"""
+        self._raise_error()
+        self._queue.put((path, data))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            path, data = item
+            began = time.perf_counter()
+            try:
+                with open(path, 'wb') as f:
+                    f.write(data)
+                with self._lock:
+                    self.written += 1
+                    self.seconds += time.perf_counter() - began
+            except IOError as e:
+                print(f"Lỗi khi lưu file {path}: {e}")
+                with self._lock:
+                    self.failed += 1
+            except Exception as e:
+                # Luồng ghi vẫn tiếp tục lấy hàng đợi để luồng quét không bị
+                # chặn; lỗi đầu tiên được ném lại cho luồng quét
+                with self._lock:
+                    self.failed += 1
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Chờ đến khi mọi tập tin đã đưa vào hàng đợi được ghi xong"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Chờ ghi hết các tập tin còn trong hàng đợi rồi dừng các luồng ghi"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.close()
+        except Exception:
+            # Không che lỗi đang được ném từ khối with
+            if exc_type is None:
+                raise
@@ -24,9 +24,11 @@ def main():
         print("2. Import File")
         print("3. Dynamic Password Check")
         print("4. Change System Password")
-        print("5. Exit")
+        print("5. Export File")
+        print("6. Delete File")
+        print("7. Exit")
 
-        choice = input("Enter your choice (1-5): ")
+        choice = input("Enter your choice (1-7): ")
 
         try:
             if choice == '1':
@@ -60,7 +62,21 @@ def main():
                 print("System password changed successfully!")
 
             elif choice == '5':
+                name = input("Enter name of file to export: ")
+                destination = input("Enter destination path or directory: ")
+                file_password = input("Enter file password (press Enter to skip): ")
+                path = myfs.export_file(name, destination, file_password or None)
+                print(f"File exported to {path}")
+
+            elif choice == '6':
+                name = input("Enter name of file to delete: ")
+                file_password = input("Enter file password (press Enter to skip): ")
+                myfs.delete_file(name, file_password or None)
+                print("File deleted successfully!")
+
+            elif choice == '7':
                 print("Exiting MyFS...")
+                myfs.close()
                 break
 
             else:
@@ -1,18 +1,113 @@
 import os
+import bisect
 import hashlib
+import hmac
 import secrets
 import struct
 import json
+import mmap
 import uuid
 import time
 import random
 import shutil
-from cryptography.fernet import Fernet
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 import base64
 
+# Chunked container: each chunk is sealed with AES-256-GCM under a nonce made
+# of a random per-file prefix and the chunk index. The chunk index and a
+# final-chunk flag are authenticated as associated data, so reordered,
+# swapped or truncated chunks fail to decrypt.
+CHUNK_CIPHER = 'AES-256-GCM'
+CHUNK_NONCE_PREFIX_SIZE = 8
+CHUNK_TAG_SIZE = 16
+
+
+def _chunk_nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+
+def _chunk_aad(index, final):
+    return struct.pack('>IB', index, final)
+
+
+def _seal_chunk(cipher, nonce_prefix, index, final, chunk):
+    return cipher.encrypt(_chunk_nonce(nonce_prefix, index), chunk,
+                          _chunk_aad(index, final))
+
+
+def _seal_chunks(work):
+    """Seal a batch of (cipher, nonce_prefix, index, final, chunk) entries"""
+    return [_seal_chunk(*entry) for entry in work]
+
+
+def _read_chunks(f, chunk_size):
+    """Yield (chunk, final) pairs; an empty file yields one empty final chunk"""
+    chunk = f.read(chunk_size)
+    while True:
+        next_chunk = f.read(chunk_size) if chunk else b''
+        yield chunk, not next_chunk
+        if not next_chunk:
+            return
+        chunk = next_chunk
+
+
+# Key hierarchy: the system password is stretched once into a key-encryption
+# key that wraps a random master key; every file gets a random data key,
+# wrapped by the master key or by a key derived from its file password.
+KDF_ITERATIONS = 100000
+KEY_NONCE_SIZE = 12
+
+# Volume Y layout: one header line (key slot and an encrypted snapshot of the
+# metadata) followed by encrypted journal records, one per line. Records are
+# bound to the snapshot id and their sequence number, so records cannot be
+# reordered, dropped from the middle or replayed against another snapshot.
+VOLUME_FORMAT = 'MyFS-3'
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+
+def _seal(key, data, aad):
+    """Encrypt data under key with a fresh nonce, bound to aad"""
+    nonce = os.urandom(KEY_NONCE_SIZE)
+    return _b64(nonce + AESGCM(key).encrypt(nonce, data, aad))
+
+
+def _unseal(key, sealed, aad):
+    """Decrypt the output of _seal; raises InvalidTag for the wrong key/aad"""
+    blob = base64.b64decode(sealed)
+    return AESGCM(key).decrypt(blob[:KEY_NONCE_SIZE], blob[KEY_NONCE_SIZE:],
+                               aad)
+
+
+def _journal_aad(snapshot_id, seq):
+    return b'journal' + snapshot_id + struct.pack('>Q', seq)
+
+
+def _check_name(name):
+    """
+    Reject a stored name that could escape the directory it is exported to:
+    names are relative '/'-separated paths without empty, '.' or '..'
+    components
+    """
+    parts = name.split('/')
+    if (os.path.isabs(name) or
+            any(part in ('', '.', '..') or os.sep in part or
+                (os.altsep and os.altsep in part) or
+                os.path.splitdrive(part)[0] for part in parts)):
+        raise ValueError(f"Invalid file name: {name!r}")
+    return parts
+
+
 class SmartOTP:
     @staticmethod
     def generate_otp(x):
@@ -28,30 +123,201 @@ class MyFSMetadata:
         self.computer_id = str(uuid.getnode())
         self.creation_time = time.time()
         self.files = {}
-        self.system_password = None
+        # Salt for deriving file-password keys, shared by all files so a
+        # password reused across imports is only stretched once per session
+        self.file_key_salt = _b64(os.urandom(16))
+
+    @classmethod
+    def from_dict(cls, data):
+        metadata = cls.__new__(cls)
+        metadata.__dict__.update(data)
+        return metadata
+
+class ExtentAllocator:
+    """
+    Free space of MyFS.Dat as coalesced (offset, length) extents, indexed
+    both by offset and by size class (power-of-two buckets). Space past the
+    last extent in use is not tracked: the volume ends at end, and freeing
+    the extent just before it shrinks the volume instead
+    """
+
+    def __init__(self, end=0):
+        self.end = end
+        self._offsets = []  # Sorted offsets of the free extents
+        self._lengths = {}  # Free extent offset -> length
+        self._buckets = {}  # Size class -> offsets of free extents
+
+    @classmethod
+    def from_extents(cls, extents, end=0):
+        """
+        Allocator for a volume of end bytes whose free space is every gap
+        around the extents in use
+        """
+        allocator = cls()
+        for offset, length in sorted(extents):
+            if offset > allocator.end:
+                allocator._insert(allocator.end, offset - allocator.end)
+            allocator.end = max(allocator.end, offset + length)
+        if end > allocator.end:
+            allocator._insert(allocator.end, end - allocator.end)
+            allocator.end = end
+        return allocator
+
+    @property
+    def free_bytes(self):
+        return sum(self._lengths.values())
+
+    @property
+    def lowest_free(self):
+        """Offset of the first free extent, or None"""
+        return self._offsets[0] if self._offsets else None
+
+    def _insert(self, offset, length):
+        bisect.insort(self._offsets, offset)
+        self._lengths[offset] = length
+        self._buckets.setdefault(length.bit_length(), set()).add(offset)
+
+    def _remove(self, offset):
+        del self._offsets[bisect.bisect_left(self._offsets, offset)]
+        length = self._lengths.pop(offset)
+        bucket = self._buckets[length.bit_length()]
+        bucket.discard(offset)
+        if not bucket:
+            del self._buckets[length.bit_length()]
+        return length
+
+    def _take(self, offset, length):
+        free = self._remove(offset)
+        if free > length:
+            self._insert(offset + length, free - length)
+        return offset
+
+    def allocate(self, length):
+        """
+        Offset of a new extent: the smallest fitting hole of the lowest size
+        class that has one, or the end of the volume
+        """
+        for size_class in sorted(self._buckets):
+            if size_class < length.bit_length():
+                continue
+            fits = [offset for offset in self._buckets[size_class]
+                    if self._lengths[offset] >= length]
+            if fits:
+                return self._take(min(fits, key=lambda offset: (
+                    self._lengths[offset], offset)), length)
+        offset = self.end
+        self.end += length
+        return offset
+
+    def allocate_below(self, length, limit):
+        """Lowest hole that fits length bytes before limit, or None"""
+        for offset in self._offsets:
+            if offset + length > limit:
+                break
+            if self._lengths[offset] >= length:
+                return self._take(offset, length)
+        return None
+
+    def trim(self):
+        """Shrink the volume by the free extent at its end, if any"""
+        if self._offsets:
+            last = self._offsets[-1]
+            if last + self._lengths[last] >= self.end:
+                self._remove(last)
+                self.end = last
+
+    def free(self, offset, length):
+        """Return an extent, merging it with the free extents around it"""
+        index = bisect.bisect_left(self._offsets, offset)
+        if offset + length in self._lengths:
+            length += self._remove(offset + length)
+        if index:
+            previous = self._offsets[index - 1]
+            if previous + self._lengths[previous] == offset:
+                offset, length = previous, length + self._remove(previous)
+        if offset + length >= self.end:
+            self.end = offset
+        else:
+            self._insert(offset, length)
+
 
 class MyFS:
+    # import_many: most small files sealed by one encryption task
+    IMPORT_BATCH_FILES = 64
+
     def __init__(self, volume_x_path, volume_y_path):
         self.volume_x_path = volume_x_path  # MyFS.Dat location
         self.volume_y_path = volume_y_path  # Metadata location
         self.max_files = 99
         self.max_file_size = 4 * 1024 * 1024 * 1024  # 4GB
+        self.chunk_size = 1024 * 1024  # Plaintext bytes per stored chunk
+        self.key_cache_size = 16  # Password-derived keys kept per session
+        self.chunk_cache_size = 0  # Decrypted chunks kept for read(); 0 = off
         self.metadata = None
+        self._master_key = None
+        self._key_slot = None
+        self._derived_keys = OrderedDict()
+        # Per-session secret keying the derived-key cache
+        self._cache_secret = os.urandom(32)
+        self._chunk_cache = OrderedDict()
+        # Guards _chunk_cache, shared by concurrent readers and the compactor
+        self._cache_lock = threading.Lock()
+        self._data_file = None
+        self._data_map = None
+        # Space in MyFS.Dat: extents released by a put, delete or move are
+        # only reused once that record is committed. _lock serializes
+        # metadata and allocator updates; _data_lock is only held while a
+        # reader copies a chunk out of the mapping, or while freed extents
+        # are released and the volume is truncated
+        self._allocator = ExtentAllocator()
+        self._pending_frees = []
+        self._lock = threading.RLock()
+        self._data_lock = threading.Lock()
+        self._compactor = None
+        # Metadata journal: updates are batched into one fsync (group commit)
+        # and folded into a new snapshot every compact_threshold records
+        self.commit_batch_size = 32
+        self.commit_interval = 1.0  # Seconds before a partial batch is due
+        self.compact_threshold = 1024
+        self._pending_records = []
+        self._batch_started = None
+        self._defer_commit = False
+        self._snapshot_id = None
+        self._journal_seq = 0
 
-    def _generate_encryption_key(self, password):
-        """Generate a secure encryption key from password"""
-        salt = os.urandom(16)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def _derive_key(self, password, salt):
+        """Stretch a password into a raw 256-bit key (PBKDF2-SHA256)"""
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
             salt=salt,
-            iterations=100000,
+            iterations=KDF_ITERATIONS,
             backend=default_backend()
         )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        # bytes arent json serializable, so we have to convert them to string for storage
-        # when using them in Fernet, use base64.b64decode(key) to convert back to bytes
-        return base64.b64encode(key).decode('utf-8'), base64.b64encode(salt).decode('utf-8')
+        return kdf.derive(password.encode())
+
+    def _password_key(self, password, salt):
+        """Derived key for password and salt, cached in a bounded LRU"""
+        # Cache by a keyed digest: plaintext passwords are not kept in
+        # memory, and without the session secret the cache keys cannot be
+        # brute-forced faster than the KDF itself
+        cache_key = hmac.new(self._cache_secret, salt + password.encode(),
+                             hashlib.sha256).digest()
+        key = self._derived_keys.get(cache_key)
+        if key is not None:
+            self._derived_keys.move_to_end(cache_key)
+            return key
+        key = self._derive_key(password, salt)
+        self._derived_keys[cache_key] = key
+        if len(self._derived_keys) > self.key_cache_size:
+            self._derived_keys.popitem(last=False)
+        return key
 
     def _verify_computer(self):
         """Verify if current computer matches the one that created the file system"""
@@ -71,86 +337,734 @@ class MyFS:
         # Generate metadata
         metadata = MyFSMetadata()
         print(json.dumps(metadata.__dict__))
-        key, salt = self._generate_encryption_key(system_password)
-        metadata.system_password = {
-            'salt': salt,
-            'key': key
-        }
 
-        # Encrypt and save metadata
-        fernet = Fernet(base64.b64decode(key))
-        encrypted_metadata = fernet.encrypt(json.dumps(metadata.__dict__).encode())
-        
-        with open(self.volume_y_path, 'wb') as f:
-            f.write(encrypted_metadata)
+        # Random master key, wrapped by the stretched system password
+        self._master_key = AESGCM.generate_key(bit_length=256)
+        self._key_slot = self._new_key_slot(system_password)
 
         self.metadata = metadata
+        self._allocator = ExtentAllocator()
+        self.compact()
         return True
 
+    def open_myfs(self, system_password):
+        """Open existing MyFS volumes, unlocking the master key for this session"""
+        self.metadata = self._load_metadata(system_password)
+        # Free space is every gap around the chunks in use, including data
+        # past the last one (left by an interrupted import), which is only
+        # cut off by compact_data
+        self._allocator = ExtentAllocator.from_extents(
+            (extent for file_metadata in self.metadata.files.values()
+             for extent in file_metadata['chunks']),
+            os.path.getsize(self.volume_x_path))
+        return True
+
+    def _new_key_slot(self, system_password):
+        """Wrap the master key under a fresh salt for system_password"""
+        salt = os.urandom(16)
+        return {
+            'kdf': {
+                'algorithm': 'PBKDF2-SHA256',
+                'salt': _b64(salt),
+                'iterations': KDF_ITERATIONS
+            },
+            'master_key': _seal(
+                self._password_key(system_password, salt),
+                self._master_key, b'master key')
+        }
+
+    def _read_volume(self):
+        """
+        Read volume Y: the header and the journal lines that follow it,
+        together with the byte offset where each line ends
+        """
+        with open(self.volume_y_path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != VOLUME_FORMAT:
+                raise ValueError("Unsupported MyFS metadata format")
+            records = []
+            for line in f:
+                records.append((line, f.tell()))
+        return header, records
+
+    def _unlock_master_key(self, key_slot, system_password):
+        """Unwrap the master key of key_slot with the system password"""
+        salt = base64.b64decode(key_slot['kdf']['salt'])
+        try:
+            return _unseal(self._password_key(system_password, salt),
+                           key_slot['master_key'], b'master key')
+        except InvalidTag:
+            raise PermissionError("Incorrect system password") from None
+
+    def _load_metadata(self, system_password):
+        """
+        Unlock the master key, decrypt the snapshot and replay the journal.
+        A torn final line (an interrupted commit, not ending in a newline)
+        is cut off so later commits append after the last valid record;
+        any other record that fails authentication raises ValueError and
+        leaves volume Y untouched
+        """
+        header, records = self._read_volume()
+        key_slot = header['key_slot']
+        master_key = self._unlock_master_key(key_slot, system_password)
+        snapshot_id = base64.b64decode(header['snapshot_id'])
+        metadata = MyFSMetadata.from_dict(json.loads(
+            _unseal(master_key, header['snapshot'], b'metadata' + snapshot_id)))
+
+        seq = 0
+        valid_end = None
+        for line, end in records:
+            if not line.endswith(b'\n'):
+                # Only the last line can lack its newline
+                break
+            try:
+                record = json.loads(_unseal(master_key, line.strip(),
+                                            _journal_aad(snapshot_id, seq)))
+            except (InvalidTag, ValueError):
+                raise ValueError(f"Journal corrupted at record {seq}") from None
+            self._apply_record(metadata, record)
+            seq += 1
+            valid_end = end
+        if seq < len(records):
+            with open(self.volume_y_path, 'r+b') as f:
+                if valid_end is None:
+                    f.readline()
+                    valid_end = f.tell()
+                f.truncate(valid_end)
+
+        self._master_key = master_key
+        self._key_slot = key_slot
+        self._snapshot_id = snapshot_id
+        self._journal_seq = seq
+        self._pending_records = []
+        return metadata
+
+    @staticmethod
+    def _apply_record(metadata, record):
+        """Apply one journal record to the in-memory metadata"""
+        if record['op'] == 'put':
+            metadata.files[record['name']] = record['file']
+        elif record['op'] == 'delete':
+            metadata.files.pop(record['name'], None)
+        elif record['op'] == 'move':
+            file_metadata = metadata.files[record['name']]
+            file_metadata['chunks'][record['index']] = record['extent']
+            file_metadata['offset'] = file_metadata['chunks'][0][0]
+        else:
+            raise ValueError(f"Unknown journal record {record['op']}")
+
+    def _append_record(self, record, freed=()):
+        """
+        Queue a journal record, with the extents it frees; the batch is
+        committed when it is due
+        """
+        with self._lock:
+            if not self._pending_records:
+                self._batch_started = time.monotonic()
+            self._pending_records.append(record)
+            self._pending_frees.extend(freed)
+            if self._defer_commit:
+                return
+            if (len(self._pending_records) >= self.commit_batch_size or
+                    time.monotonic() - self._batch_started >=
+                    self.commit_interval):
+                self.commit()
+
+    def commit(self):
+        """
+        Group commit: append every pending record to the journal with a
+        single write and fsync, then release the extents they freed.
+        Compacts the journal when it grows too long
+        """
+        with self._lock:
+            if not self._pending_records:
+                return
+            # The file data that the records point to must be durable first
+            self._sync_data()
+            lines = []
+            for record in self._pending_records:
+                aad = _journal_aad(self._snapshot_id,
+                                   self._journal_seq + len(lines))
+                lines.append(_seal(self._master_key,
+                                   json.dumps(record).encode(), aad) + '\n')
+            with open(self.volume_y_path, 'a') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_seq += len(lines)
+            self._pending_records = []
+            self._release_frees()
+            if self._journal_seq >= self.compact_threshold:
+                self.compact()
+
+    def compact(self):
+        """
+        Fold the journal into a new snapshot of the metadata (also written
+        when the key slot changes). The new volume Y replaces the old one
+        atomically, so a crash leaves either the old or the new state
+        """
+        with self._lock:
+            # As in commit: the snapshot must not point at unwritten data
+            self._sync_data()
+            self._pending_records = []
+            snapshot_id = os.urandom(16)
+            data = json.dumps(self.metadata.__dict__).encode()
+            header = {
+                'format': VOLUME_FORMAT,
+                'key_slot': self._key_slot,
+                'snapshot_id': _b64(snapshot_id),
+                'snapshot': _seal(self._master_key, data,
+                                  b'metadata' + snapshot_id)
+            }
+            tmp_path = self.volume_y_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(header) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.volume_y_path)
+            self._snapshot_id = snapshot_id
+            self._journal_seq = 0
+            self._release_frees()
+
+    def _sync_data(self):
+        """fsync MyFS.Dat"""
+        with open(self.volume_x_path, 'ab') as data:
+            os.fsync(data.fileno())
+
+    def _release_frees(self):
+        """
+        Hand the extents freed by committed records back to the allocator
+        and cut MyFS.Dat down to the last extent in use. Readers copy a
+        chunk and look up its extent under the same lock, so none can be
+        reading a released extent while it is reused or cut off
+        """
+        if not self._pending_frees:
+            return
+        with self._data_lock:
+            for offset, length in self._pending_frees:
+                self._allocator.free(offset, length)
+            self._pending_frees = []
+            self._truncate_data()
+
+    def _truncate_data(self):
+        """Cut MyFS.Dat at the end of the allocator (needs _data_lock)"""
+        if os.path.getsize(self.volume_x_path) > self._allocator.end:
+            # Pages past the end of a mapped file must not stay mapped
+            self._unmap_data()
+            os.truncate(self.volume_x_path, self._allocator.end)
+
+    def close(self):
+        """
+        Stop the background compactor, commit pending metadata updates and
+        release the MyFS.Dat mapping
+        """
+        self.stop_compactor()
+        if self.metadata is not None and self._master_key is not None:
+            self.commit()
+        self._unmap_data()
+        with self._cache_lock:
+            self._chunk_cache.clear()
+
     def change_system_password(self, old_password, new_password):
-        """Change system-level password"""
+        """
+        Change system-level password. Only the master key is re-wrapped;
+        file data and file keys are left untouched
+        """
         if not self._verify_computer():
             raise PermissionError("Unauthorized computer")
 
-        # Decrypt existing metadata
-        current_metadata = self._load_metadata(old_password)
-        
-        # Generate new encryption key
-        new_key, new_salt = self._generate_encryption_key(new_password)
-        current_metadata['system_password'] = {
-            'salt': new_salt,
-            'key': new_key
-        }
+        # Verify the old password against the stored key slot
+        key_slot = self._read_volume()[0]['key_slot']
+        self._master_key = self._unlock_master_key(key_slot, old_password)
 
-        # Re-encrypt and save
-        fernet = Fernet(new_key)
-        encrypted_metadata = fernet.encrypt(json.dumps(current_metadata).encode())
-        
-        with open(self.volume_y_path, 'wb') as f:
-            f.write(encrypted_metadata)
+        # The new key slot is written with a snapshot of the current metadata
+        self._key_slot = self._new_key_slot(new_password)
+        self.compact()
 
-    def import_file(self, file_path, file_password=None):
-        """Import a file into MyFS"""
+    def _file_key(self, file_metadata, file_password=None, name=None):
+        """Unwrap the data key of a stored file"""
+        key_info = file_metadata['key']
+        if key_info['wrapped_by'] == 'master':
+            return _unseal(self._master_key, key_info['wrapped'],
+                           b'file key')
+        if not file_password:
+            raise PermissionError(f"File {name} is password protected")
+        salt = base64.b64decode(self.metadata.file_key_salt)
+        try:
+            return _unseal(self._password_key(file_password, salt),
+                           key_info['wrapped'], b'file key')
+        except InvalidTag:
+            raise PermissionError(f"Incorrect password for file {name}") from None
+
+    def import_file(self, file_path, file_password=None, old_password=None):
+        """
+        Import a file into MyFS, streaming it in chunk_size pieces. A stored
+        file with the same name is replaced; if it is password protected,
+        old_password (default: file_password) must be its password
+        """
         if not self._verify_computer():
             raise PermissionError("Unauthorized computer")
 
-        if len(self.metadata.files) >= self.max_files:
+        name = os.path.basename(file_path)
+        if name in self.metadata.files:
+            self._open_file(name, old_password or file_password)
+        elif len(self.metadata.files) >= self.max_files:
             raise ValueError("MyFS volume is full")
 
+        file_metadata, cipher, nonce_prefix = self._new_file_entry(
+            file_path, file_password)
+
+        # Stream the file into MyFS.Dat one chunk at a time; the next chunk is
+        # read ahead so the final one can be flagged before it is sealed
+        chunks = []
+        size = 0
+        try:
+            with open(file_path, 'rb') as src, \
+                    open(self.volume_x_path, 'r+b') as f:
+                for chunk, final in _read_chunks(src, self.chunk_size):
+                    size += len(chunk)
+                    chunk = _seal_chunk(cipher, nonce_prefix, len(chunks),
+                                        final, chunk)
+                    chunks.append(self._write_extent(f, chunk))
+        except BaseException:
+            self._free_unused(chunks)
+            raise
+
+        self._add_file(name, file_metadata, size, chunks)
+        return True
+
+    def _write_extent(self, f, data):
+        """Write data to a newly allocated extent of MyFS.Dat"""
+        with self._lock:
+            offset = self._allocator.allocate(len(data))
+        f.seek(offset)
+        f.write(data)
+        return [offset, len(data)]
+
+    def _free_unused(self, extents):
+        """Free extents that no metadata (committed or not) refers to"""
+        with self._lock, self._data_lock:
+            for offset, length in extents:
+                self._allocator.free(offset, length)
+
+    def _new_file_entry(self, file_path, file_password=None):
+        """
+        Metadata, cipher and nonce prefix for a file about to be imported.
+        The data key is random, wrapped by the file password key (derived
+        once and cached) or by the master key
+        """
         file_stats = os.stat(file_path)
         
         if file_stats.st_size > self.max_file_size:
             print(f"Warning: Large file {file_path} might have limited protection")
 
-        # File metadata
+        file_key = AESGCM.generate_key(bit_length=256)
+        if file_password:
+            salt = base64.b64decode(self.metadata.file_key_salt)
+            wrapping_key = self._password_key(file_password, salt)
+        else:
+            wrapping_key = self._master_key
+        nonce_prefix = os.urandom(CHUNK_NONCE_PREFIX_SIZE)
         file_metadata = {
             'original_path': file_path,
             'import_time': time.time(),
-            'size': file_stats.st_size,
-            'has_password': bool(file_password)
+            'has_password': bool(file_password),
+            'chunk_size': self.chunk_size,
+            'key': {
+                'wrapped_by': 'password' if file_password else 'master',
+                'wrapped': _seal(wrapping_key, file_key, b'file key')
+            },
+            'encryption': {
+                'cipher': CHUNK_CIPHER,
+                'nonce_prefix': _b64(nonce_prefix)
+            }
         }
+        return file_metadata, AESGCM(file_key), nonce_prefix
 
-        # Encrypt file content if password provided
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
+    def _add_file(self, name, file_metadata, size, chunks):
+        """
+        Record a fully written file in the metadata and the journal. The
+        chunks of a file it replaces are freed with the record
+        """
+        file_metadata['size'] = size
+        file_metadata['offset'] = chunks[0][0]
+        file_metadata['chunks'] = chunks
+        with self._lock:
+            replaced = self.metadata.files.get(name)
+            self.metadata.files[name] = file_metadata
+            self._append_record({'op': 'put', 'name': name,
+                                 'file': file_metadata},
+                                replaced['chunks'] if replaced else ())
 
-        if file_password:
-            file_key, file_salt = self._generate_encryption_key(file_password)
-            fernet = Fernet(file_key)
-            file_content = fernet.encrypt(file_content)
-            file_metadata['file_salt'] = file_salt
+    def import_directory(self, directory, file_password=None, workers=None,
+                         old_password=None):
+        """
+        Import every file under directory (recursively) with import_many.
+        Files are named by their path relative to directory
+        """
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for file_name in sorted(names):
+                path = os.path.join(root, file_name)
+                relative = os.path.relpath(path, directory)
+                files.append((relative.replace(os.sep, '/'), path))
+        return self.import_many(files, file_password, workers, old_password)
 
-        # Save encrypted file in MyFS.Dat
-        with open(self.volume_x_path, 'ab') as f:
-            file_offset = f.tell()
-            f.write(file_content)
+    def import_many(self, files, file_password=None, workers=None,
+                    old_password=None):
+        """
+        Import many files through a bounded pipeline: a reader thread
+        streams the files in chunks, a thread pool encrypts them and the
+        calling thread writes them in order to MyFS.Dat, which stays open
+        for the whole batch. files holds paths or (name, path) pairs.
+        Stored files are replaced as with import_file, after the passwords
+        of all of them have been checked.
+        The metadata of the batch is committed once, at the end (also when
+        a file fails, for the files imported before it).
+        Returns the number of imported files
+        """
+        if not self._verify_computer():
+            raise PermissionError("Unauthorized computer")
 
-        # Update file metadata
-        file_metadata['offset'] = file_offset
-        self.metadata.files[os.path.basename(file_path)] = file_metadata
+        files = [(os.path.basename(item), item) if isinstance(item, str)
+                 else tuple(item) for item in files]
+        for name, _ in files:
+            _check_name(name)
+        new_names = {name for name, _ in files} - set(self.metadata.files)
+        for name in {name for name, _ in files} - new_names:
+            self._open_file(name, old_password or file_password)
+        if len(self.metadata.files) + len(new_names) > self.max_files:
+            raise ValueError("MyFS volume is full")
+
+        workers = workers or os.cpu_count() or 1
+        # Each queue entry is one encryption task: a single chunk, or several
+        # small files batched together up to chunk_size bytes. At most
+        # queue size + 1 tasks are in memory at any time
+        pending = Queue(maxsize=workers * 4)
+        stop = threading.Event()
+        errors = []
 
+        def read_files(pool):
+            entries, work, batched = [], [], 0
+            try:
+                for name, path in files:
+                    file_metadata, cipher, nonce_prefix = \
+                        self._new_file_entry(path, file_password)
+                    with open(path, 'rb') as src:
+                        for index, (chunk, final) in enumerate(
+                                _read_chunks(src, self.chunk_size)):
+                            if stop.is_set():
+                                return
+                            entries.append((name, file_metadata, len(chunk),
+                                            final))
+                            work.append((cipher, nonce_prefix, index, final,
+                                         chunk))
+                            batched += len(chunk)
+                            if batched >= self.chunk_size or \
+                                    len(work) >= self.IMPORT_BATCH_FILES:
+                                pending.put((entries,
+                                             pool.submit(_seal_chunks, work)))
+                                entries, work, batched = [], [], 0
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Files completed before an error are still written
+                if work and not stop.is_set():
+                    pending.put((entries, pool.submit(_seal_chunks, work)))
+                pending.put(None)
+
+        imported = 0
+        finished = False
+        # The whole call is one batch: its records are committed together
+        self._defer_commit = True
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            reader = threading.Thread(target=read_files, args=(pool,),
+                                      daemon=True)
+            reader.start()
+            chunks, size = [], 0
+            try:
+                with open(self.volume_x_path, 'r+b') as f:
+                    while True:
+                        item = pending.get()
+                        if item is None:
+                            finished = True
+                            break
+                        entries, future = item
+                        for (name, file_metadata, length, final), sealed in \
+                                zip(entries, future.result()):
+                            chunks.append(self._write_extent(f, sealed))
+                            size += length
+                            if final:
+                                f.flush()
+                                self._add_file(name, file_metadata, size,
+                                               chunks)
+                                chunks, size = [], 0
+                                imported += 1
+            finally:
+                if not finished:
+                    # Writing failed: stop the reader and let it finish
+                    stop.set()
+                    while pending.get() is not None:
+                        pass
+                # Chunks of a file that was not completed
+                self._free_unused(chunks)
+                reader.join()
+                self._defer_commit = False
+                self.commit()
+
+        if errors:
+            raise errors[0]
+        return imported
+
+    def _map_data(self, end):
+        """
+        Read-only mmap of MyFS.Dat covering at least [0, end) (needs
+        _data_lock). The mapping is shared, so chunks written into reused
+        holes or moved by compact_data are visible through it. It is
+        renewed when a chunk lies past its end because the volume grew, and
+        dropped by _truncate_data when the volume shrinks
+        """
+        if self._data_map is None or len(self._data_map) < end:
+            self._unmap_data()
+            self._data_file = open(self.volume_x_path, 'rb')
+            size = os.fstat(self._data_file.fileno()).st_size
+            if size < end:
+                self._data_file.close()
+                self._data_file = None
+                raise ValueError("MyFS.Dat is truncated")
+            self._data_map = mmap.mmap(self._data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        return self._data_map
+
+    def _unmap_data(self):
+        if self._data_map is not None:
+            self._data_map.close()
+            self._data_map = None
+        if self._data_file is not None:
+            self._data_file.close()
+            self._data_file = None
+
+    def _open_file(self, name, file_password=None):
+        """Metadata, cipher and nonce prefix of a stored file"""
+        if not self._verify_computer():
+            raise PermissionError("Unauthorized computer")
+        if name not in self.metadata.files:
+            raise FileNotFoundError(f"File {name} is not in MyFS")
+        file_metadata = self.metadata.files[name]
+        cipher = AESGCM(self._file_key(file_metadata, file_password, name))
+        nonce_prefix = base64.b64decode(
+            file_metadata['encryption']['nonce_prefix'])
+        return file_metadata, cipher, nonce_prefix
+
+    def _read_extent(self, name, file_metadata, index):
+        """
+        Copy chunk index of a file out of the mapping. The compactor may
+        have moved the chunk since file_metadata was read, so its current
+        extent is looked up under the same lock that guards releasing the
+        old one
+        """
+        with self._data_lock:
+            current = self.metadata.files.get(name)
+            if (current is not None and
+                    current['encryption'] == file_metadata['encryption']):
+                file_metadata = current
+            offset, length = file_metadata['chunks'][index]
+            return self._map_data(offset + length)[offset:offset + length]
+
+    def _decrypt_chunk(self, name, file_metadata, cipher, nonce_prefix,
+                       index):
+        """Decrypt and verify one chunk of a file straight from the mapping"""
+        data = self._read_extent(name, file_metadata, index)
+        final = index == len(file_metadata['chunks']) - 1
+        return cipher.decrypt(_chunk_nonce(nonce_prefix, index), data,
+                              _chunk_aad(index, final))
+
+    def _cached_chunk(self, name, file_metadata, cipher, nonce_prefix, index):
+        """_decrypt_chunk through the LRU of decrypted chunks"""
+        if not self.chunk_cache_size:
+            return self._decrypt_chunk(name, file_metadata, cipher,
+                                       nonce_prefix, index)
+        # Nonce prefixes are random per file, so they identify its chunks
+        cache_key = (nonce_prefix, index)
+        with self._cache_lock:
+            chunk = self._chunk_cache.get(cache_key)
+            if chunk is not None:
+                self._chunk_cache.move_to_end(cache_key)
+                return chunk
+        # Decrypted outside the lock so readers of other chunks are not held
+        chunk = self._decrypt_chunk(name, file_metadata, cipher, nonce_prefix,
+                                    index)
+        with self._cache_lock:
+            self._chunk_cache[cache_key] = chunk
+            while len(self._chunk_cache) > self.chunk_cache_size:
+                self._chunk_cache.popitem(last=False)
+        return chunk
+
+    def _iter_file_chunks(self, name, file_password=None):
+        """Yield the plaintext chunks of a stored file, verifying each one"""
+        file_metadata, cipher, nonce_prefix = self._open_file(
+            name, file_password)
+        for index in range(len(file_metadata['chunks'])):
+            yield self._decrypt_chunk(name, file_metadata, cipher,
+                                      nonce_prefix, index)
+
+    def read(self, name, offset=0, length=None, file_password=None):
+        """
+        Read length bytes (to the end of the file if None) of a stored file
+        starting at offset. Only the chunks covering the range are
+        decrypted, through the chunk cache if chunk_cache_size is set
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError("Offset and length must not be negative")
+        # The file key is unwrapped first, so a wrong password is rejected
+        # even when the chunks are already cached
+        file_metadata, cipher, nonce_prefix = self._open_file(
+            name, file_password)
+        end = file_metadata['size']
+        if length is not None:
+            end = min(end, offset + length)
+        if offset >= end:
+            return b''
+
+        chunk_size = file_metadata['chunk_size']
+        first = offset // chunk_size
+        parts = [self._cached_chunk(name, file_metadata, cipher, nonce_prefix,
+                                    index)
+                 for index in range(first, (end - 1) // chunk_size + 1)]
+        start = offset - first * chunk_size
+        return b''.join(parts)[start:start + end - offset]
+
+    def export_file(self, name, destination, file_password=None):
+        """
+        Decrypt a stored file to destination (a path, or a directory to put
+        it in under its MyFS name), one chunk at a time. Returns the path
+        """
+        file_metadata, cipher, nonce_prefix = self._open_file(
+            name, file_password)
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, *_check_name(name))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        f = open(destination, 'wb')
+        try:
+            with f:
+                for index in range(len(file_metadata['chunks'])):
+                    f.write(self._decrypt_chunk(name, file_metadata, cipher,
+                                                nonce_prefix, index))
+        except Exception:
+            # Do not leave a partial plaintext file behind
+            os.remove(destination)
+            raise
+        return destination
+
+    def delete_file(self, name, file_password=None):
+        """
+        Remove a stored file (a password-protected one needs its password).
+        Its chunks become free space once the deletion is committed
+        """
+        if not self._verify_computer():
+            raise PermissionError("Unauthorized computer")
+
+        _, _, nonce_prefix = self._open_file(name, file_password)
+        with self._lock:
+            file_metadata = self.metadata.files.pop(name)
+            self._append_record({'op': 'delete', 'name': name},
+                                file_metadata['chunks'])
+        with self._cache_lock:
+            for cache_key in [key for key in self._chunk_cache
+                              if key[0] == nonce_prefix]:
+                del self._chunk_cache[cache_key]
         return True
 
+    def compact_data(self, max_bytes=None):
+        """
+        Move live chunks from the end of MyFS.Dat into the lowest holes
+        that fit them, so the freed tail is cut off, copying at most
+        max_bytes (all movable chunks if None). Chunks are copied as
+        ciphertext, since their nonce and associated data do not depend on
+        where they are stored. A moved file gets a new copy of its metadata
+        instead of being changed in place, so readers are never blocked by
+        a copy. Returns the number of bytes moved
+        """
+        with self._lock:
+            if self._allocator.lowest_free is None:
+                return 0
+            extents = sorted(
+                ((offset, length, name, index,
+                  file_metadata['encryption']['nonce_prefix'])
+                 for name, file_metadata in self.metadata.files.items()
+                 for index, (offset, length) in
+                 enumerate(file_metadata['chunks'])), reverse=True)
+
+        moved = 0
+        with open(self.volume_x_path, 'r+b') as f:
+            for offset, length, name, index, nonce_prefix in extents:
+                if max_bytes is not None and moved >= max_bytes:
+                    break
+                with self._lock:
+                    lowest = self._allocator.lowest_free
+                    if lowest is None or lowest >= offset:
+                        break
+                    target = self._allocator.allocate_below(length, offset)
+                if target is None:
+                    continue
+                f.seek(offset)
+                data = f.read(length)
+                f.seek(target)
+                f.write(data)
+                f.flush()
+
+                with self._lock:
+                    file_metadata = self.metadata.files.get(name)
+                    if (file_metadata is None or
+                            file_metadata['encryption']['nonce_prefix'] !=
+                            nonce_prefix or
+                            file_metadata['chunks'][index] != [offset, length]):
+                        # Deleted or replaced while it was being copied
+                        self._free_unused([[target, length]])
+                        continue
+                    chunks = list(file_metadata['chunks'])
+                    chunks[index] = [target, length]
+                    self.metadata.files[name] = dict(
+                        file_metadata, chunks=chunks, offset=chunks[0][0])
+                    self._append_record({'op': 'move', 'name': name,
+                                         'index': index,
+                                         'extent': [target, length]},
+                                        [[offset, length]])
+                moved += length
+
+        self.commit()
+        with self._lock, self._data_lock:
+            self._allocator.trim()
+            self._truncate_data()
+        return moved
+
+    def start_compactor(self, interval=1.0, max_bytes=None):
+        """
+        Compact MyFS.Dat incrementally in a background thread, moving up to
+        max_bytes (16 chunks by default) every interval seconds
+        """
+        if self._compactor is not None:
+            return
+        max_bytes = max_bytes or 16 * (self.chunk_size + CHUNK_TAG_SIZE)
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.compact_data(max_bytes)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._compactor = (thread, stop)
+
+    def stop_compactor(self):
+        """Stop the background compactor once its current step is done"""
+        if self._compactor is not None:
+            thread, stop = self._compactor
+            stop.set()
+            thread.join()
+            self._compactor = None
+
     def _detect_tampering(self):
         """Detect potential system tampering"""
         # Implement checks for unexpected modifications
@@ -199,6 +1113,7 @@ def main():
     
     # Import a file
     myfs.import_file('/path/to/important/file.txt', 'optional_file_password')
+    myfs.close()
 
 if __name__ == "__main__":
     main()
@@ -2,8 +2,13 @@ import unittest
 import os
 import tempfile
 import time
+import hashlib
 import random
-from myfs import MyFS, SmartOTP  # Assuming the previous implementation is in myfs.py
+from collections import OrderedDict
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+from myfs import MyFS, SmartOTP, ExtentAllocator  # Assuming the previous implementation is in myfs.py
 
 class TestMyFSFileSystem(unittest.TestCase):
     def setUp(self):
@@ -16,6 +21,7 @@ class TestMyFSFileSystem(unittest.TestCase):
 
     def tearDown(self):
         """Clean up temporary files after each test"""
+        self.myfs.close()
         if os.path.exists(self.volume_x_path):
             os.remove(self.volume_x_path)
         if os.path.exists(self.volume_y_path):
@@ -131,6 +137,583 @@ class TestMyFSFileSystem(unittest.TestCase):
         self.assertIn('import_time', file_metadata)
         self.assertIn('size', file_metadata)
 
+    def _write_test_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_chunked_import_roundtrip(self):
+        """Test that encrypted files are stored as authenticated chunks"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        content = os.urandom(5000)
+        path = self._write_test_file('chunked.bin', content)
+
+        self.myfs.import_file(path, 'file_password')
+
+        file_metadata = self.myfs.metadata.files['chunked.bin']
+        self.assertEqual(file_metadata['size'], len(content))
+        self.assertEqual([length for _, length in file_metadata['chunks']],
+                         [1024 + 16] * 4 + [904 + 16])
+        stored = b''.join(self.myfs._iter_file_chunks('chunked.bin',
+                                                      'file_password'))
+        self.assertEqual(stored, content)
+        with open(self.volume_x_path, 'rb') as f:
+            self.assertNotIn(content[:64], f.read())
+
+    def test_unprotected_import_uses_master_key(self):
+        """Test that files without a password are encrypted under the master key"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1000
+        content = os.urandom(2500)
+        path = self._write_test_file('plain.bin', content)
+
+        self.myfs.import_file(path)
+
+        file_metadata = self.myfs.metadata.files['plain.bin']
+        self.assertEqual(file_metadata['key']['wrapped_by'], 'master')
+        self.assertEqual(len(file_metadata['chunks']), 3)
+        self.assertEqual(b''.join(self.myfs._iter_file_chunks('plain.bin')),
+                         content)
+        with open(self.volume_x_path, 'rb') as f:
+            self.assertNotIn(content[:64], f.read())
+
+    def test_tampered_chunk_is_rejected(self):
+        """Test that modified or truncated chunks fail authentication"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        path = self._write_test_file('tamper.bin', os.urandom(3000))
+        self.myfs.import_file(path, 'file_password')
+        file_metadata = self.myfs.metadata.files['tamper.bin']
+        chunks = file_metadata['chunks']
+
+        with self.assertRaises(PermissionError):
+            b''.join(self.myfs._iter_file_chunks('tamper.bin', 'wrong'))
+
+        # Dropping the final chunk must not yield a valid shorter file
+        file_metadata['chunks'] = chunks[:2]
+        with self.assertRaises(InvalidTag):
+            b''.join(self.myfs._iter_file_chunks('tamper.bin', 'file_password'))
+        file_metadata['chunks'] = chunks
+
+        with open(self.volume_x_path, 'r+b') as f:
+            f.seek(chunks[1][0])
+            byte = f.read(1)
+            f.seek(chunks[1][0])
+            f.write(bytes([byte[0] ^ 1]))
+        with self.assertRaises(InvalidTag):
+            b''.join(self.myfs._iter_file_chunks('tamper.bin', 'file_password'))
+
+    def test_password_change_rewraps_master_key(self):
+        """Test that a new system password unlocks the same file data"""
+        self.myfs.create_myfs(self.system_password)
+        content = os.urandom(3000)
+        path = self._write_test_file('kept.bin', content)
+        self.myfs.import_file(path, 'file_password')
+        with open(self.volume_x_path, 'rb') as f:
+            stored = f.read()
+
+        new_password = 'new_test_password_456'
+        self.myfs.change_system_password(self.system_password, new_password)
+        with open(self.volume_x_path, 'rb') as f:
+            self.assertEqual(f.read(), stored)
+
+        reopened = MyFS(self.volume_x_path, self.volume_y_path)
+        with self.assertRaises(PermissionError):
+            reopened.open_myfs(self.system_password)
+        reopened.open_myfs(new_password)
+        self.assertEqual(b''.join(reopened._iter_file_chunks('kept.bin',
+                                                             'file_password')),
+                         content)
+
+    def test_wrong_old_password_is_rejected(self):
+        """Test that changing the password requires the current one"""
+        self.myfs.create_myfs(self.system_password)
+        with self.assertRaises(PermissionError):
+            self.myfs.change_system_password('not_the_password', 'other')
+
+    def test_file_password_is_derived_once(self):
+        """Test that a reused file password is stretched only once"""
+        self.myfs.create_myfs(self.system_password)
+        paths = [self._write_test_file(f'same_{i}.txt', b'content %d' % i)
+                 for i in range(5)]
+
+        with mock.patch.object(self.myfs, '_derive_key',
+                               wraps=self.myfs._derive_key) as derive:
+            for path in paths:
+                self.myfs.import_file(path, 'shared_password')
+            for i in range(5):
+                self.assertEqual(b''.join(self.myfs._iter_file_chunks(
+                    f'same_{i}.txt', 'shared_password')), b'content %d' % i)
+        self.assertEqual(derive.call_count, 1)
+
+    def test_key_cache_is_keyed_per_session(self):
+        """Test that cached keys are not indexed by a bare password hash"""
+        self.myfs.create_myfs(self.system_password)
+        salt = os.urandom(16)
+        self.myfs._password_key('cached_password', salt)
+        other = MyFS(self.volume_x_path, self.volume_y_path)
+        other._password_key('cached_password', salt)
+
+        plain = hashlib.sha256(salt + b'cached_password').digest()
+        self.assertNotIn(plain, self.myfs._derived_keys)
+        self.assertFalse(set(self.myfs._derived_keys) &
+                         set(other._derived_keys))
+
+    def _reopen(self):
+        reopened = MyFS(self.volume_x_path, self.volume_y_path)
+        reopened.open_myfs(self.system_password)
+        return reopened
+
+    def test_journal_group_commit(self):
+        """Test that imports are persisted in batches through the journal"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 3
+        self.myfs.commit_interval = 3600
+        for i in range(5):
+            self.myfs.import_file(self._write_test_file(f'j{i}.txt', b'x'))
+
+        # Only the first full batch has been committed so far
+        self.assertEqual(sorted(self._reopen().metadata.files),
+                         ['j0.txt', 'j1.txt', 'j2.txt'])
+        self.myfs.close()
+        reopened = self._reopen()
+        self.assertEqual(sorted(reopened.metadata.files),
+                         [f'j{i}.txt' for i in range(5)])
+        self.assertEqual(b''.join(reopened._iter_file_chunks('j4.txt')), b'x')
+
+    def test_torn_journal_tail_is_discarded(self):
+        """Test that an interrupted commit only loses the torn record"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 1
+        self.myfs.import_file(self._write_test_file('kept.txt', b'kept'))
+        with open(self.volume_y_path, 'a') as f:
+            f.write('dG9ybiByZWNvcmQ')  # Partial line without newline
+
+        reopened = self._reopen()
+        self.assertEqual(list(reopened.metadata.files), ['kept.txt'])
+        reopened.commit_batch_size = 1
+        reopened.import_file(self._write_test_file('after.txt', b'after'))
+        self.assertEqual(sorted(self._reopen().metadata.files),
+                         ['after.txt', 'kept.txt'])
+
+    def test_corrupt_journal_record_is_not_truncated(self):
+        """Test that a corrupt record before the tail fails without data loss"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 1
+        for i in range(10):
+            self.myfs.import_file(self._write_test_file(f'f{i}.txt', b'f'))
+        with open(self.volume_y_path, 'rb') as f:
+            lines = f.readlines()
+        record = bytearray(lines[1 + 3])
+        record[len(record) // 2] ^= ord('A') ^ ord('B')
+        lines[1 + 3] = bytes(record)
+        with open(self.volume_y_path, 'wb') as f:
+            f.writelines(lines)
+        size = os.path.getsize(self.volume_y_path)
+
+        reopened = MyFS(self.volume_x_path, self.volume_y_path)
+        with self.assertRaises(ValueError):
+            reopened.open_myfs(self.system_password)
+        self.assertEqual(os.path.getsize(self.volume_y_path), size)
+
+    def test_journal_compaction(self):
+        """Test that a long journal is folded into a new snapshot"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 1
+        self.myfs.compact_threshold = 4
+        for i in range(6):
+            self.myfs.import_file(self._write_test_file(f'c{i}.txt', b'c'))
+
+        with open(self.volume_y_path) as f:
+            self.assertEqual(len(f.readlines()), 1 + 2)
+        self.assertEqual(len(self._reopen().metadata.files), 6)
+
+    def test_compaction_syncs_data_before_snapshot(self):
+        """Test that MyFS.Dat is durable before a snapshot replaces volume Y"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 100
+        self.myfs.import_file(self._write_test_file('s.txt', b's'))
+        events = []
+        sync_data = self.myfs._sync_data
+
+        def record_sync():
+            events.append('sync')
+            sync_data()
+
+        with mock.patch.object(self.myfs, '_sync_data', record_sync), \
+                mock.patch('myfs.os.replace',
+                           side_effect=lambda *args: events.append('replace')
+                           or os.rename(*args)):
+            self.myfs.compact()
+        self.assertEqual(events, ['sync', 'replace'])
+        self.assertEqual(list(self._reopen().metadata.files), ['s.txt'])
+
+    def test_import_many_roundtrip(self):
+        """Test that a pipelined bulk import matches the stored contents"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        contents = {f'm{i}.bin': os.urandom(size) for i, size in
+                    enumerate([0, 10, 1023, 1024, 5000, 3, 2048])}
+        paths = [self._write_test_file(name, content)
+                 for name, content in contents.items()]
+
+        self.assertEqual(self.myfs.import_many(paths, 'file_password',
+                                               workers=2), len(paths))
+
+        reopened = self._reopen()
+        for name, content in contents.items():
+            self.assertEqual(reopened.metadata.files[name]['size'],
+                             len(content))
+            self.assertEqual(b''.join(reopened._iter_file_chunks(
+                name, 'file_password')), content)
+
+    def test_import_directory_uses_relative_names(self):
+        """Test that a directory import names files by relative path"""
+        self.myfs.create_myfs(self.system_password)
+        os.makedirs(os.path.join(self.temp_dir, 'src', 'sub'))
+        self._write_test_file(os.path.join('src', 'a.txt'), b'a')
+        self._write_test_file(os.path.join('src', 'sub', 'b.txt'), b'b')
+
+        self.assertEqual(self.myfs.import_directory(
+            os.path.join(self.temp_dir, 'src')), 2)
+        self.assertEqual(sorted(self._reopen().metadata.files),
+                         ['a.txt', 'sub/b.txt'])
+
+    def test_names_cannot_escape_export_directory(self):
+        """Test that unsafe names are rejected on import and on export"""
+        self.myfs.create_myfs(self.system_password)
+        path = self._write_test_file('x.txt', b'x')
+        for name in ('../../x', 'sub/../../x', '/tmp/x', 'a//x', ''):
+            with self.assertRaises(ValueError):
+                self.myfs.import_many([('ok.txt', path), (name, path)])
+        self.assertEqual(self.myfs.metadata.files, {})
+
+        # A name stored by an older version is checked before the join
+        self.myfs.import_many([('ok.txt', path)])
+        self.myfs.metadata.files['../x'] = self.myfs.metadata.files['ok.txt']
+        out_dir = os.path.join(self.temp_dir, 'out', 'inner')
+        os.makedirs(out_dir)
+        with self.assertRaises(ValueError):
+            self.myfs.export_file('../x', out_dir)
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, 'out')),
+                         ['inner'])
+
+    def test_import_many_checks_capacity_first(self):
+        """Test that an oversized batch is rejected before writing"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.max_files = 2
+        paths = [self._write_test_file(f'f{i}.txt', b'f') for i in range(3)]
+        size = os.path.getsize(self.volume_x_path)
+
+        with self.assertRaises(ValueError):
+            self.myfs.import_many(paths)
+        self.assertEqual(self.myfs.metadata.files, {})
+        self.assertEqual(os.path.getsize(self.volume_x_path), size)
+
+    def test_import_many_keeps_files_before_failure(self):
+        """Test that files imported before a failing one are committed"""
+        self.myfs.create_myfs(self.system_password)
+        good = self._write_test_file('good.txt', b'good')
+        missing = os.path.join(self.temp_dir, 'missing.txt')
+
+        with self.assertRaises(FileNotFoundError):
+            self.myfs.import_many([good, missing])
+        reopened = self._reopen()
+        self.assertEqual(list(reopened.metadata.files), ['good.txt'])
+        self.assertEqual(b''.join(reopened._iter_file_chunks('good.txt')),
+                         b'good')
+
+    def test_range_read_decrypts_covering_chunks(self):
+        """Test that a range read decrypts only the chunks it overlaps"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        content = os.urandom(10000)
+        self.myfs.import_file(self._write_test_file('range.bin', content),
+                              'file_password')
+
+        for offset, length in [(0, 10), (1000, 100), (5000, 4096),
+                               (9990, 100), (0, None), (20000, 5)]:
+            end = None if length is None else offset + length
+            self.assertEqual(self.myfs.read('range.bin', offset, length,
+                                            'file_password'),
+                             content[offset:end])
+
+        with mock.patch.object(self.myfs, '_decrypt_chunk',
+                               wraps=self.myfs._decrypt_chunk) as decrypt:
+            self.myfs.read('range.bin', 5000, 100, 'file_password')
+            self.assertEqual([call.args[4] for call in decrypt.call_args_list],
+                             [4])
+        with self.assertRaises(FileNotFoundError):
+            self.myfs.read('missing.bin')
+
+    def test_chunk_cache_serves_repeated_reads(self):
+        """Test that cached chunks are reused but still need the password"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        self.myfs.chunk_cache_size = 2
+        content = os.urandom(4096)
+        self.myfs.import_file(self._write_test_file('cached.bin', content),
+                              'file_password')
+
+        with mock.patch.object(self.myfs, '_decrypt_chunk',
+                               wraps=self.myfs._decrypt_chunk) as decrypt:
+            for _ in range(3):
+                self.assertEqual(self.myfs.read('cached.bin', 1000, 100,
+                                                'file_password'),
+                                 content[1000:1100])
+            self.assertEqual(decrypt.call_count, 2)
+            # Reading a third chunk evicts the least recently used one
+            self.myfs.read('cached.bin', 3000, 10, 'file_password')
+            self.myfs.read('cached.bin', 0, 10, 'file_password')
+            self.assertEqual(decrypt.call_count, 4)
+
+        with self.assertRaises(PermissionError):
+            self.myfs.read('cached.bin', 1000, 100, 'wrong')
+
+    def test_chunk_cache_under_concurrent_reads(self):
+        """Test that readers sharing a small chunk cache do not race"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 256
+        self.myfs.chunk_cache_size = 3
+        content = os.urandom(256 * 16)
+        self.myfs.import_file(self._write_test_file('shared.bin', content))
+
+        class SlowCache(OrderedDict):
+            # Give other readers time to evict between get and move_to_end
+            def move_to_end(self, key, last=True):
+                time.sleep(0.0005)
+                super().move_to_end(key, last)
+
+        self.myfs._chunk_cache = SlowCache()
+
+        def read_ranges(seed):
+            rng = random.Random(seed)
+            for _ in range(100):
+                offset = rng.randrange(len(content))
+                if self.myfs.read('shared.bin', offset, 300) != \
+                        content[offset:offset + 300]:
+                    return False
+            return True
+
+        with ThreadPoolExecutor(8) as pool:
+            self.assertTrue(all(pool.map(read_ranges, range(8))))
+        self.assertLessEqual(len(self.myfs._chunk_cache), 3)
+
+    def test_read_sees_files_imported_after_mapping(self):
+        """Test that the MyFS.Dat mapping follows later imports"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.import_file(self._write_test_file('first.txt', b'first'))
+        self.assertEqual(self.myfs.read('first.txt'), b'first')
+        self.myfs.import_file(self._write_test_file('second.txt', b'second'))
+        self.assertEqual(self.myfs.read('second.txt', 2, 3), b'con')
+
+    def test_read_on_another_computer_is_rejected(self):
+        """Test that stored files cannot be decrypted on another computer"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.import_file(self._write_test_file('local.txt', b'local'))
+        out_dir = os.path.join(self.temp_dir, 'out')
+        os.mkdir(out_dir)
+
+        other = int(self.myfs.metadata.computer_id) ^ 1
+        with mock.patch('uuid.getnode', return_value=other):
+            with self.assertRaises(PermissionError):
+                self.myfs.read('local.txt')
+            with self.assertRaises(PermissionError):
+                self.myfs.export_file('local.txt', out_dir)
+        self.assertEqual(os.listdir(out_dir), [])
+        self.assertEqual(self.myfs.read('local.txt'), b'local')
+
+    def test_export_file(self):
+        """Test exporting a stored file to a path and into a directory"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        content = os.urandom(3000)
+        self.myfs.import_file(self._write_test_file('export.bin', content),
+                              'file_password')
+        out_dir = os.path.join(self.temp_dir, 'out')
+        os.mkdir(out_dir)
+
+        with self.assertRaises(PermissionError):
+            self.myfs.export_file('export.bin', out_dir, 'wrong')
+        self.assertEqual(os.listdir(out_dir), [])
+
+        path = self.myfs.export_file('export.bin', out_dir, 'file_password')
+        self.assertEqual(path, os.path.join(out_dir, 'export.bin'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_failed_export_cleans_up_only_its_output(self):
+        """Test that a failed export removes its output and nothing else"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.import_file(self._write_test_file('data.bin', b'd' * 100))
+        existing = self._write_test_file('existing.bin', b'keep')
+
+        with mock.patch('builtins.open', side_effect=PermissionError):
+            with self.assertRaises(PermissionError):
+                self.myfs.export_file('data.bin', existing)
+        self.assertTrue(os.path.exists(existing))
+
+        offset = self.myfs.metadata.files['data.bin']['chunks'][0][0]
+        with open(self.volume_x_path, 'r+b') as f:
+            f.seek(offset)
+            f.write(b'\x00')
+        destination = os.path.join(self.temp_dir, 'partial.bin')
+        with self.assertRaises(InvalidTag):
+            self.myfs.export_file('data.bin', destination)
+        self.assertFalse(os.path.exists(destination))
+
+    def test_extent_allocator(self):
+        """Test best-fit allocation, coalescing and shrinking the volume"""
+        allocator = ExtentAllocator.from_extents([[0, 10], [20, 10],
+                                                  [100, 10]], 120)
+        self.assertEqual(allocator.free_bytes, 10 + 70 + 10)
+        self.assertEqual(allocator.allocate(8), 10)  # Smallest fitting hole
+        self.assertEqual(allocator.allocate(40), 30)
+        self.assertEqual(allocator.allocate(100), 120)  # No hole fits
+        allocator.free(10, 8)
+        allocator.free(0, 10)
+        self.assertEqual(allocator.lowest_free, 0)
+        self.assertEqual(allocator.allocate_below(18, 20), 0)
+        self.assertIsNone(allocator.allocate_below(31, 100))
+        allocator.free(120, 100)  # Last extent: the volume shrinks
+        self.assertEqual(allocator.end, 110)
+        allocator.trim()
+        self.assertEqual(allocator.end, 110)
+
+    def _import_files(self, sizes):
+        contents = {}
+        for i, size in enumerate(sizes):
+            contents[f'e{i}.bin'] = os.urandom(size)
+            self.myfs.import_file(self._write_test_file(
+                f'e{i}.bin', contents[f'e{i}.bin']))
+        return contents
+
+    def test_delete_reuses_space_after_commit(self):
+        """Test that deleted extents are reused only once committed"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.commit_batch_size = 100
+        self.myfs.commit_interval = 3600
+        contents = self._import_files([3000, 3000])
+        self.myfs.commit()
+        size = os.path.getsize(self.volume_x_path)
+
+        self.myfs.delete_file('e0.bin')
+        self.assertNotIn('e0.bin', self.myfs.metadata.files)
+        # Uncommitted: the old chunks still back the durable metadata
+        self.myfs.import_file(self._write_test_file('new.bin', b'n' * 3000))
+        self.assertGreater(os.path.getsize(self.volume_x_path), size)
+        self.assertEqual(self._reopen().read('e0.bin'), contents['e0.bin'])
+
+        self.myfs.commit()
+        size = os.path.getsize(self.volume_x_path)
+        self.myfs.import_file(self._write_test_file('hole.bin', b'h' * 3000))
+        self.assertEqual(os.path.getsize(self.volume_x_path), size)
+        self.myfs.commit()
+        reopened = self._reopen()
+        self.assertEqual(sorted(reopened.metadata.files),
+                         ['e1.bin', 'hole.bin', 'new.bin'])
+        self.assertEqual(reopened.read('e1.bin'), contents['e1.bin'])
+        self.assertEqual(reopened.read('hole.bin'), b'h' * 3000)
+        with self.assertRaises(FileNotFoundError):
+            self.myfs.delete_file('e0.bin')
+
+    def test_delete_password_protected_file(self):
+        """Test that deleting a protected file needs its password"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.import_file(self._write_test_file('secret.txt', b's'),
+                              'file_password')
+        with self.assertRaises(PermissionError):
+            self.myfs.delete_file('secret.txt', 'wrong')
+        self.assertTrue(self.myfs.delete_file('secret.txt', 'file_password'))
+        self.myfs.close()
+        self.assertEqual(self._reopen().metadata.files, {})
+        self.assertEqual(os.path.getsize(self.volume_x_path), 0)
+
+    def test_overwrite_replaces_file_in_place(self):
+        """Test that importing an existing name replaces the stored file"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.max_files = 1
+        self.myfs.commit_batch_size = 1
+        path = self._write_test_file('same.txt', b'a' * 5000)
+        self.myfs.import_file(path)
+        size = os.path.getsize(self.volume_x_path)
+        self._write_test_file('same.txt', b'b' * 5000)
+        self.myfs.import_file(path)
+        self._write_test_file('same.txt', b'c' * 5000)
+        self.myfs.import_file(path)
+
+        self.assertLessEqual(os.path.getsize(self.volume_x_path), 2 * size)
+        self.assertEqual(self._reopen().read('same.txt'), b'c' * 5000)
+
+    def test_overwrite_needs_old_file_password(self):
+        """Test that a protected file is only replaced with its password"""
+        self.myfs.create_myfs(self.system_password)
+        path = self._write_test_file('secret.txt', b'original')
+        self.myfs.import_file(path, 'file_password')
+        self._write_test_file('secret.txt', b'replaced')
+
+        with self.assertRaises(PermissionError):
+            self.myfs.import_file(path)
+        with self.assertRaises(PermissionError):
+            self.myfs.import_many([path], 'wrong')
+        self.assertEqual(self.myfs.read('secret.txt', 0, None,
+                                        'file_password'), b'original')
+
+        self.myfs.import_file(path, old_password='file_password')
+        self.assertEqual(self.myfs.read('secret.txt'), b'replaced')
+
+    def test_compact_data_relocates_live_chunks(self):
+        """Test that compaction packs MyFS.Dat down to the live chunks"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        contents = self._import_files([4000, 3000, 5000, 100])
+        stale = self.myfs._open_file('e2.bin')
+        self.myfs.delete_file('e0.bin')
+        self.myfs.delete_file('e1.bin')
+        self.myfs.commit()
+        del contents['e0.bin'], contents['e1.bin']
+
+        moved = self.myfs.compact_data(max_bytes=1)
+        self.assertGreater(moved, 0)
+        self.assertGreater(self.myfs.compact_data(), 0)
+        self.assertEqual(self.myfs.compact_data(), 0)
+
+        live = sum(length for file_metadata in
+                   self.myfs.metadata.files.values()
+                   for _, length in file_metadata['chunks'])
+        self.assertEqual(os.path.getsize(self.volume_x_path), live)
+        # A reader holding metadata from before the move still finds it
+        self.assertEqual(b''.join(self.myfs._decrypt_chunk('e2.bin', *stale,
+                                                           index)
+                                  for index in range(5)),
+                         contents['e2.bin'])
+        reopened = self._reopen()
+        for name, content in contents.items():
+            self.assertEqual(self.myfs.read(name), content)
+            self.assertEqual(reopened.read(name), content)
+
+    def test_background_compactor(self):
+        """Test that the background compactor shrinks MyFS.Dat"""
+        self.myfs.create_myfs(self.system_password)
+        self.myfs.chunk_size = 1024
+        contents = self._import_files([6000, 6000])
+        self.myfs.delete_file('e0.bin')
+        self.myfs.commit()
+        size = os.path.getsize(self.volume_x_path)
+
+        self.myfs.start_compactor(interval=0.01, max_bytes=1024)
+        deadline = time.monotonic() + 10
+        while (os.path.getsize(self.volume_x_path) >= size and
+               time.monotonic() < deadline):
+            self.assertEqual(self.myfs.read('e1.bin'), contents['e1.bin'])
+            time.sleep(0.01)
+        self.myfs.stop_compactor()
+
+        self.assertLess(os.path.getsize(self.volume_x_path), size)
+        self.assertEqual(self._reopen().read('e1.bin'), contents['e1.bin'])
+
 def run_tests():
     """Run all tests and provide a detailed report"""
     suite = unittest.TestLoader().loadTestsFromTestCase(TestMyFSFileSystem)